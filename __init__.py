@@ -15,13 +15,21 @@ from .operators import (
     FinishOnboardingOperator,
     DS_OpenDocumentationOperator,
     OpenOutputFolderOperator,
+    ExportTimingsOperator,
+    BenchmarkResultLoadingOperator,
+    HistoryPageOperator,
+    OpenHistoryEntryOperator,
+    FreeUnusedImagesOperator,
     SceneRenderExistingOutputOperator,
     SceneRenderViewportOperator,
     UseRenderFolderOperator,
     StateOperator,
     CancelRenderOperator,
     ContinueRenderOperator,
+    ResumeJobOperator,
     RenderOperator,
+    ShardedRenderOperator,
+    BatchTextureOperator,
     DS_OpenPresetsFileOperator,
 )
 from bpy.app.handlers import persistent
@@ -34,14 +42,22 @@ from .ui import (
     RenderOptionsPanelSection3DEditor,
     RenderOptionsPanelSectionImageEditor,
     AdvancedOptionsPanelSectionImageEditor,
+    PerformancePanelSection3DEditor,
+    PerformancePanelSectionImageEditor,
+    HistoryPanelSection3DEditor,
+    HistoryPanelSectionImageEditor,
 )
 from . import addon_updater_ops
 from .dependencies import check_dependencies_installed
 import getpass
 
 from .data import (
+    FRAME_SELECTIONS,
+    HISTORY_FILTERS,
     INIT_TYPES,
+    KEYFRAME_MODES,
     OUTPUT_LOCATIONS,
+    VIDEO_OUTPUTS,
     APIType,
     Engine,
     InitType,
@@ -51,6 +67,13 @@ from .data import (
     get_image_size_options,
     initialize_sentry,
 )
+from .frame_conversion import shutdown_conversion_pool
+from .render_capture import register_capture_handlers, unregister_capture_handlers
+from .gallery import history_gallery
+from .history import close_history_store
+from .frame_index import FrameSelection
+from .frame_plan import KeyframeMode
+from .video import VideoOutput
 from .prompt_list import (
     PromptList_NewItem,
     PromptList_RemoveItem,
@@ -59,6 +82,7 @@ from .prompt_list import (
     register_presets,
 )
 
+
 # Update the entire UI when this property changes.
 def ui_update(self, context):
     for region in context.area.regions:
@@ -66,6 +90,11 @@ def ui_update(self, context):
     return None
 
 
+# A new search starts from the newest results.
+def reset_history_page(self, context):
+    self.history_page = 0
+
+
 bl_info = {
     "name": "Stability for Blender",
     "author": "Stability AI",
@@ -118,7 +147,8 @@ class StabilitySettings(bpy.types.PropertyGroup):
     generation_engine: EnumProperty(
         name="Engine",
         items=engine_to_blender_enum(),
-        default=Engine.GENERATE_512_2_1.value,
+        # The engine requests were sent to before it could be chosen, so existing scenes keep their results.
+        default=Engine.GENERATE_1_5.value,
         description="The model and configuration options used for generation",
     )
     use_custom_seed: BoolProperty(
@@ -181,6 +211,159 @@ class StabilitySettings(bpy.types.PropertyGroup):
         description="The location to save the output image. The default is to open the result as a new image in the image editor. The other options are to output the images to the file system, and open the explorer to the image when diffusion is complete, or replace the existing image in the image editor.",
     )
 
+    frame_selection: EnumProperty(
+        name="Frames",
+        items=FRAME_SELECTIONS,
+        default=FrameSelection.SCENE_RANGE.name,
+        description="Which frames of the animation to generate",
+    )
+    frame_list: StringProperty(
+        name="Frame List",
+        default="",
+        description="Frames and ranges to generate, separated by commas. A range can have a step, e.g. 1-100, 120, 200-300:5",
+    )
+    frame_selection_stride: IntProperty(
+        name="Every Nth Frame",
+        default=1,
+        min=1,
+        max=100,
+        description="Generate only every Nth of the selected frames, e.g. for a quick preview of a long animation",
+    )
+    keyframe_mode: EnumProperty(
+        name="Generate",
+        items=KEYFRAME_MODES,
+        default=KeyframeMode.ALL.name,
+        description="Which animation frames are sent to the API. Frames that aren't sent are interpolated locally from the generated frames around them",
+    )
+    keyframe_stride: IntProperty(
+        name="Keyframe Interval",
+        default=4,
+        min=2,
+        max=30,
+        description="Generate every Nth frame. In adaptive mode, the most frames allowed between two generated frames",
+    )
+    keyframe_change_threshold: FloatProperty(
+        name="Change Threshold",
+        default=0.05,
+        min=0.001,
+        max=1,
+        description="How much the init frames have to change, as an average pixel difference since the last generated frame, before a new frame is generated",
+    )
+    interpolation_guidance: FloatProperty(
+        name="Init Guidance",
+        default=0.5,
+        min=0,
+        max=1,
+        description="How much of the motion in the init frames is added to interpolated frames. 0 is a plain cross-fade between the generated frames",
+    )
+
+    skip_duplicate_frames: BoolProperty(
+        name="Reuse Duplicate Frames",
+        default=False,
+        description="Compare the init frames before generating, and reuse the result of the last generated frame for frames that look the same, such as in static shots. The mapping is saved to frame_plan.json in the output folder",
+    )
+    duplicate_frame_tolerance: IntProperty(
+        name="Duplicate Tolerance",
+        default=2,
+        min=0,
+        max=16,
+        description="How many of the 64 perceptual hash bits may differ for a frame to count as a duplicate. 0 only matches frames that look identical",
+    )
+
+    incremental_generation: BoolProperty(
+        name="Only Regenerate Changed Frames",
+        default=False,
+        description="Keep the results of the last run, and only regenerate frames whose init frame or keyframed settings changed. All frames are regenerated when the engine, sampler or frames directory change",
+    )
+
+    video_output: EnumProperty(
+        name="Video",
+        items=VIDEO_OUTPUTS,
+        default=VideoOutput.NONE.name,
+        description="Encode the generated frames into a video with ffmpeg while the animation is generated. Requires ffmpeg on the PATH",
+    )
+
+    show_live_preview: BoolProperty(
+        name="Show Frames in Sequencer",
+        default=False,
+        description="Add the generated frames to an image strip in the sequencer as they complete, so the animation can be scrubbed while it is generated. Frames that aren't done yet hold the last finished frame",
+    )
+
+    shard_count: IntProperty(
+        name="Background Processes",
+        default=2,
+        min=1,
+        max=16,
+        description="How many background Blender processes to split the animation's frame range across. Each process sends its own concurrent requests",
+    )
+
+    max_concurrent_requests: IntProperty(
+        name="Concurrent Requests",
+        default=2,
+        min=1,
+        max=8,
+        description="How many animation frames, tiles of a tiled image, or textures of a batch are sent to the API at the same time. The next frames are prepared while these are in flight",
+    )
+
+    use_credit_budget: BoolProperty(
+        name="Limit Spending",
+        default=False,
+        description="Pause animation jobs once they have spent the credit budget. Paused jobs can be resumed after raising the budget",
+    )
+    credit_budget: FloatProperty(
+        name="Budget",
+        default=100,
+        min=0,
+        description="The maximum number of credits a single job may spend, including any earlier runs of a resumed job",
+    )
+
+    use_preview_generation: BoolProperty(
+        name="Preview First",
+        default=False,
+        description="Generate a fast, low resolution preview with the same seed before the full quality image, so the prompt can be checked before paying for the full generation",
+    )
+    preview_auto_continue: BoolProperty(
+        name="Continue Automatically",
+        default=False,
+        description="Start the full quality generation right after the preview is shown, instead of waiting for confirmation",
+    )
+
+    use_tiled_generation: BoolProperty(
+        name="Tiled Generation",
+        default=False,
+        description="Generate init images over 1 megapixel as overlapping tiles, sent concurrently with the same seed and blended back together. Each tile is charged as its own generation",
+    )
+    tile_size: IntProperty(
+        name="Tile Size",
+        default=896,
+        min=512,
+        max=960,
+        step=64,
+        description="Largest side of each tile, in pixels. Tiles have to stay within the 1 megapixel limit",
+    )
+    tile_overlap: IntProperty(
+        name="Tile Overlap",
+        default=128,
+        min=32,
+        max=256,
+        description="How many pixels neighbouring tiles share at least. Tiles are blended across the overlap, so larger overlaps hide seams better but need more tiles",
+    )
+
+    history_search: StringProperty(
+        name="Search",
+        default="",
+        description="Show only generations whose prompt contains these words",
+        update=reset_history_page,
+    )
+    history_filter: EnumProperty(
+        name="Show",
+        items=HISTORY_FILTERS,
+        default="ALL",
+        description="Which kind of generations to show",
+        update=reset_history_page,
+    )
+    history_page: IntProperty(name="Page", default=0, min=0)
+
     current_time: FloatProperty(name="Current Time", default=0, update=ui_update)
 
 
@@ -206,6 +389,34 @@ class StabilityPreferences(AddonPreferences):
         default=APIType.REST.value,
     )
 
+    output_root: StringProperty(
+        name="Output Folder",
+        subtype="DIR_PATH",
+        default="",
+        description="Where renders and results are written, each run in its own folder. A fast local disk helps with long animations. Defaults to the system temp folder",
+    )
+
+    retention_max_runs: IntProperty(
+        name="Keep Runs",
+        default=20,
+        min=0,
+        description="How many runs of each kind to keep. Older runs are removed in the background when a new run starts. 0 keeps every run",
+    )
+
+    retention_max_age_days: IntProperty(
+        name="Keep Days",
+        default=0,
+        min=0,
+        description="Remove runs older than this many days. 0 keeps runs regardless of age",
+    )
+
+    retention_max_size_gb: FloatProperty(
+        name="Max Size (GB)",
+        default=0,
+        min=0,
+        description="Remove the oldest runs once all runs together take more than this much disk space. 0 is no limit",
+    )
+
     auto_check_update = bpy.props.BoolProperty(
         name="Auto-check for Update",
         description="If enabled, auto-check for updates using an interval",
@@ -252,6 +463,11 @@ class StabilityPreferences(AddonPreferences):
             GetAPIKeyOperator.bl_idname, text="Get your API key here", icon="URL"
         )
         layout.prop(self, "base_url")
+        layout.prop(self, "output_root")
+        retention_row = layout.row()
+        retention_row.prop(self, "retention_max_runs")
+        retention_row.prop(self, "retention_max_age_days")
+        retention_row.prop(self, "retention_max_size_gb")
         layout.prop(self, "record_analytics")
         layout.operator(
             FinishOnboardingOperator.bl_idname,
@@ -276,6 +492,9 @@ registered_operators = [
     StabilityImageEditorPanel,
     CancelRenderOperator,
     ContinueRenderOperator,
+    ResumeJobOperator,
+    ShardedRenderOperator,
+    BatchTextureOperator,
     SceneRenderExistingOutputOperator,
     SceneRenderViewportOperator,
     StateOperator,
@@ -284,9 +503,18 @@ registered_operators = [
     RenderOptionsPanelSectionImageEditor,
     AdvancedOptionsPanelSection3DEditor,
     AdvancedOptionsPanelSectionImageEditor,
+    PerformancePanelSection3DEditor,
+    PerformancePanelSectionImageEditor,
+    HistoryPanelSection3DEditor,
+    HistoryPanelSectionImageEditor,
     FinishOnboardingOperator,
     GetAPIKeyOperator,
     OpenOutputFolderOperator,
+    ExportTimingsOperator,
+    BenchmarkResultLoadingOperator,
+    HistoryPageOperator,
+    OpenHistoryEntryOperator,
+    FreeUnusedImagesOperator,
     UseRenderFolderOperator,
     DS_OpenPresetsFileOperator,
 ]
@@ -315,6 +543,7 @@ def register():
     register_presets()
 
     bpy.app.handlers.load_post.append(file_loaded)
+    register_capture_handlers()
 
     for op in prompt_list_operators:
         bpy.utils.register_class(op)
@@ -341,9 +570,13 @@ def register():
 
 
 def unregister():
+    shutdown_conversion_pool()
+    history_gallery.release()
+    close_history_store()
     for op in registered_operators + prompt_list_operators:
         bpy.utils.unregister_class(op)
     del bpy.types.Scene.ds_settings
     bpy.utils.unregister_class(StabilityPreferences)
     addon_updater_ops.unregister()
     bpy.app.handlers.load_post.remove(file_loaded)
+    unregister_capture_handlers()
@@ -0,0 +1,228 @@
+from enum import Enum
+import io
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from .budget import CreditBudget
+from .datablocks import convert_channels
+from .frame_conversion import srgb_to_linear
+from .history import GenerationKind, HistoryStore
+from .imaging import get_lanczos_filter, load_resized_png
+from .pipeline import Pipeline
+from .requests import DEFAULT_ENGINE_NAME, generate_img2img, write_result_image
+
+# Image files the init image is read from directly. Anything else is read from the image's pixels.
+DIRECT_INIT_EXTENSIONS = {".png", ".jpg", ".jpeg", ".bmp", ".tga", ".tif", ".tiff"}
+
+
+class BatchStatus(Enum):
+    PENDING = 1
+    RUNNING = 2
+    DONE = 3
+    FAILED = 4
+
+
+# One image texture of a batch job. The init image is either a file on disk, or the image's pixels read on
+# the main thread, as 8 bit RGBA rows from the bottom up. The result is resized to the texture's own size
+# and converted to its channels, so the main thread only has to copy it in.
+class BatchItem:
+    def __init__(
+        self,
+        index: int,
+        image_name: str,
+        width: int,
+        height: int,
+        channels: int,
+        is_float: bool,
+        init_path: str = None,
+        init_pixels=None,
+    ):
+        self.index = index
+        self.image_name = image_name
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.is_float = is_float
+        self.init_path = init_path
+        self.init_pixels = init_pixels
+        self.status = BatchStatus.PENDING
+        self.error: Optional[str] = None
+        self.cost = 0.0
+        self.started_at = 0.0
+        # Filled in by the pipeline stages.
+        self.init_image: bytes = None
+        self.result: bytes = None
+        self.output_path: str = None
+        # Flat float32 pixels to write into the image, ready for foreach_set.
+        self.result_pixels = None
+
+
+def safe_filename(name: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", name).strip("_") or "texture"
+
+
+# Encode pixels read from an image as the upload PNG of the given size.
+def encode_init_pixels(pixels, width: int, height: int) -> bytes:
+    from PIL import Image
+
+    img = Image.fromarray(pixels[::-1], "RGBA").convert("RGB")
+    if img.size != (width, height):
+        img = img.resize((width, height), get_lanczos_filter())
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+# Decode a result into the pixels of a texture: its size, bottom row first, in its channel count, and in
+# linear color for float images.
+def decode_result_pixels(data: bytes, item: BatchItem):
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert("RGBA")
+        if img.size != (item.width, item.height):
+            img = img.resize((item.width, item.height), get_lanczos_filter())
+        pixels = np.asarray(img)[::-1].astype(np.float32) / 255
+    if item.is_float:
+        pixels[..., :3] = srgb_to_linear(pixels[..., :3])
+    return convert_channels(pixels.ravel(), 4, item.channels)
+
+
+# Generates every texture of a batch with the same args, several at a time. A texture that fails doesn't
+# stop the others. Completed textures are handed to the main thread, which writes them into their images.
+class BatchTextureJob:
+    def __init__(
+        self,
+        items: List[BatchItem],
+        args: dict,
+        output_directory: str,
+        concurrency: int,
+        credit_budget: CreditBudget,
+        history: HistoryStore = None,
+    ):
+        self.items = items
+        self.args = args
+        self.output_directory = output_directory
+        self.concurrency = max(1, concurrency)
+        self.credit_budget = credit_budget
+        self.history = history
+        self.lock = threading.Lock()
+        self.completed: List[BatchItem] = []
+        self.pipeline: Pipeline = None
+        self.thread: threading.Thread = None
+        self.error: Optional[Exception] = None
+
+    def start(self):
+        self.pipeline = Pipeline()
+        self.pipeline.add_stage(
+            "prepare",
+            self.prepare,
+            workers=self.concurrency,
+            queue_size=self.concurrency,
+        )
+        self.pipeline.add_stage(
+            "request",
+            self.send_request,
+            workers=self.concurrency,
+            queue_size=self.concurrency,
+        )
+        self.pipeline.add_stage("write", self.write_output, queue_size=self.concurrency)
+        self.thread = threading.Thread(
+            target=self.run, name="batch-textures", daemon=True
+        )
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.pipeline.run(self.items)
+        except Exception as e:
+            self.error = e
+
+    def cancel(self):
+        if self.pipeline:
+            self.pipeline.stop()
+
+    @property
+    def finished(self) -> bool:
+        return self.thread is not None and not self.thread.is_alive()
+
+    def fail(self, item: BatchItem, error: str):
+        item.status = BatchStatus.FAILED
+        item.error = error
+        item.init_image = item.init_pixels = item.result = None
+        print(f"Could not generate {item.image_name}: {error}")
+
+    def prepare(self, item: BatchItem):
+        width, height = self.args["width"], self.args["height"]
+        try:
+            if item.init_path:
+                item.init_image = load_resized_png(item.init_path, width, height)
+            else:
+                item.init_image = encode_init_pixels(item.init_pixels, width, height)
+        except Exception as e:
+            self.fail(item, f"Could not read the texture: {e}")
+            return None
+        item.init_pixels = None
+        return item
+
+    def send_request(self, item: BatchItem):
+        if not self.credit_budget.reserve(item.cost):
+            self.fail(item, "Over the credit limit.")
+            return None
+        item.status = BatchStatus.RUNNING
+        item.started_at = time.perf_counter()
+        try:
+            status, reason, item.result = generate_img2img(item.init_image, self.args)
+        except Exception as e:
+            self.credit_budget.release(item.cost)
+            self.fail(item, str(e))
+            return None
+        item.init_image = None
+        if status != 200:
+            self.credit_budget.release(item.cost)
+            self.fail(item, f"{status} {reason}")
+            return None
+        self.credit_budget.commit(item.cost)
+        return item
+
+    def write_output(self, item: BatchItem):
+        item.output_path = os.path.join(
+            self.output_directory,
+            "{:03d}_{}.png".format(item.index, safe_filename(item.image_name)),
+        )
+        try:
+            write_result_image(item.output_path, item.result)
+            item.result_pixels = decode_result_pixels(item.result, item)
+        except Exception as e:
+            self.fail(item, f"Could not decode the result: {e}")
+            return None
+        item.result = None
+        if self.history:
+            try:
+                self.history.record(
+                    GenerationKind.IMAGE,
+                    self.args,
+                    item.output_path,
+                    cost=item.cost,
+                    duration=time.perf_counter() - item.started_at,
+                    engine=self.args.get("engine", DEFAULT_ENGINE_NAME),
+                )
+            except sqlite3.Error as e:
+                print(f"Could not record the generation in the history: {e}")
+        with self.lock:
+            self.completed.append(item)
+        return None
+
+    # Textures generated since the last call, for the main thread to write into their images.
+    def take_completed(self) -> List[BatchItem]:
+        with self.lock:
+            completed, self.completed = self.completed, []
+        return completed
+
+    def count(self, status: BatchStatus) -> int:
+        return sum(1 for item in self.items if item.status == status)
@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+from typing import List, Optional
+
+CHECKPOINT_FILENAME = "job_checkpoint.json"
+
+
+# Tracks the credits spent by a single run against a spending limit. Credits are reserved before a frame
+# is dispatched, and either committed once it succeeds or released if it fails, so the limit holds even
+# with several requests in flight.
+class CreditBudget:
+    def __init__(self, limit: Optional[float]):
+        # None means there is no limit.
+        self.limit = limit
+        self.spent = 0.0
+        self.reserved = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self, cost: float) -> bool:
+        with self.lock:
+            if (
+                self.limit is not None
+                and self.spent + self.reserved + cost > self.limit
+            ):
+                return False
+            self.reserved += cost
+            return True
+
+    def commit(self, cost: float):
+        with self.lock:
+            self.reserved = max(0.0, self.reserved - cost)
+            self.spent += cost
+
+    def release(self, cost: float):
+        with self.lock:
+            self.reserved = max(0.0, self.reserved - cost)
+
+    # How many more frames of the given cost fit in the remaining budget.
+    def affordable_frames(self, frame_cost: float) -> Optional[int]:
+        if self.limit is None or frame_cost <= 0:
+            return None
+        with self.lock:
+            remaining = self.limit - self.spent - self.reserved
+        return max(0, int(remaining // frame_cost))
+
+
+# Resumable record of an animation job, stored next to the generated frames. Saved after every completed
+# frame, so a job that is paused or cancelled can pick up where it left off.
+class JobCheckpoint:
+    def __init__(
+        self,
+        output_directory: str,
+        frames_directory: str = "",
+        frames: List[int] = None,
+    ):
+        self.output_directory = output_directory
+        self.frames_directory = frames_directory
+        # Frame numbers the job generates.
+        self.frames = list(frames or [])
+        self.completed_frames = set()
+        self.spent_credits = 0.0
+        self.paused_for_budget = False
+        self.lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.output_directory, CHECKPOINT_FILENAME)
+
+    @property
+    def total_frames(self) -> int:
+        return len(self.frames)
+
+    # Frames of the job that haven't completed, e.g. because their request failed.
+    @property
+    def failed_frames(self) -> List[int]:
+        with self.lock:
+            return [f for f in self.frames if f not in self.completed_frames]
+
+    @property
+    def remaining_frames(self) -> int:
+        return max(0, self.total_frames - len(self.completed_frames))
+
+    def mark_completed(self, frame_idx: int, cost: float):
+        with self.lock:
+            self.completed_frames.add(frame_idx)
+            self.spent_credits += cost
+
+    def save(self):
+        with self.lock:
+            payload = {
+                "frames_directory": self.frames_directory,
+                "frames": self.frames,
+                "completed_frames": sorted(self.completed_frames),
+                "spent_credits": self.spent_credits,
+                "paused_for_budget": self.paused_for_budget,
+            }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, self.path)
+
+    @classmethod
+    def load(cls, output_directory: str) -> Optional["JobCheckpoint"]:
+        path = os.path.join(output_directory, CHECKPOINT_FILENAME)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                payload = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Could not read job checkpoint {path}: {e}")
+            return None
+        checkpoint = cls(
+            output_directory,
+            payload.get("frames_directory", ""),
+            payload.get("frames", []),
+        )
+        checkpoint.completed_frames = set(payload.get("completed_frames", []))
+        checkpoint.spent_credits = payload.get("spent_credits", 0.0)
+        checkpoint.paused_for_budget = payload.get("paused_for_budget", False)
+        return checkpoint
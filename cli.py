@@ -0,0 +1,386 @@
+# Headless entry point for animation jobs, for scripting large jobs on render nodes without the UI:
+#
+#   blender -b scene.blend --python-expr "import <addon module>.cli as cli; cli.run()" -- --job job.json
+#   blender -b scene.blend --python path/to/addon/cli.py -- --job job.json
+#
+# The job spec is a JSON file; any of its keys can also be given (or overridden) on the command line:
+#
+#   {
+#     "frames_dir": "/renders/shot_010",
+#     "prompts": ["a watercolor city", {"text": "blurry", "weight": -0.5}],
+#     "engine": "stable-diffusion-512-v2-1",
+#     "concurrency": 4,
+#     "output_dir": "/renders/shot_010_dream",
+#     "state_dir": "/renders/shot_010_dream",
+#     "frame_start": 1,
+#     "frame_end": 240,
+#     "frames": "1-100, 120, 200-300:5",
+#     "stride": 2,
+#     "failed_only": false,
+#     "resume": false,
+#     "api_key": "...",
+#     "settings": {"init_strength": 0.6, "keyframe_mode": "STRIDE"}
+#   }
+#
+# Init frames are matched by the scene's output file format, as in the UI. The checkpoint, frame plan and
+# generation index are kept in state_dir, which defaults to output_dir. "frames" (a frame list, or a JSON list
+# of frame numbers) generates those frames instead of the scene's frame range, "stride" every nth of the
+# selected frames, and "failed_only" only the frames that didn't complete in the last run. "settings" sets
+# any other generation setting by name. The API key falls back to the STABILITY_API_KEY environment variable, then to
+# the addon preferences. Progress is written to stdout as one JSON object per line.
+# Generated frames are added to the generation history, as in the UI, including those of multi-process jobs.
+import argparse
+from enum import Enum
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+
+if __name__ == "__main__" and not __package__:
+    # Run as a script: import the addon package this file is part of, so its relative imports resolve.
+    addon_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.dirname(addon_dir))
+    importlib.import_module(os.path.basename(addon_dir) + ".cli").run()
+
+import bpy
+
+from .data import (
+    API_KEY_ENV_VAR,
+    InitType,
+    RenderState,
+    UIContext,
+    engine_enum_to_name,
+    format_rest_args,
+    get_credit_limit,
+    get_preferences,
+)
+from .frame_index import FrameSelection, format_frame_list, parse_frame_list
+from .metrics import start_job_metrics
+from .operators import (
+    GeneratorWorker,
+    StateOperator,
+    open_history,
+    prepare_animation_job,
+)
+
+# How often a progress line is written while no frame completes.
+HEARTBEAT_INTERVAL = 10.0
+
+
+class ExitCode(Enum):
+    SUCCESS = 0
+    # A request or the pipeline failed. Completed frames are kept, and the job can be resumed.
+    FAILED = 1
+    # The job spec or command line is invalid.
+    INVALID_JOB = 2
+    # The credit budget ran out before every frame was generated. Resume with a higher budget.
+    PAUSED = 3
+    INTERRUPTED = 130
+
+
+class InvalidJobError(Exception):
+    pass
+
+
+# Writes progress events to stdout as JSON lines. Called from the generation threads.
+class ProgressReporter:
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.lock = threading.Lock()
+        self.last_event_at = time.time()
+        # Checkpoint of the running job, which frame events count completed frames from.
+        self.checkpoint = None
+
+    def emit(self, event: str, **fields):
+        line = json.dumps({"event": event, "time": round(time.time(), 3), **fields})
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+            self.last_event_at = time.time()
+
+    def frame_done(self, planned_frame):
+        self.emit(
+            "frame",
+            index=planned_frame.index,
+            frame=planned_frame.frame,
+            source=planned_frame.source.name.lower(),
+            output=planned_frame.output_path,
+            completed=len(self.checkpoint.completed_frames),
+            total=self.checkpoint.total_frames,
+        )
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="cli.py", description="Run a Stability animation job without the UI."
+    )
+    parser.add_argument("--job", help="Path to a JSON job spec.")
+    parser.add_argument("--frames-dir", dest="frames_dir")
+    parser.add_argument(
+        "--prompt",
+        dest="prompts",
+        action="append",
+        help="Prompt text, optionally followed by :weight. Can be repeated.",
+    )
+    parser.add_argument("--engine")
+    parser.add_argument("--concurrency", type=int)
+    parser.add_argument("--output-dir", dest="output_dir")
+    parser.add_argument(
+        "--state-dir",
+        dest="state_dir",
+        help="Where the checkpoint and frame plan are kept. Defaults to the output dir.",
+    )
+    parser.add_argument("--frame-start", dest="frame_start", type=int)
+    parser.add_argument("--frame-end", dest="frame_end", type=int)
+    parser.add_argument(
+        "--frames", help="Frames and ranges to generate, e.g. 1-100,120,200-300:5."
+    )
+    parser.add_argument("--stride", type=int)
+    parser.add_argument(
+        "--failed-only", dest="failed_only", action="store_true", default=None
+    )
+    parser.add_argument("--resume", action="store_true", default=None)
+    parser.add_argument("--api-key", dest="api_key")
+    return parser.parse_args(argv)
+
+
+def parse_prompt(prompt) -> dict:
+    if isinstance(prompt, dict):
+        if "text" not in prompt:
+            raise InvalidJobError(f"Prompt {prompt} has no text")
+        return {"text": str(prompt["text"]), "weight": float(prompt.get("weight", 1))}
+    text, _, weight = str(prompt).rpartition(":")
+    try:
+        if text:
+            return {"text": text, "weight": float(weight)}
+    except ValueError:
+        pass
+    return {"text": str(prompt), "weight": 1.0}
+
+
+# Merge the job spec file with the command line arguments, and check it.
+def load_job_spec(args) -> dict:
+    spec = {}
+    if args.job:
+        try:
+            with open(args.job) as f:
+                spec = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise InvalidJobError(f"Could not read job spec {args.job}: {e}")
+        if not isinstance(spec, dict):
+            raise InvalidJobError("The job spec must be a JSON object")
+    for key, value in vars(args).items():
+        if key != "job" and value is not None:
+            spec[key] = value
+
+    for key in ["frames_dir", "output_dir"]:
+        if not spec.get(key):
+            raise InvalidJobError(f"Missing {key} in the job spec")
+    spec["frames_dir"] = os.path.abspath(os.path.expanduser(spec["frames_dir"]))
+    spec["output_dir"] = os.path.abspath(os.path.expanduser(spec["output_dir"]))
+    spec["state_dir"] = os.path.abspath(
+        os.path.expanduser(spec.get("state_dir") or spec["output_dir"])
+    )
+    if not os.path.isdir(spec["frames_dir"]):
+        raise InvalidJobError(f"Frames directory {spec['frames_dir']} does not exist")
+    spec["prompts"] = [parse_prompt(p) for p in spec.get("prompts") or []]
+    if not spec["prompts"]:
+        raise InvalidJobError("The job spec needs at least one prompt")
+
+    engine = spec.get("engine")
+    if engine:
+        engine_names = {e.name: name for e, name in engine_enum_to_name.items()}
+        engine = engine_names.get(engine, engine)
+        if engine not in engine_enum_to_name.values():
+            raise InvalidJobError(
+                "Unknown engine {}, expected one of: {}".format(
+                    engine, ", ".join(engine_enum_to_name.values())
+                )
+            )
+        spec["engine"] = engine
+    if "concurrency" in spec and int(spec["concurrency"]) < 1:
+        raise InvalidJobError("Concurrency must be at least 1")
+    if not isinstance(spec.get("settings", {}), dict):
+        raise InvalidJobError("settings must be a JSON object")
+    frames = spec.get("frames")
+    if isinstance(frames, list):
+        frames = format_frame_list(int(f) for f in frames)
+    if frames is not None:
+        try:
+            if not parse_frame_list(str(frames)):
+                raise ValueError("The frame list is empty")
+        except ValueError as e:
+            raise InvalidJobError(f"Invalid frames: {e}")
+        spec["frames"] = str(frames)
+    if "stride" in spec and int(spec["stride"]) < 1:
+        raise InvalidJobError("Stride must be at least 1")
+    return spec
+
+
+# Set up the scene's generation settings and prompts from the job spec.
+def apply_job_spec(scene, spec: dict):
+    settings = scene.ds_settings
+    settings.init_type = InitType.ANIMATION.name
+    settings.init_animation_folder_path = spec["frames_dir"]
+    if spec.get("engine"):
+        settings.generation_engine = spec["engine"]
+    if spec.get("concurrency"):
+        settings.max_concurrent_requests = int(spec["concurrency"])
+    for name, value in spec.get("settings", {}).items():
+        if name not in settings.bl_rna.properties:
+            raise InvalidJobError(f"Unknown generation setting {name}")
+        try:
+            setattr(settings, name, value)
+        except (TypeError, ValueError) as e:
+            raise InvalidJobError(f"Invalid value for {name}: {e}")
+    if spec.get("frame_start") is not None:
+        scene.frame_start = int(spec["frame_start"])
+    if spec.get("frame_end") is not None:
+        scene.frame_end = int(spec["frame_end"])
+    if spec.get("failed_only"):
+        settings.frame_selection = FrameSelection.FAILED.name
+    elif spec.get("frames"):
+        settings.frame_selection = FrameSelection.CUSTOM.name
+        settings.frame_list = spec["frames"]
+    if spec.get("stride"):
+        settings.frame_selection_stride = int(spec["stride"])
+    scene.prompt_list.clear()
+    for prompt in spec["prompts"]:
+        item = scene.prompt_list.add()
+        item.prompt = prompt["text"]
+        item.strength = prompt["weight"]
+
+
+# The addon has to be enabled for its settings and preferences to exist; background Blender only loads the
+# addons that are enabled in the user preferences.
+def ensure_addon_enabled():
+    if hasattr(bpy.types.Scene, "ds_settings") and get_preferences():
+        return
+    import addon_utils
+
+    addon_utils.enable(__package__, default_set=True)
+
+
+# Run an animation job from the job spec, blocking until it's done. Returns the process exit code.
+def main(argv=None) -> int:
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+    reporter = ProgressReporter()
+    try:
+        spec = load_job_spec(parse_args(argv))
+        ensure_addon_enabled()
+        scene = bpy.context.scene
+        apply_job_spec(scene, spec)
+    except InvalidJobError as e:
+        reporter.emit("error", message=str(e))
+        return ExitCode.INVALID_JOB.value
+
+    settings = scene.ds_settings
+    out_dir = spec["output_dir"]
+    state_dir = spec["state_dir"]
+    os.makedirs(out_dir, exist_ok=True)
+    os.makedirs(state_dir, exist_ok=True)
+    start_job_metrics()
+    try:
+        init_frames, checkpoint, parameter_table = prepare_animation_job(
+            scene, state_dir, bool(spec.get("resume"))
+        )
+    except Exception as e:
+        reporter.emit("error", message=str(e))
+        return ExitCode.INVALID_JOB.value
+    if not init_frames:
+        reporter.emit(
+            "error",
+            message="No {} frames selected in {}".format(
+                scene.render.image_settings.file_format, spec["frames_dir"]
+            ),
+        )
+        return ExitCode.INVALID_JOB.value
+
+    args = format_rest_args(settings, scene.prompt_list)
+    api_key = spec.get("api_key") or os.environ.get(API_KEY_ENV_VAR)
+    if api_key:
+        args["api_key"] = api_key
+    if not args["api_key"]:
+        reporter.emit("error", message="No API key given")
+        return ExitCode.INVALID_JOB.value
+
+    reporter.checkpoint = checkpoint
+    StateOperator.generated_output_dir = out_dir
+    StateOperator.render_state = RenderState.DIFFUSING
+    StateOperator.render_start_time = time.time()
+    worker = GeneratorWorker(
+        scene,
+        bpy.context,
+        UIContext.SCENE_VIEW,
+        input_img_paths=[path for _, path in init_frames],
+        output_img_directory=out_dir,
+        init_type=InitType.ANIMATION,
+        animation_frames=init_frames,
+        args=args,
+        parameter_table=parameter_table,
+        credit_limit=get_credit_limit(settings, None, checkpoint.spent_credits),
+        checkpoint=checkpoint,
+        on_frame_done=reporter.frame_done,
+        history=open_history(),
+    )
+    StateOperator.generator_thread = worker
+    reporter.emit(
+        "start",
+        frames_dir=spec["frames_dir"],
+        output_dir=out_dir,
+        total=checkpoint.total_frames,
+        completed=len(checkpoint.completed_frames),
+        engine=args["engine"],
+        concurrency=settings.max_concurrent_requests,
+    )
+
+    # Frames complete on the pipeline threads, so the main thread only writes a heartbeat while it waits.
+    def heartbeat():
+        while worker.running:
+            time.sleep(1.0)
+            if time.time() - reporter.last_event_at >= HEARTBEAT_INTERVAL:
+                fields = dict(
+                    completed=StateOperator.current_frame_idx,
+                    total=StateOperator.total_frame_count,
+                    spent_credits=round(worker.credit_budget.spent, 4),
+                )
+                # Throughput, time left, and frames in flight and failed.
+                if StateOperator.job_progress:
+                    fields = {**StateOperator.job_progress.snapshot(), **fields}
+                reporter.emit("progress", **fields)
+
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+    try:
+        worker.generate()
+    except KeyboardInterrupt:
+        worker.running = False
+        reporter.emit("interrupted", completed=len(checkpoint.completed_frames))
+        return ExitCode.INTERRUPTED.value
+    except Exception as e:
+        reporter.emit(
+            "error", message=str(e), completed=len(checkpoint.completed_frames)
+        )
+        return ExitCode.FAILED.value
+    finally:
+        worker.running = False
+        StateOperator.render_state = RenderState.IDLE
+
+    summary = dict(
+        completed=len(checkpoint.completed_frames),
+        total=checkpoint.total_frames,
+        spent_credits=round(checkpoint.spent_credits, 4),
+        seconds=round(time.time() - StateOperator.render_start_time, 2),
+    )
+    if checkpoint.paused_for_budget:
+        reporter.emit("paused", reason="credit_budget", **summary)
+        return ExitCode.PAUSED.value
+    reporter.emit("finished", **summary)
+    return ExitCode.SUCCESS.value
+
+
+def run(argv=None):
+    sys.exit(main(argv))
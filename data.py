@@ -6,14 +6,33 @@ import os
 import subprocess
 import sys
 import platform
-from glob import glob
 import re
-
+import tempfile
+from typing import Optional
+
+from .datablocks import (
+    copy_pixels,
+    get_reusable_output_image,
+    new_output_image,
+)
 from .dependencies import check_dependencies_installed, install_dependencies
-
-SUPPORTED_RENDER_FILE_TYPES = {"PNG", "JPEG", "JPG", "EXR"}
+from .frame_index import (
+    FrameIndex,
+    FrameSelection,
+    get_frame_index,
+    parse_frame_list,
+)
+from .frame_plan import KeyframeMode
+from .history import GenerationKind
+from .runs import RetentionPolicy
+from .tiling import TileLayout, needs_tiling
+from .video import VideoOutput
+
+SUPPORTED_RENDER_FILE_TYPES = {"PNG", "JPEG", "JPG", "OPEN_EXR", "OPEN_EXR_MULTILAYER"}
+EXR_RENDER_FILE_TYPES = {"OPEN_EXR", "OPEN_EXR_MULTILAYER"}
 RENDER_PREFIX = "render_"
 
+
 # Take current state of the scene and use it to format arguments for the REST API.
 def format_rest_args(settings, prompt_list_items):
     prompt_list = [{"text": p.prompt, "weight": p.strength} for p in prompt_list_items]
@@ -49,6 +68,7 @@ def format_rest_args(settings, prompt_list_items):
         "seed": settings.seed,
         "width": w,
         "height": h,
+        "engine": settings.generation_engine,
     }
 
 
@@ -67,13 +87,47 @@ def get_init_image_dimensions(settings, scene):
     return width, height
 
 
-def copy_image(image):
-    new_image = bpy.data.images.new(
-        "generation_output",
-        width=image.size[0],
-        height=image.size[1],
-    )
-    new_image.pixels = image.pixels[:]
+# The tiles an image job is generated as, or None if its init image fits in one request.
+def get_tile_layout(settings, scene) -> Optional[TileLayout]:
+    width, height = get_init_image_dimensions(settings, scene)
+    if not settings.use_tiled_generation or not needs_tiling(width, height):
+        return None
+    return TileLayout(width, height, settings.tile_size, settings.tile_overlap)
+
+
+# Least a request is estimated to cost. The formula below goes to zero and then negative for small images,
+# which would let budget checks pass for free.
+MIN_FRAME_CREDITS = 0.1
+
+
+# Rough credit cost of generating a single frame at the given size.
+def estimate_frame_credits(width: int, height: int, steps: int) -> float:
+    pixels = width * height
+    return max(MIN_FRAME_CREDITS, (pixels - 169527) * steps / 30 * 2.16e-08 * 100)
+
+
+# How many credits a job may spend: the user's budget minus what a resumed job already spent, capped by the
+# cached account balance. None if there is no limit.
+def get_credit_limit(settings, account, already_spent: float = 0.0):
+    limits = []
+    if settings.use_credit_budget:
+        limits.append(max(0.0, settings.credit_budget - already_spent))
+    if account and account.logged_in:
+        limits.append(account.credits)
+    return min(limits) if limits else None
+
+
+# Environment variable that passes the API key to background Blender processes.
+API_KEY_ENV_VAR = "STABILITY_API_KEY"
+
+
+# Copy an image's pixels into target, or else into an unused output image of the same size, or a new one.
+def copy_image(image, target=None):
+    width, height = image.size
+    new_image = target or get_reusable_output_image(width, height, exclude=image)
+    if not new_image:
+        new_image = new_output_image(width, height)
+    copy_pixels(image, new_image)
     return new_image
 
 
@@ -97,6 +151,8 @@ class RenderState(Enum):
     CANCELLED = 6
     # generation is finished and we want to display the finished texture this frame
     FINISHED = 7
+    # A low-res preview is displayed, waiting for the user to confirm the full generation
+    PREVIEW = 8
 
 
 # Where to grab the init image from.
@@ -140,6 +196,102 @@ INIT_TYPES = [
     ),
 ]
 
+# Which animation frames are sent to the API
+KEYFRAME_MODES = [
+    (
+        KeyframeMode.ALL.name,
+        "Every Frame",
+        "Generate every frame",
+        KeyframeMode.ALL.value,
+    ),
+    (
+        KeyframeMode.STRIDE.name,
+        "Every Nth Frame",
+        "Generate every Nth frame and interpolate the frames in between",
+        KeyframeMode.STRIDE.value,
+    ),
+    (
+        KeyframeMode.ADAPTIVE.name,
+        "Adaptive",
+        "Generate a frame once the init frames have changed enough, and interpolate the frames in between",
+        KeyframeMode.ADAPTIVE.value,
+    ),
+]
+
+FRAME_SELECTIONS = [
+    (
+        FrameSelection.SCENE_RANGE.name,
+        "Scene Range",
+        "Generate the frames in the scene's frame range",
+        FrameSelection.SCENE_RANGE.value,
+    ),
+    (
+        FrameSelection.CUSTOM.name,
+        "Frame List",
+        "Generate the frames in a list of frames and ranges",
+        FrameSelection.CUSTOM.value,
+    ),
+    (
+        FrameSelection.FAILED.name,
+        "Failed Only",
+        "Generate only the frames that didn't complete in the last run",
+        FrameSelection.FAILED.value,
+    ),
+]
+
+# "ALL" shows every kind of generation in the history.
+HISTORY_FILTERS = [
+    ("ALL", "All", "Show every generation", 0),
+    (
+        GenerationKind.TEXT.name,
+        "Text",
+        "Show images generated from a prompt only",
+        GenerationKind.TEXT.value,
+    ),
+    (
+        GenerationKind.IMAGE.name,
+        "Image",
+        "Show images generated from a texture or the viewport",
+        GenerationKind.IMAGE.value,
+    ),
+    (
+        GenerationKind.TILED.name,
+        "Tiled",
+        "Show large images generated as tiles",
+        GenerationKind.TILED.value,
+    ),
+    (
+        GenerationKind.ANIMATION.name,
+        "Animation",
+        "Show animation frames",
+        GenerationKind.ANIMATION.value,
+    ),
+]
+
+
+def get_history_filter(settings) -> Optional[GenerationKind]:
+    if settings.history_filter == "ALL":
+        return None
+    return GenerationKind[settings.history_filter]
+
+
+VIDEO_OUTPUTS = [
+    (VideoOutput.NONE.name, "None", "Only write frames", VideoOutput.NONE.value),
+    (VideoOutput.MP4.name, "MP4", "Encode an H.264 MP4", VideoOutput.MP4.value),
+    (
+        VideoOutput.GIF.name,
+        "GIF",
+        "Encode a GIF with a palette optimized for the animation",
+        VideoOutput.GIF.value,
+    ),
+    (
+        VideoOutput.MP4_AND_GIF.name,
+        "MP4 and GIF",
+        "Encode both an MP4 and a GIF",
+        VideoOutput.MP4_AND_GIF.value,
+    ),
+]
+
 # where to send the resulting texture
 OUTPUT_LOCATIONS = [
     (
@@ -238,6 +390,16 @@ class HighResEngineConfig(EngineConfig):
     steps = 30
 
 
+# Cheap configuration used for the preview pass before a full generation.
+class PreviewEngineConfig(EngineConfig):
+    sampler_clip = Sampler.K_DPM_2_ANCESTRAL
+    sampler_no_clip = Sampler.K_DPMPP_2M
+    guidance_preset = ClipGuidancePreset.NONE
+    steps = 15
+    max_side = 512
+    min_side = 384
+
+
 def get_optimal_engine_config(width: int, height: int) -> EngineConfig:
     if width <= 512 and height <= 512:
         return DefaultEngineConfig()
@@ -245,6 +407,45 @@ def get_optimal_engine_config(width: int, height: int) -> EngineConfig:
         return HighResEngineConfig()
 
 
+# Scale the init dimensions down so the longest side fits the preview size, keeping the aspect ratio
+# and snapping to multiples of 64 as the API requires.
+def get_preview_dimensions(width: int, height: int) -> tuple[int, int]:
+    config = PreviewEngineConfig
+    scale = min(1, config.max_side / max(width, height))
+
+    def snap(side):
+        side = int(round(side * scale / 64)) * 64
+        return min(config.max_side, max(config.min_side, side))
+
+    return snap(width), snap(height)
+
+
+# Rough credit cost of the preview sent before a full generation of the given size and steps.
+def estimate_preview_credits(width: int, height: int, steps: int) -> float:
+    preview_width, preview_height = get_preview_dimensions(width, height)
+    return estimate_frame_credits(
+        preview_width, preview_height, min(steps, PreviewEngineConfig.steps)
+    )
+
+
+# Derive the arguments for a preview request from the full request, keeping the same engine, seed and
+# prompts so the preview predicts the full result.
+def format_preview_args(args: dict) -> dict:
+    config = PreviewEngineConfig
+    width, height = get_preview_dimensions(args["width"], args["height"])
+    preview_args = dict(args)
+    preview_args.update(
+        {
+            "sampler": config.sampler_no_clip.name,
+            "clip_guidance_preset": config.guidance_preset.name,
+            "steps": min(args["steps"], config.steps),
+            "width": width,
+            "height": height,
+        }
+    )
+    return preview_args
+
+
 def enum_to_blender_enum(enum: Enum):
     return [(e.name, e.name, "", e.value) for e in enum]
 
@@ -332,6 +533,32 @@ def get_preferences():
     return bpy.context.preferences.addons[__package__].preferences
 
 
+# Where the addon writes renders and results: the output root set in the preferences, such as a fast local
+# disk, or else the system temp dir.
+def get_output_root() -> str:
+    prefs = get_preferences()
+    if prefs and prefs.output_root:
+        return os.path.abspath(bpy.path.abspath(prefs.output_root))
+    return os.path.join(tempfile.gettempdir(), "stability")
+
+
+# Where the generation history is kept: Blender's user config directory, so it outlasts the output root,
+# which is the temp dir by default and whose runs are removed by the retention policy.
+def get_history_directory() -> str:
+    return bpy.utils.user_resource("CONFIG", path="stability", create=True)
+
+
+def get_retention_policy() -> RetentionPolicy:
+    prefs = get_preferences()
+    if not prefs:
+        return RetentionPolicy()
+    return RetentionPolicy(
+        max_runs=prefs.retention_max_runs,
+        max_age_days=prefs.retention_max_age_days,
+        max_size_bytes=int(prefs.retention_max_size_gb * 2**30),
+    )
+
+
 def get_settings():
     if not hasattr(bpy.context.scene, "ds_settings"):
         raise Exception(
@@ -345,18 +572,35 @@ def get_init_type() -> InitType:
     return InitType[settings.init_type]
 
 
-def get_anim_images():
+# Index of the rendered frames in the init animation folder, matched by the scene's output file format.
+def get_anim_frame_index() -> FrameIndex:
     render_file_type = bpy.context.scene.render.image_settings.file_format
-    if render_file_type.lower() == "jpeg":
-        render_file_type = "jpg"
     settings = bpy.context.scene.ds_settings
     frame_path = bpy.path.abspath(settings.init_animation_folder_path)
-    glob_paths = os.path.join(
-        frame_path,
-        "*.{}".format(render_file_type.lower()),
-    )
-    init_img_paths = sorted(glob(glob_paths))
-    return init_img_paths, frame_path
+    return get_frame_index(frame_path, render_file_type)
+
+
+# Frame numbers an animation job over the init animation folder generates, from the job's frame selection.
+# Frames that were requested but have no init frame are returned separately. Retrying failed frames needs the
+# checkpoint of the last run.
+def get_anim_frame_selection(scene, frame_index: FrameIndex, checkpoint=None):
+    settings = scene.ds_settings
+    selection = FrameSelection[settings.frame_selection]
+    if selection == FrameSelection.FAILED:
+        frames = checkpoint.failed_frames if checkpoint else []
+    else:
+        if selection == FrameSelection.CUSTOM:
+            frames = parse_frame_list(settings.frame_list)
+        else:
+            frames = list(range(scene.frame_start, scene.frame_end + 1))
+        frames = frames[:: max(1, settings.frame_selection_stride)]
+    return frame_index.select(frames)
+
+
+# Rendered frames in the init animation folder, sorted by frame number.
+def get_anim_images():
+    frame_index = get_anim_frame_index()
+    return list(frame_index.paths), frame_index.directory
 
 
 def prompt_to_filename(prompt_list) -> str:
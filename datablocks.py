@@ -0,0 +1,314 @@
+from enum import Enum
+import os
+import time
+from typing import Dict, List, Set, Tuple
+
+import bpy
+
+from .frame_conversion import linear_to_srgb
+
+# Custom property marking the images the addon creates, with their kind as its value. Saved with the .blend
+# file, so images left over from earlier sessions are found as well.
+ADDON_IMAGE_KEY = "stability_addon_image"
+
+
+class AddonImageKind(Enum):
+    # A generated result, shown in the image editor.
+    OUTPUT = 1
+    # Loaded or copied only to be scaled and saved again, and removed right after.
+    TEMPORARY = 2
+
+
+def tag_image(image, kind: AddonImageKind):
+    image[ADDON_IMAGE_KEY] = kind.name
+
+
+def get_addon_images(kind: AddonImageKind = None) -> List[bpy.types.Image]:
+    return [
+        image
+        for image in bpy.data.images
+        if ADDON_IMAGE_KEY in image
+        and (kind is None or image[ADDON_IMAGE_KEY] == kind.name)
+    ]
+
+
+# Names of the images open in any image editor, in every window.
+def get_displayed_image_names() -> Set[str]:
+    names = set()
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type != "IMAGE_EDITOR":
+                continue
+            for space in area.spaces:
+                if space.type == "IMAGE_EDITOR" and space.image:
+                    names.add(space.image.name)
+    return names
+
+
+# An addon image that nothing uses anymore: not displayed, not used by a material or texture, and not kept
+# with a fake user.
+def is_orphan(image, displayed: Set[str]) -> bool:
+    return image.name not in displayed and image.users == 0 and not image.use_fake_user
+
+
+# An output image of the given size that isn't used anymore, to write the next result into instead of
+# creating another datablock.
+def get_reusable_output_image(width: int, height: int, exclude=None):
+    displayed = get_displayed_image_names()
+    for image in get_addon_images(AddonImageKind.OUTPUT):
+        if (
+            image != exclude
+            and image.source == "GENERATED"
+            and tuple(image.size) == (width, height)
+            and is_orphan(image, displayed)
+        ):
+            return image
+    return None
+
+
+# A new output image to write a result into.
+def new_output_image(width: int, height: int):
+    image = bpy.data.images.new("generation_output", width=width, height=height)
+    tag_image(image, AddonImageKind.OUTPUT)
+    return image
+
+
+# Whether the result shown in an image editor can be overwritten in place by the next result of that size:
+# it's an addon output that only the editor uses.
+def is_replaceable_output(image, width: int, height: int) -> bool:
+    return bool(
+        image
+        and image.get(ADDON_IMAGE_KEY) == AddonImageKind.OUTPUT.name
+        and image.source == "GENERATED"
+        and tuple(image.size) == (width, height)
+        and image.users <= 1
+        and not image.use_fake_user
+    )
+
+
+def remove_image(image):
+    bpy.data.images.remove(image)
+
+
+# Remove every addon image that is no longer used. Temporary images are always removed. Returns how many
+# images were removed.
+def free_orphan_images() -> int:
+    displayed = get_displayed_image_names()
+    orphans = [
+        image
+        for image in get_addon_images()
+        if image[ADDON_IMAGE_KEY] == AddonImageKind.TEMPORARY.name
+        or is_orphan(image, displayed)
+    ]
+    for image in orphans:
+        remove_image(image)
+    return len(orphans)
+
+
+# Bytes of pixel data an image holds in memory: 4 float or byte channels per pixel, if it's loaded.
+def image_memory_bytes(image) -> int:
+    if not image.has_data:
+        return 0
+    width, height = image.size
+    return width * height * 4 * (4 if image.is_float else 1)
+
+
+# (image count, bytes in memory) of the images the addon created, and of the pixel buffer.
+def get_addon_image_memory() -> Tuple[int, int]:
+    images = get_addon_images()
+    return (
+        len(images),
+        sum(image_memory_bytes(image) for image in images) + pixel_buffer.nbytes,
+    )
+
+
+# Largest pixel buffer kept between copies: a 2048x2048 RGBA image, larger than generated results. Larger
+# images get a buffer of their own that is freed after the copy.
+MAX_PIXEL_BUFFER_BYTES = 2048 * 2048 * 4 * 4
+
+
+# Reusable float32 buffer that image pixels are read into and written from with foreach_get / foreach_set,
+# which copy straight between the image and the buffer instead of creating a Python float for every channel.
+# The buffer only grows and is kept across the copies of a job, so same-sized images never allocate again;
+# it is released when the job finishes, and by Free Unused Images. Only used from the main thread.
+class PixelBuffer:
+    def __init__(self):
+        self.buffer = None
+
+    @property
+    def nbytes(self) -> int:
+        return self.buffer.nbytes if self.buffer is not None else 0
+
+    # The image's pixels as a flat float32 array. Only valid until the next read.
+    def read(self, image):
+        import numpy as np
+
+        size = len(image.pixels)
+        if size * 4 > MAX_PIXEL_BUFFER_BYTES:
+            pixels = np.empty(size, dtype=np.float32)
+            image.pixels.foreach_get(pixels)
+            return pixels
+        if self.buffer is None or len(self.buffer) < size:
+            self.buffer = np.empty(size, dtype=np.float32)
+        pixels = self.buffer[:size]
+        image.pixels.foreach_get(pixels)
+        return pixels
+
+    def write(self, image, pixels):
+        image.pixels.foreach_set(pixels)
+        image.update()
+
+    def release(self):
+        self.buffer = None
+
+
+pixel_buffer = PixelBuffer()
+
+
+# Pixels with from_channels channels per pixel, as to_channels channels. Gray is repeated into RGB, and
+# missing alpha is opaque.
+def convert_channels(pixels, from_channels: int, to_channels: int):
+    import numpy as np
+
+    if from_channels == to_channels:
+        return pixels
+    pixels = pixels.reshape(-1, from_channels)
+    converted = np.ones((len(pixels), to_channels), dtype=np.float32)
+    color = min(3, to_channels)
+    converted[:, :color] = pixels[:, :color] if from_channels >= 3 else pixels[:, :1]
+    return converted.ravel()
+
+
+# Write decoded result pixels, as returned by imaging.decode_image_pixels, into target if it can take them, or
+# else into a reusable or new output image. Returns the image written to.
+def write_result_pixels(decoded, target=None):
+    width, height, pixels = decoded
+    if not is_replaceable_output(target, width, height):
+        target = get_reusable_output_image(width, height) or new_output_image(
+            width, height
+        )
+    pixel_buffer.write(target, pixels)
+    return target
+
+
+# An output image holding the encoded result, packed into the .blend file, so Blender decodes it straight
+# from memory instead of from a file. Only compared in the loading benchmark, since packed results would be
+# saved with the .blend file.
+def load_packed_image(data: bytes, name: str = "generation_output"):
+    image = bpy.data.images.new(name, width=1, height=1)
+    image.pack(data=data, data_len=len(data))
+    image.source = "FILE"
+    tag_image(image, AddonImageKind.OUTPUT)
+    return image
+
+
+# Copy every pixel of source into target, which has the same size.
+def copy_pixels(source, target):
+    pixels = pixel_buffer.read(source)
+    pixel_buffer.write(
+        target, convert_channels(pixels, source.channels, target.channels)
+    )
+
+
+# The images of every image texture node in the materials of the objects, each once, in the order they are
+# found. Images without pixels, like the Render Result, are left out.
+def collect_texture_images(objects) -> List[bpy.types.Image]:
+    images = {}
+    for obj in objects:
+        for slot in getattr(obj, "material_slots", []):
+            material = slot.material
+            if not material or not material.use_nodes or not material.node_tree:
+                continue
+            for node in material.node_tree.nodes:
+                image = getattr(node, "image", None)
+                if (
+                    node.type == "TEX_IMAGE"
+                    and image
+                    and image.type == "IMAGE"
+                    and image.name not in images
+                ):
+                    images[image.name] = image
+    return list(images.values())
+
+
+# An image's pixels as an 8 bit RGBA array of rows from the bottom up, in display color.
+def read_image_rgba8(image):
+    import numpy as np
+
+    width, height = image.size
+    pixels = convert_channels(pixel_buffer.read(image), image.channels, 4)
+    pixels = pixels.reshape(height, width, 4)
+    if image.is_float:
+        pixels = pixels.copy()
+        pixels[..., :3] = linear_to_srgb(pixels[..., :3])
+    return np.clip(np.rint(pixels * 255), 0, 255).astype(np.uint8)
+
+
+# Result sizes the loading benchmark compares, in pixels per side.
+BENCHMARK_SIZES = (512, 1024, 2048)
+
+
+# A noisy gradient encoded as PNG, which compresses about as badly as a generated result.
+def make_benchmark_png(size: int) -> bytes:
+    import io
+    import numpy as np
+    from PIL import Image
+
+    ramp = np.linspace(0, 255, size, dtype=np.float32)
+    noise = np.random.default_rng(size).integers(0, 32, (size, size, 3))
+    pixels = np.clip(ramp[None, :, None] + noise, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, "RGB").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+# Milliseconds each way of loading a result into an image datablock takes, by size, best of repeats:
+# "disk" writes the PNG, loads the file and copies its pixels into an output image, as results used to be
+# shown; "packed" packs the PNG bytes into an image; "decoded" decodes them with Pillow and writes the pixels
+# into an output image in place. Each path is timed until the pixels are loaded.
+def benchmark_result_loading(
+    directory: str, sizes=BENCHMARK_SIZES, repeats: int = 3
+) -> Dict[int, Dict[str, float]]:
+    from .imaging import decode_image_pixels
+
+    def load_from_disk(data: bytes, path: str):
+        with open(path, "wb") as f:
+            f.write(data)
+        loaded = bpy.data.images.load(path)
+        tag_image(loaded, AddonImageKind.TEMPORARY)
+        try:
+            width, height = loaded.size
+            image = new_output_image(width, height)
+            copy_pixels(loaded, image)
+        finally:
+            remove_image(loaded)
+        return image
+
+    def load_packed(data: bytes, path: str):
+        image = load_packed_image(data)
+        # Reading the size makes Blender decode the packed image.
+        tuple(image.size)
+        return image
+
+    def load_decoded(data: bytes, path: str):
+        return write_result_pixels(decode_image_pixels(data))
+
+    paths = {"disk": load_from_disk, "packed": load_packed, "decoded": load_decoded}
+    results = {}
+    for size in sizes:
+        data = make_benchmark_png(size)
+        path = os.path.join(directory, f"benchmark_{size}.png")
+        results[size] = {}
+        for name, load in paths.items():
+            best = None
+            for _ in range(repeats):
+                start = time.perf_counter()
+                image = load(data, path)
+                elapsed = (time.perf_counter() - start) * 1000
+                remove_image(image)
+                best = elapsed if best is None else min(best, elapsed)
+            results[size][name] = best
+        if os.path.exists(path):
+            os.remove(path)
+    pixel_buffer.release()
+    return results
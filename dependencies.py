@@ -13,7 +13,7 @@ def install_dependencies():
     env = os.environ.copy()
     env["PYTHONNOUSERSITE"] = "1"
     env["GRPC_PYTHON_BUILD_WITH_CYTHON"] = "1"
-    for dep_name in ("sentry-sdk", "Pillow"):
+    for dep_name in ("sentry-sdk", "Pillow", "OpenEXR"):
         res = subprocess.run(
             [sys.executable, "-m", "pip", "install", dep_name], env=env
         )
@@ -0,0 +1,279 @@
+# Converts EXR and JPEG init frames into the PNGs that are uploaded, in a pool of worker processes so that
+# decoding and tonemapping large frames runs in parallel with the requests in flight. Converted frames are
+# cached on disk, keyed by the source file's mtime and the target size, so repeat runs skip the work.
+#
+# The worker processes are spawned rather than forked from Blender, and load this file on its own instead
+# of importing the addon package, which needs bpy. So this module must not use relative imports.
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import io
+import multiprocessing
+import os
+import site
+import sys
+import threading
+from typing import Optional
+
+# Directory of this file, and the name the worker processes import it under. Functions sent to the pool are
+# pickled by that name, so the module is registered under it in Blender as well.
+MODULE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+WORKER_MODULE_NAME = os.path.splitext(os.path.basename(__file__))[0]
+CONVERTED_EXTENSIONS = {".exr", ".jpg", ".jpeg"}
+# Bump when the conversion changes, so frames cached by an older version are converted again.
+CONVERSION_VERSION = 1
+# Subdirectory of the output root that converted frames are cached in.
+CACHE_DIRNAME = "converted_frames"
+# Once the cache grows past this, the least recently used frames are removed when a job starts.
+MAX_CACHE_BYTES = 2 * 1024**3
+
+
+def needs_conversion(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in CONVERTED_EXTENSIONS
+
+
+def is_exr(path) -> bool:
+    return isinstance(path, str) and os.path.splitext(path)[1].lower() == ".exr"
+
+
+def has_openexr() -> bool:
+    try:
+        import OpenEXR
+
+        return True
+    except ImportError:
+        return False
+
+
+# Piecewise sRGB transfer function on linear values, clipped to 0..1 first. The same display transform as
+# Blender's Standard view, vectorized over the whole frame.
+def linear_to_srgb(linear):
+    import numpy as np
+
+    linear = np.clip(np.nan_to_num(linear, nan=0.0, posinf=1.0, neginf=0.0), 0, 1)
+    return np.where(
+        linear <= 0.0031308,
+        linear * 12.92,
+        1.055 * np.power(linear, 1 / 2.4) - 0.055,
+    )
+
+
+# Inverse of linear_to_srgb, for writing 8 bit results into float images.
+def srgb_to_linear(srgb):
+    import numpy as np
+
+    srgb = np.clip(srgb, 0, 1)
+    return np.where(
+        srgb <= 0.04045, srgb / 12.92, np.power((srgb + 0.055) / 1.055, 2.4)
+    )
+
+
+# Names of the color channels of an EXR, as (R, G, B). Multilayer EXRs name them by view layer and pass,
+# e.g. "ViewLayer.Combined.R"; the combined pass is used. Grayscale images repeat their only channel.
+def exr_color_channels(channel_names):
+    names = set(channel_names)
+    if {"R", "G", "B"} <= names:
+        return "R", "G", "B"
+    prefixes = sorted(
+        {name[:-1] for name in names if name.endswith(".R")},
+        key=lambda prefix: (not prefix.endswith(".Combined."), prefix),
+    )
+    for prefix in prefixes:
+        if prefix + "G" in names and prefix + "B" in names:
+            return prefix + "R", prefix + "G", prefix + "B"
+    for name in ("Y", "V"):
+        if name in names:
+            return name, name, name
+    name = sorted(names)[0]
+    return name, name, name
+
+
+# Decode an EXR into a float32 array of linear RGB.
+def read_exr(path: str):
+    import numpy as np
+    import Imath
+    import OpenEXR
+
+    exr = OpenEXR.InputFile(path)
+    try:
+        header = exr.header()
+        window = header["dataWindow"]
+        width = window.max.x - window.min.x + 1
+        height = window.max.y - window.min.y + 1
+        float_type = Imath.PixelType(Imath.PixelType.FLOAT)
+        channels = exr_color_channels(header["channels"].keys())
+        planes = {
+            name: np.frombuffer(
+                exr.channel(name, float_type), dtype=np.float32
+            ).reshape(height, width)
+            for name in set(channels)
+        }
+        return np.stack([planes[name] for name in channels], axis=-1)
+    finally:
+        exr.close()
+
+
+# Decode a frame into an 8 bit RGB Pillow image, dropping any alpha. EXRs are tonemapped to sRGB, since
+# Pillow can't read them. If draft_size is given, JPEGs may decode at a reduced scale no smaller than it.
+def open_display_image(path: str, draft_size=None):
+    import numpy as np
+    from PIL import Image
+
+    if is_exr(path):
+        pixels = np.rint(linear_to_srgb(read_exr(path)) * 255).astype(np.uint8)
+        return Image.fromarray(pixels, "RGB")
+    with Image.open(path) as source:
+        if draft_size:
+            source.draft("RGB", draft_size)
+        return source.convert("RGB")
+
+
+# Decode a frame into an 8 bit RGB Pillow image of the given size, dropping any alpha.
+def load_display_image(path: str, width: int, height: int):
+    from PIL import Image
+
+    resample = getattr(Image, "Resampling", Image).LANCZOS
+    img = open_display_image(path, (width, height))
+    if img.size != (width, height):
+        img = img.resize((width, height), resample)
+    return img
+
+
+# Runs in the worker processes. Converts a frame into the upload PNG, writes it to the cache and returns it.
+def convert_frame(path: str, width: int, height: int, cache_path: str) -> bytes:
+    buffer = io.BytesIO()
+    load_display_image(path, width, height).save(buffer, format="PNG")
+    data = buffer.getvalue()
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, cache_path)
+    return data
+
+
+# Remove the least recently used frames from the cache until it fits in max_bytes. Cache hits touch their
+# file, so its mtime is the time it was last used.
+def prune_cache(directory: str, max_bytes: int = MAX_CACHE_BYTES):
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            try:
+                if entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                pass
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError as e:
+            print(f"Couldn't remove cached frame {path}: {e}")
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+# This module as loaded under WORKER_MODULE_NAME, so that what is sent to the pool pickles by that name.
+# Loaded from its path rather than by adding the addon directory to Blender's sys.path.
+def get_worker_module():
+    with _pool_lock:
+        module = sys.modules.get(WORKER_MODULE_NAME)
+        if module is None:
+            import importlib.util
+
+            spec = importlib.util.spec_from_file_location(
+                WORKER_MODULE_NAME, os.path.abspath(__file__)
+            )
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            sys.modules[WORKER_MODULE_NAME] = module
+        return module
+
+
+# The process pool is shared by every job, since spawning the workers takes a moment. Each worker appends
+# this file's directory to its sys.path before anything is sent to it, so it can import WORKER_MODULE_NAME
+# without importing the addon package. Appended last, the addon's modules can't shadow installed packages.
+def get_conversion_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, min(8, (os.cpu_count() or 2) - 1)),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=site.addsitedir,
+                initargs=(MODULE_DIRECTORY,),
+            )
+        return _pool
+
+
+def shutdown_conversion_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+# Converts the init frames of a job, from its generation threads. Frames are converted in the process pool,
+# or on the calling thread if the pool can't run.
+class FrameConverter:
+    def __init__(self, cache_directory: str, max_cache_bytes: int = MAX_CACHE_BYTES):
+        self.cache_directory = cache_directory
+        os.makedirs(cache_directory, exist_ok=True)
+        prune_cache(cache_directory, max_cache_bytes)
+        self.use_pool = True
+
+    def cache_path(self, path: str, width: int, height: int) -> str:
+        stat = os.stat(path)
+        key = "|".join(
+            str(part)
+            for part in (
+                CONVERSION_VERSION,
+                os.path.abspath(path),
+                stat.st_size,
+                stat.st_mtime_ns,
+                width,
+                height,
+            )
+        )
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(self.cache_directory, digest + ".png")
+
+    def convert(self, path: str, width: int, height: int) -> bytes:
+        cache_path = self.cache_path(path, width, height)
+        try:
+            with open(cache_path, "rb") as f:
+                data = f.read()
+            os.utime(cache_path)
+            return data
+        except FileNotFoundError:
+            pass
+        try:
+            if self.use_pool:
+                try:
+                    future = get_conversion_pool().submit(
+                        get_worker_module().convert_frame,
+                        path,
+                        width,
+                        height,
+                        cache_path,
+                    )
+                    return future.result()
+                except (BrokenProcessPool, OSError) as e:
+                    print(
+                        f"Frame conversion processes failed, converting in-process: {e}"
+                    )
+                    self.use_pool = False
+                    shutdown_conversion_pool()
+            return convert_frame(path, width, height, cache_path)
+        except ImportError as e:
+            raise Exception(
+                "Reading {} needs {}. Reinstall dependencies.".format(
+                    os.path.basename(path), "OpenEXR" if is_exr(path) else e.name
+                )
+            )
@@ -0,0 +1,211 @@
+from bisect import bisect_left, bisect_right
+from enum import Enum
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# The last run of digits in a file name is its frame number, e.g. render_0012.png or shot3_frame12.png.
+FRAME_NUMBER_PATTERN = re.compile(r"(\d+)\D*$")
+NATURAL_SORT_PATTERN = re.compile(r"(\d+)")
+# One item of a frame list: a frame, or a range of frames with an optional step, e.g. 12, 1-100 or 1-100:5.
+FRAME_LIST_ITEM_PATTERN = re.compile(r"^(\d+)(?:\s*-\s*(\d+)(?:\s*:\s*(\d+))?)?$")
+# Render file format -> file extensions of its frames.
+FORMAT_EXTENSIONS = {
+    "jpeg": ("jpg", "jpeg"),
+    "jpg": ("jpg", "jpeg"),
+    "open_exr": ("exr",),
+    "open_exr_multilayer": ("exr",),
+}
+
+
+# Which frames of the animation a job generates.
+class FrameSelection(Enum):
+    # Every frame in the scene's frame range.
+    SCENE_RANGE = 1
+    # The frames in the frame list, e.g. "1-100, 120, 200-300:5".
+    CUSTOM = 2
+    # The frames of the last run that didn't complete.
+    FAILED = 3
+
+
+# Parse a comma separated frame list into sorted, unique frame numbers. Raises ValueError if it's malformed.
+def parse_frame_list(text: str) -> List[int]:
+    frames = set()
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        match = FRAME_LIST_ITEM_PATTERN.match(item)
+        if not match:
+            raise ValueError(f"Invalid frame list item: {item}")
+        first = int(match.group(1))
+        last = int(match.group(2)) if match.group(2) else first
+        step = int(match.group(3)) if match.group(3) else 1
+        if last < first or step < 1:
+            raise ValueError(f"Invalid frame range: {item}")
+        frames.update(range(first, last + 1, step))
+    return sorted(frames)
+
+
+# The shortest frame list for the given frames, with consecutive runs written as ranges.
+def format_frame_list(frames: Iterable[int]) -> str:
+    items = []
+    run_start = previous = None
+    for frame in sorted(set(frames)):
+        if previous is not None and frame == previous + 1:
+            previous = frame
+            continue
+        if run_start is not None:
+            items.append(
+                str(run_start) if run_start == previous else f"{run_start}-{previous}"
+            )
+        run_start = previous = frame
+    if run_start is not None:
+        items.append(
+            str(run_start) if run_start == previous else f"{run_start}-{previous}"
+        )
+    return ", ".join(items)
+
+
+def natural_sort_key(name: str):
+    return [
+        (0, int(part), "") if part.isdigit() else (1, 0, part.lower())
+        for part in NATURAL_SORT_PATTERN.split(name)
+        if part
+    ]
+
+
+# Frame file extensions have no digits, so the extension doesn't need to be split off first.
+def parse_frame_number(file_name: str) -> Optional[int]:
+    match = FRAME_NUMBER_PATTERN.search(file_name)
+    return int(match.group(1)) if match else None
+
+
+def frame_extensions(file_format: str) -> Tuple[str, ...]:
+    file_format = file_format.lower()
+    return FORMAT_EXTENSIONS.get(file_format, (file_format,))
+
+
+# The rendered frames in a directory, sorted by frame number, with the frame number parsed from each file
+# name. Files without a number are naturally sorted after the numbered ones.
+class FrameIndex:
+    def __init__(self, directory: str, extensions: Tuple[str, ...]):
+        self.directory = directory
+        self.extensions = extensions
+        self.exists = False
+        self.mtime_ns = None
+        self.paths: List[str] = []
+        # Frame number of each path, None if its name has no number.
+        self.frames: List[Optional[int]] = []
+        # frame number -> first path with that number
+        self.by_frame: Dict[int, str] = {}
+        # frame number -> every path with that number, for numbers used by more than one file
+        self.duplicates: Dict[int, List[str]] = {}
+        # Inclusive ranges of frame numbers missing between the first and last frame.
+        self.gaps: List[Tuple[int, int]] = []
+        # First and last frame number, None if no file is numbered.
+        self.frame_range: Optional[Tuple[int, int]] = None
+        # Frame number -> init frame used for it, and the sorted frame numbers. If some files have no number,
+        # every file is numbered by its position instead, starting at 1.
+        self.frame_paths: Dict[int, str] = {}
+        self.frame_numbers: List[int] = []
+
+    @classmethod
+    def build(cls, directory: str, extensions: Tuple[str, ...]) -> "FrameIndex":
+        index = cls(directory, extensions)
+        try:
+            index.mtime_ns = os.stat(directory).st_mtime_ns
+            suffixes = tuple("." + ext.lower() for ext in extensions)
+            with os.scandir(directory) as entries:
+                names = [
+                    entry.name
+                    for entry in entries
+                    if entry.name.lower().endswith(suffixes) and entry.is_file()
+                ]
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return index
+        index.exists = True
+        numbered = []
+        unnumbered = []
+        for name in names:
+            frame = parse_frame_number(name)
+            if frame is None:
+                unnumbered.append(name)
+            else:
+                numbered.append((frame, name))
+        numbered.sort()
+        unnumbered.sort(key=natural_sort_key)
+        prefix = os.path.join(directory, "")
+        for frame, name in numbered:
+            path = prefix + name
+            index.paths.append(path)
+            index.frames.append(frame)
+            if frame in index.by_frame:
+                index.duplicates.setdefault(frame, [index.by_frame[frame]]).append(path)
+            else:
+                index.by_frame[frame] = path
+        for name in unnumbered:
+            index.paths.append(prefix + name)
+            index.frames.append(None)
+        if numbered:
+            index.frame_range = (numbered[0][0], numbered[-1][0])
+        if unnumbered:
+            index.frame_paths = {i + 1: path for i, path in enumerate(index.paths)}
+        else:
+            index.frame_paths = index.by_frame
+        index.frame_numbers = sorted(index.frame_paths)
+        previous = None
+        for frame, _ in numbered:
+            if previous is not None and frame > previous + 1:
+                index.gaps.append((previous + 1, frame - 1))
+            previous = frame
+        return index
+
+    @property
+    def missing_frame_count(self) -> int:
+        return sum(last - first + 1 for first, last in self.gaps)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    # How many frames there are between first and last, inclusive.
+    def count_in_range(self, first: int, last: int) -> int:
+        return bisect_right(self.frame_numbers, last) - bisect_left(
+            self.frame_numbers, first
+        )
+
+    # Split the requested frame numbers into the frames that exist, as (frame, path), and the ones that don't.
+    def select(self, frames: Iterable[int]):
+        selected = []
+        missing = []
+        for frame in frames:
+            path = self.frame_paths.get(frame)
+            if path:
+                selected.append((frame, path))
+            else:
+                missing.append(frame)
+        return selected, missing
+
+
+_cache: Dict[tuple, FrameIndex] = {}
+_cache_lock = threading.Lock()
+
+
+# The frame index of a directory, rebuilt only when the directory's mtime changes, which happens whenever a
+# file is added, removed or renamed in it. Cheap enough to call on every redraw.
+def get_frame_index(directory: str, file_format: str) -> FrameIndex:
+    extensions = frame_extensions(file_format)
+    key = (directory, extensions)
+    try:
+        mtime_ns = os.stat(directory).st_mtime_ns
+    except OSError:
+        mtime_ns = None
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached.exists and cached.mtime_ns == mtime_ns:
+            return cached
+    index = FrameIndex.build(directory, extensions)
+    with _cache_lock:
+        _cache[key] = index
+    return index
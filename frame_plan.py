@@ -0,0 +1,282 @@
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+import json
+import os
+import shutil
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .imaging import (
+    frame_signature,
+    has_pillow,
+    hash_distance,
+    interpolate_frames,
+    load_rgb_array,
+    perceptual_hashes,
+    save_rgb_array,
+)
+
+FRAME_PLAN_FILENAME = "frame_plan.json"
+
+
+# Which frames of an animation are sent to the API.
+class KeyframeMode(Enum):
+    # Every frame is generated.
+    ALL = 1
+    # Every Nth frame is generated, the rest are interpolated.
+    STRIDE = 2
+    # A frame is generated once the init frames have changed enough since the last one.
+    ADAPTIVE = 3
+
+
+# Where the output of a frame comes from.
+class FrameSource(Enum):
+    GENERATE = 1
+    INTERPOLATE = 2
+    # A copy of the output of a generated frame whose init frame is nearly identical.
+    REUSE = 3
+
+
+class PlannedFrame:
+    def __init__(self, index: int, frame: int, init_path: str, output_path: str):
+        self.index = index
+        self.frame = frame
+        self.init_path = init_path
+        self.output_path = output_path
+        self.source = FrameSource.GENERATE
+        # For interpolated frames: the generated frames on either side, and how far between them it is.
+        self.from_index: int = None
+        self.to_index: int = None
+        self.blend = 0.0
+        # For reused frames: the generated frame whose output is copied, and how far apart their hashes are.
+        self.reuse_index: int = None
+        self.hash_distance = 0
+        self.perceptual_hash: int = None
+
+    def to_dict(self) -> dict:
+        entry = {
+            "frame": self.frame,
+            "init": os.path.basename(self.init_path),
+            "output": os.path.basename(self.output_path),
+            "source": self.source.name.lower(),
+        }
+        if self.source == FrameSource.INTERPOLATE:
+            entry.update(
+                {"from": self.from_index, "to": self.to_index, "blend": self.blend}
+            )
+        if self.source == FrameSource.REUSE:
+            entry.update(
+                {"reuses": self.reuse_index, "hash_distance": self.hash_distance}
+            )
+        if self.perceptual_hash is not None:
+            entry["hash"] = "{:016x}".format(self.perceptual_hash)
+        return entry
+
+
+# How each frame of an animation job gets its output. Frames between two generated keyframes form a
+# segment, which is interpolated once both of its keyframes are done.
+class FramePlan:
+    def __init__(self, frames: List[PlannedFrame]):
+        self.frames = frames
+        self.by_index: Dict[int, PlannedFrame] = {f.index: f for f in frames}
+        # keyframe index -> (next keyframe index, interpolated frames between them)
+        self.segments: Dict[int, tuple] = {}
+        # keyframe index -> keyframe index of the segment that ends at it
+        self.segment_starts: Dict[int, int] = {}
+        # generated frame index -> frames that reuse its output
+        self.reused_by: Dict[int, List[PlannedFrame]] = {}
+
+    @property
+    def generated_frames(self) -> List[PlannedFrame]:
+        return [f for f in self.frames if f.source == FrameSource.GENERATE]
+
+    @property
+    def reused_frame_count(self) -> int:
+        return sum(len(frames) for frames in self.reused_by.values())
+
+    @property
+    def api_call_count(self) -> int:
+        return len(self.generated_frames)
+
+    @property
+    def saved_api_calls(self) -> int:
+        return len(self.frames) - self.api_call_count
+
+    def set_keyframes(self, keyframe_indices: List[int]):
+        keys = sorted(set(keyframe_indices) & set(self.by_index))
+        self.segments = {}
+        self.segment_starts = {}
+        for frame in self.frames:
+            frame.source = FrameSource.INTERPOLATE
+        for key in keys:
+            self.by_index[key].source = FrameSource.GENERATE
+        for from_index, to_index in zip(keys, keys[1:]):
+            between = [
+                self.by_index[i]
+                for i in range(from_index + 1, to_index)
+                if i in self.by_index
+            ]
+            for frame in between:
+                frame.from_index, frame.to_index = from_index, to_index
+                frame.blend = (frame.index - from_index) / (to_index - from_index)
+            if between:
+                self.segments[from_index] = (to_index, between)
+                self.segment_starts[to_index] = from_index
+        # Frames outside the first and last keyframe have nothing to interpolate from.
+        for frame in self.frames:
+            if frame.source == FrameSource.INTERPOLATE and frame.from_index is None:
+                frame.source = FrameSource.GENERATE
+
+    # Mark generated frames whose init frame is within max_distance hash bits of the last frame that is still
+    # generated as reusing its output. Only consecutive runs are collapsed, so a shot that returns to an
+    # earlier look is generated again.
+    def skip_duplicates(self, hashes, max_distance: int):
+        self.reused_by = {}
+        anchor = None
+        for frame, frame_hash in zip(self.frames, hashes):
+            frame.perceptual_hash = int(frame_hash)
+            if frame.source != FrameSource.GENERATE:
+                continue
+            if anchor is not None:
+                distance = hash_distance(frame_hash, anchor.perceptual_hash)
+                if distance <= max_distance:
+                    frame.source = FrameSource.REUSE
+                    frame.reuse_index = anchor.index
+                    frame.hash_distance = distance
+                    self.reused_by.setdefault(anchor.index, []).append(frame)
+                    continue
+            anchor = frame
+
+    # Segments that border the given keyframe, as (from index, to index, frames).
+    def segments_touching(self, index: int):
+        touching = []
+        for from_index in (self.segment_starts.get(index), index):
+            if from_index in self.segments:
+                to_index, between = self.segments[from_index]
+                touching.append((from_index, to_index, between))
+        return touching
+
+    def save(self, directory: str):
+        payload = {
+            "api_calls": self.api_call_count,
+            "saved_api_calls": self.saved_api_calls,
+            "reused_frames": self.reused_frame_count,
+            "frames": {str(f.index): f.to_dict() for f in self.frames},
+        }
+        with open(os.path.join(directory, FRAME_PLAN_FILENAME), "w") as f:
+            json.dump(payload, f, indent=1)
+
+
+def select_keyframes_stride(frame_count: int, stride: int) -> List[int]:
+    if frame_count == 0:
+        return []
+    keys = list(range(0, frame_count, max(1, stride)))
+    if keys[-1] != frame_count - 1:
+        keys.append(frame_count - 1)
+    return keys
+
+
+# Pick a keyframe whenever the init frames have changed by more than the threshold since the last keyframe,
+# or max_stride frames have passed. Change is the mean absolute difference between consecutive downsampled
+# grayscale frames, accumulated since the last keyframe.
+def select_keyframes_adaptive(
+    signatures: np.ndarray, threshold: float, max_stride: int
+) -> List[int]:
+    frame_count = len(signatures)
+    if frame_count == 0:
+        return []
+    diffs = np.zeros(frame_count, dtype=np.float32)
+    if frame_count > 1:
+        diffs[1:] = np.abs(np.diff(signatures, axis=0)).mean(axis=(1, 2))
+    keys = [0]
+    accumulated = 0.0
+    for i in range(1, frame_count):
+        accumulated += float(diffs[i])
+        if accumulated >= threshold or i - keys[-1] >= max_stride:
+            keys.append(i)
+            accumulated = 0.0
+    if keys[-1] != frame_count - 1:
+        keys.append(frame_count - 1)
+    return keys
+
+
+# Upper bound on the number of requests a job makes, used for cost estimates before the plan is built.
+def estimate_api_calls(frame_count: int, mode: KeyframeMode, stride: int) -> int:
+    if mode == KeyframeMode.STRIDE:
+        return len(select_keyframes_stride(frame_count, stride))
+    return frame_count
+
+
+# Plan an animation job over the given init frames, as (frame number, path) in frame order: which frames are
+# generated, and which are interpolated from the generated frames around them. Frames are indexed and their
+# outputs named by frame number, so jobs over different parts of the same animation don't clash.
+def build_frame_plan(
+    init_frames: List[Tuple[int, str]],
+    output_directory: str,
+    mode: KeyframeMode,
+    stride: int,
+    change_threshold: float,
+    skip_duplicates: bool = False,
+    duplicate_threshold: int = 0,
+) -> FramePlan:
+    frames = [
+        PlannedFrame(
+            frame, frame, path, os.path.join(output_directory, f"result_{frame}.png")
+        )
+        for frame, path in init_frames
+    ]
+    init_paths = [path for _, path in init_frames]
+    plan = FramePlan(frames)
+    if (mode != KeyframeMode.ALL or skip_duplicates) and not has_pillow():
+        print("Comparing frames requires Pillow, generating every frame instead.")
+        mode = KeyframeMode.ALL
+        skip_duplicates = False
+    signatures = None
+    if mode == KeyframeMode.ADAPTIVE or skip_duplicates:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            signatures = np.stack(list(executor.map(frame_signature, init_paths)))
+    if mode == KeyframeMode.STRIDE:
+        key_positions = select_keyframes_stride(len(frames), stride)
+    elif mode == KeyframeMode.ADAPTIVE:
+        key_positions = select_keyframes_adaptive(signatures, change_threshold, stride)
+    else:
+        key_positions = range(len(frames))
+    plan.set_keyframes([frames[p].index for p in key_positions])
+    if skip_duplicates and len(frames):
+        plan.skip_duplicates(perceptual_hashes(signatures), duplicate_threshold)
+    return plan
+
+
+# Copy the output of a generated frame to the frames that reuse it and aren't done yet.
+def copy_reused_frames(plan: FramePlan, index: int, completed) -> List[PlannedFrame]:
+    reused = [f for f in plan.reused_by.get(index, []) if f.index not in completed]
+    for frame in reused:
+        shutil.copyfile(plan.by_index[index].output_path, frame.output_path)
+    return reused
+
+
+# Write the given in-between frames of the segment starting at from_index. Both of its keyframes must have
+# been generated already.
+def synthesize_segment(
+    plan: FramePlan, from_index: int, frames: List[PlannedFrame], guidance: float
+):
+    to_index, _ = plan.segments[from_index]
+    key_from, key_to = plan.by_index[from_index], plan.by_index[to_index]
+    gen_from = load_rgb_array(key_from.output_path)
+    size = (gen_from.shape[1], gen_from.shape[0])
+    gen_to = load_rgb_array(key_to.output_path, size)
+    init_from = load_rgb_array(key_from.init_path, size)
+    init_to = load_rgb_array(key_to.init_path, size)
+    init_frames = [load_rgb_array(f.init_path, size) for f in frames]
+    synthesized = interpolate_frames(
+        gen_from,
+        gen_to,
+        init_from,
+        init_to,
+        init_frames,
+        [f.blend for f in frames],
+        guidance,
+    )
+    for frame, pixels in zip(frames, synthesized):
+        save_rgb_array(pixels, frame.output_path)
@@ -0,0 +1,62 @@
+import os
+from typing import List, Tuple
+
+import bpy
+import bpy.utils.previews
+
+from .history import GenerationKind, HistoryEntry, HistoryStore
+
+GALLERY_PAGE_SIZE = 12
+GALLERY_COLUMNS = 3
+# The thumbnail collection is cleared once it holds this many, so paging through a long history doesn't
+# keep every thumbnail in memory.
+MAX_LOADED_THUMBNAILS = 240
+
+
+# Thumbnails of the history entries shown in the panel. Only the entries of the page that is drawn get a
+# thumbnail, which Blender renders in the background the first time it's shown. The page itself is cached
+# until the search or the history changes, so redrawing the panel doesn't query the database.
+class HistoryGallery:
+    def __init__(self):
+        self.previews = None
+        self.page_key = None
+        self.page: Tuple[List[HistoryEntry], int] = ([], 0)
+
+    def get_page(
+        self, store: HistoryStore, text: str, kind: GenerationKind, page: int
+    ) -> Tuple[List[HistoryEntry], int]:
+        key = (store.path, store.version, text, kind, page)
+        if key != self.page_key:
+            self.page = (
+                store.search(
+                    text,
+                    kind,
+                    limit=GALLERY_PAGE_SIZE,
+                    offset=page * GALLERY_PAGE_SIZE,
+                ),
+                store.count(text, kind),
+            )
+            self.page_key = key
+        return self.page
+
+    # Icon id of an entry's thumbnail, or 0 if its result file was removed.
+    def thumbnail_icon(self, entry: HistoryEntry) -> int:
+        if not os.path.exists(entry.output_path):
+            return 0
+        if self.previews is None:
+            self.previews = bpy.utils.previews.new()
+        key = str(entry.id)
+        if key not in self.previews:
+            if len(self.previews) >= MAX_LOADED_THUMBNAILS:
+                self.previews.clear()
+            self.previews.load(key, entry.output_path, "IMAGE")
+        return self.previews[key].icon_id
+
+    def release(self):
+        if self.previews is not None:
+            bpy.utils.previews.remove(self.previews)
+            self.previews = None
+        self.page_key = None
+
+
+history_gallery = HistoryGallery()
@@ -0,0 +1,255 @@
+from enum import Enum
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+HISTORY_FILENAME = "history.sqlite3"
+# Stored as the database's user_version, so later schema changes can tell which version a file has.
+SCHEMA_VERSION = 1
+
+
+class GenerationKind(Enum):
+    TEXT = 1
+    IMAGE = 2
+    TILED = 3
+    ANIMATION = 4
+
+
+# One generated image in the history.
+class HistoryEntry:
+    COLUMNS = (
+        "id",
+        "created_at",
+        "kind",
+        "prompt",
+        "seed",
+        "engine",
+        "width",
+        "height",
+        "steps",
+        "cost",
+        "duration",
+        "frame",
+        "output_path",
+        "args",
+    )
+
+    def __init__(self, row: tuple):
+        values = dict(zip(self.COLUMNS, row))
+        self.id: int = values["id"]
+        self.created_at: float = values["created_at"]
+        self.kind = GenerationKind[values["kind"]]
+        self.prompt: str = values["prompt"]
+        self.seed: Optional[int] = values["seed"]
+        self.engine: str = values["engine"]
+        self.width: int = values["width"]
+        self.height: int = values["height"]
+        self.steps: int = values["steps"]
+        self.cost: float = values["cost"]
+        # Seconds from sending the request to writing the result.
+        self.duration: float = values["duration"]
+        # Scene frame of an animation frame, otherwise None.
+        self.frame: Optional[int] = values["frame"]
+        self.output_path: str = values["output_path"]
+        self.args: dict = json.loads(values["args"])
+
+
+# Prompts of a request as one searchable string, strongest first.
+def format_prompt(prompts: List[dict]) -> str:
+    ordered = sorted(prompts, key=lambda p: -p.get("weight", 1.0))
+    return " | ".join(p["text"] for p in ordered if p.get("text"))
+
+
+# An FTS5 query matching entries whose prompt contains every word of text, each as a prefix.
+def fts_query(text: str) -> str:
+    words = text.split()
+    return " ".join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+
+# Persistent record of every generation, in an SQLite database in the user config directory. Prompts are indexed
+# with FTS5 when SQLite has it, so searching stays fast with tens of thousands of entries; otherwise search
+# falls back to LIKE. Written from the generation threads, so every access holds the lock.
+class HistoryStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.has_fts = self.create_schema()
+        # Bumped by every write, so the gallery knows when its cached page is out of date.
+        self.version = 0
+
+    def create_schema(self) -> bool:
+        with self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS generations (
+                    id INTEGER PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    kind TEXT NOT NULL,
+                    prompt TEXT NOT NULL,
+                    seed INTEGER,
+                    engine TEXT,
+                    width INTEGER,
+                    height INTEGER,
+                    steps INTEGER,
+                    cost REAL,
+                    duration REAL,
+                    frame INTEGER,
+                    output_path TEXT NOT NULL,
+                    args TEXT NOT NULL
+                )""")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS generations_kind ON generations (kind, id)"
+            )
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        try:
+            with self.connection:
+                self.connection.execute(
+                    """CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(
+                        prompt, content='generations', content_rowid='id'
+                    )"""
+                )
+                self.connection.execute(
+                    """CREATE TRIGGER IF NOT EXISTS generations_fts_insert
+                    AFTER INSERT ON generations BEGIN
+                        INSERT INTO generations_fts (rowid, prompt) VALUES (new.id, new.prompt);
+                    END"""
+                )
+                self.connection.execute(
+                    """CREATE TRIGGER IF NOT EXISTS generations_fts_delete
+                    AFTER DELETE ON generations BEGIN
+                        INSERT INTO generations_fts (generations_fts, rowid, prompt)
+                        VALUES ('delete', old.id, old.prompt);
+                    END"""
+                )
+            return True
+        except sqlite3.OperationalError as e:
+            print(
+                f"Full text search isn't available, searching history without it: {e}"
+            )
+            return False
+
+    # Record a generation. args are the request args; the API key is left out.
+    def record(
+        self,
+        kind: GenerationKind,
+        args: dict,
+        output_path: str,
+        cost: float = 0.0,
+        duration: float = 0.0,
+        frame: int = None,
+        engine: str = None,
+    ) -> int:
+        stored_args = {k: v for k, v in args.items() if k != "api_key"}
+        values = (
+            time.time(),
+            kind.name,
+            format_prompt(args.get("prompts", [])),
+            args.get("seed"),
+            engine or args.get("engine"),
+            args.get("width"),
+            args.get("height"),
+            args.get("steps"),
+            cost,
+            duration,
+            frame,
+            output_path,
+            json.dumps(stored_args),
+        )
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO generations ({}) VALUES ({})".format(
+                    ", ".join(HistoryEntry.COLUMNS[1:]),
+                    ", ".join("?" * len(values)),
+                ),
+                values,
+            )
+            self.version += 1
+            return cursor.lastrowid
+
+    # WHERE clause and parameters matching a search.
+    def filter_clause(
+        self, text: str, kind: Optional[GenerationKind]
+    ) -> Tuple[str, list]:
+        conditions, params = [], []
+        if text.strip():
+            if self.has_fts:
+                conditions.append(
+                    "id IN (SELECT rowid FROM generations_fts WHERE generations_fts MATCH ?)"
+                )
+                params.append(fts_query(text))
+            else:
+                for word in text.split():
+                    conditions.append("prompt LIKE ?")
+                    params.append(f"%{word}%")
+        if kind:
+            conditions.append("kind = ?")
+            params.append(kind.name)
+        return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+    # Entries matching a search, newest first.
+    def search(
+        self,
+        text: str = "",
+        kind: GenerationKind = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> List[HistoryEntry]:
+        where, params = self.filter_clause(text, kind)
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT {} FROM generations{} ORDER BY id DESC LIMIT ? OFFSET ?".format(
+                    ", ".join(HistoryEntry.COLUMNS), where
+                ),
+                params + [limit, offset],
+            ).fetchall()
+        return [HistoryEntry(row) for row in rows]
+
+    def count(self, text: str = "", kind: GenerationKind = None) -> int:
+        where, params = self.filter_clause(text, kind)
+        with self.lock:
+            return self.connection.execute(
+                f"SELECT COUNT(*) FROM generations{where}", params
+            ).fetchone()[0]
+
+    def get(self, entry_id: int) -> Optional[HistoryEntry]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT {} FROM generations WHERE id = ?".format(
+                    ", ".join(HistoryEntry.COLUMNS)
+                ),
+                (entry_id,),
+            ).fetchone()
+        return HistoryEntry(row) if row else None
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+_store: Optional[HistoryStore] = None
+_store_lock = threading.Lock()
+
+
+# The history in the given directory, opened on first use and reopened if the directory changes.
+def get_history_store(directory: str) -> HistoryStore:
+    global _store
+    path = os.path.join(directory, HISTORY_FILENAME)
+    with _store_lock:
+        if _store is None or _store.path != path:
+            if _store is not None:
+                _store.close()
+            _store = HistoryStore(path)
+        return _store
+
+
+def close_history_store():
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
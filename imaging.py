@@ -0,0 +1,141 @@
+import io
+
+from .frame_conversion import is_exr, open_display_image
+
+
+def has_pillow() -> bool:
+    try:
+        import PIL
+
+        return True
+    except ImportError:
+        return False
+
+
+def get_lanczos_filter():
+    from PIL import Image
+
+    # Pillow 9.1 moved the filters into Image.Resampling.
+    return getattr(Image, "Resampling", Image).LANCZOS
+
+
+# Read an init frame from disk, resize it to the init image size and encode it as PNG in memory, without
+# going through Blender image datablocks. Safe to call from worker threads. The frame can also be given as
+# encoded bytes. If Pillow isn't installed, or can't read the format, the frame is returned unchanged.
+def load_resized_png(path, width: int, height: int) -> bytes:
+    def read_unchanged() -> bytes:
+        if isinstance(path, bytes):
+            return path
+        with open(path, "rb") as f:
+            return f.read()
+
+    if not has_pillow():
+        return read_unchanged()
+    from PIL import Image, UnidentifiedImageError
+
+    source = io.BytesIO(path) if isinstance(path, bytes) else path
+    try:
+        with Image.open(source) as img:
+            img.load()
+            mode = "RGBA" if "A" in img.getbands() else "RGB"
+            img = img.convert(mode)
+            if img.size != (width, height):
+                img = img.resize((width, height), get_lanczos_filter())
+            buffer = io.BytesIO()
+            img.save(buffer, format="PNG")
+            return buffer.getvalue()
+    except (UnidentifiedImageError, OSError) as e:
+        name = "the init image" if isinstance(path, bytes) else path
+        print(f"Could not resize {name}, sending it unchanged: {e}")
+        return read_unchanged()
+
+
+# Size of frame signatures, chosen so they split evenly into the 9x8 grid used for perceptual hashes.
+SIGNATURE_SIZE = (36, 32)
+
+
+# Small grayscale version of an init frame, as floats in 0..1, used to compare frames cheaply.
+def frame_signature(path: str, size=SIGNATURE_SIZE):
+    import numpy as np
+    from PIL import Image
+
+    if is_exr(path):
+        img = open_display_image(path)
+    else:
+        img = Image.open(path)
+        # Lets JPEG decode at a reduced scale instead of decoding the full frame first.
+        img.draft("L", (size[0] * 4, size[1] * 4))
+    with img:
+        img = img.convert("L").resize(size, Image.BILINEAR)
+        return np.asarray(img, dtype=np.float32) / 255.0
+
+
+# 64 bit difference hashes of a stack of frame signatures: each signature is averaged down to 9x8, and each
+# bit says whether a cell is noticeably brighter than its left neighbour. The margin keeps render noise in
+# flat areas from flipping bits.
+def perceptual_hashes(signatures, margin: float = 0.01):
+    import numpy as np
+
+    count, height, width = signatures.shape
+    grid = signatures.reshape(count, 8, height // 8, 9, width // 9).mean(axis=(2, 4))
+    bits = grid[:, :, 1:] - grid[:, :, :-1] > margin
+    return np.packbits(bits.reshape(count, 64), axis=1).view(">u8").ravel()
+
+
+def hash_distance(hash_a, hash_b) -> int:
+    return bin(int(hash_a) ^ int(hash_b)).count("1")
+
+
+# Decode an image file (or encoded bytes) into a float32 RGB array, optionally resized to (width, height).
+# EXRs are tonemapped to sRGB like the frames that are uploaded.
+def load_rgb_array(source, size=None):
+    import numpy as np
+    from PIL import Image
+
+    if isinstance(source, (bytes, bytearray)):
+        img = Image.open(io.BytesIO(source))
+    elif is_exr(source):
+        img = open_display_image(source)
+    else:
+        img = Image.open(source)
+    with img:
+        img = img.convert("RGB")
+        if size and img.size != tuple(size):
+            img = img.resize(tuple(size), get_lanczos_filter())
+        return np.asarray(img, dtype=np.float32)
+
+
+def save_rgb_array(array, path: str):
+    import numpy as np
+    from PIL import Image
+
+    pixels = np.clip(np.rint(array), 0, 255).astype(np.uint8)
+    Image.fromarray(pixels, "RGB").save(path, format="PNG")
+
+
+# Synthesize the in-between frames of two generated keyframes. Each is a cross-fade of the generated
+# keyframes, plus the part of its init frame that a cross-fade of the init keyframes doesn't explain, scaled
+# by guidance - so motion in the render carries over instead of ghosting.
+# blends holds the position (0..1) of each in-between frame, init_frames the matching init frames.
+def interpolate_frames(gen_from, gen_to, init_from, init_to, init_frames, blends, guidance: float):
+    import numpy as np
+
+    blends = np.asarray(blends, dtype=np.float32)[:, None, None, None]
+    gen_fade = (1 - blends) * gen_from + blends * gen_to
+    init_fade = (1 - blends) * init_from + blends * init_to
+    return gen_fade + guidance * (np.stack(init_frames) - init_fade)
+
+
+# Decode an encoded result image into the pixels of a Blender image: (width, height, pixels), where pixels
+# is a flat float32 RGBA array with the bottom row first and values in 0..1. Doing this on the generation
+# thread leaves only the copy into the datablock for the main thread.
+def decode_image_pixels(data: bytes):
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert("RGBA")
+        width, height = img.size
+        pixels = np.asarray(img)[::-1].astype(np.float32).ravel()
+    pixels *= 1 / 255
+    return width, height, pixels
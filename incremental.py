@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import time
+from typing import Dict
+
+from .frame_plan import FramePlan, FrameSource
+
+INDEX_FILENAME = "generation_index.json"
+# Args that don't change the generated image.
+UNHASHED_ARGS = {"api_key", "base_url"}
+# Saving the index is throttled, since it's rewritten as every frame completes.
+SAVE_INTERVAL = 2.0
+
+
+def hash_values(*values) -> str:
+    payload = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def file_content_hash(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def args_hash(args: dict) -> str:
+    return hash_values({k: v for k, v in args.items() if k not in UNHASHED_ARGS})
+
+
+# Per output directory record of what each result was generated from: the init frame's content hash and a
+# key covering the frame's evaluated args (and for interpolated or reused frames, the frames they come from).
+# A re-run only regenerates frames whose key changed. Results are dropped entirely when the job-wide
+# settings change.
+class GenerationIndex:
+    def __init__(self, directory: str, settings_hash: str):
+        self.directory = directory
+        self.settings_hash = settings_hash
+        # frame index -> {"init_stat": [size, mtime], "init_hash": str, "key": str}
+        self.entries: Dict[int, dict] = {}
+        self.last_saved = 0.0
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, INDEX_FILENAME)
+
+    # Load the index of a directory. Returns an empty index if there is none, or if it was built with
+    # different job-wide settings, in which case stale is True.
+    @classmethod
+    def load(cls, directory: str, settings_hash: str):
+        index = cls(directory, settings_hash)
+        if not os.path.exists(index.path):
+            return index, False
+        try:
+            with open(index.path) as f:
+                payload = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Could not read generation index {index.path}: {e}")
+            return index, True
+        if payload.get("settings_hash") != settings_hash:
+            return index, True
+        index.entries = {int(k): v for k, v in payload.get("frames", {}).items()}
+        return index, False
+
+    # Content hash of an init frame, reusing the stored hash if the file's size and mtime haven't changed.
+    def init_hash(self, frame_idx: int, path: str) -> str:
+        stat = os.stat(path)
+        init_stat = [stat.st_size, stat.st_mtime_ns]
+        entry = self.entries.get(frame_idx)
+        if entry and entry.get("init_stat") == init_stat:
+            return entry["init_hash"]
+        content_hash = file_content_hash(path)
+        self.entries[frame_idx] = {
+            "init_stat": init_stat,
+            "init_hash": content_hash,
+            # Frame keys include the init hash, so a changed frame no longer matches its old key.
+            "key": entry.get("key") if entry else None,
+        }
+        return content_hash
+
+    def is_current(self, frame_idx: int, key: str) -> bool:
+        entry = self.entries.get(frame_idx)
+        return bool(entry and entry.get("key") == key)
+
+    def record(self, frame_idx: int, key: str):
+        entry = self.entries.setdefault(frame_idx, {})
+        entry["key"] = key
+
+    def save(self, force: bool = False):
+        now = time.time()
+        if not force and now - self.last_saved < SAVE_INTERVAL:
+            return
+        self.last_saved = now
+        payload = {
+            "settings_hash": self.settings_hash,
+            "frames": {str(k): v for k, v in self.entries.items()},
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, self.path)
+
+
+# Key of every frame in the plan. Generated frames are keyed by their init frame and args; interpolated
+# and reused frames also by the keys of the frames they are made from, so they follow any change to those.
+def compute_frame_keys(
+    plan: FramePlan, index: GenerationIndex, args_for_frame, guidance: float
+) -> Dict[int, str]:
+    init_hashes = {f.index: index.init_hash(f.index, f.init_path) for f in plan.frames}
+    keys = {}
+    for frame in plan.frames:
+        if frame.source == FrameSource.GENERATE:
+            keys[frame.index] = hash_values(
+                init_hashes[frame.index], args_hash(args_for_frame(frame.frame))
+            )
+    for frame in plan.frames:
+        if frame.source == FrameSource.REUSE:
+            keys[frame.index] = hash_values("reuse", keys[frame.reuse_index])
+    for frame in plan.frames:
+        if frame.source == FrameSource.INTERPOLATE:
+            keys[frame.index] = hash_values(
+                "interpolate",
+                init_hashes[frame.index],
+                keys[frame.from_index],
+                keys[frame.to_index],
+                frame.blend,
+                guidance,
+            )
+    return keys
+
+
+# Remove the results of the plan's frames, which can't be trusted after the job-wide settings changed.
+def remove_stale_outputs(plan: FramePlan):
+    for frame in plan.frames:
+        if os.path.exists(frame.output_path):
+            os.remove(frame.output_path)
@@ -0,0 +1,89 @@
+import numpy as np
+
+# Generation settings that can be keyframed, and the REST arg each one maps to.
+ANIMATABLE_SETTINGS = {
+    "init_strength": "init_strength",
+    "cfg_scale": "cfg_scale",
+    "steps": "steps",
+    "seed": "seed",
+}
+INTEGER_SETTINGS = {"steps", "seed"}
+
+
+# Keyframed generation params evaluated for every frame of a job, one read-only array per param, indexed
+# through the sorted frame numbers. Built once on the main thread, then only read by the generation
+# threads, so they never need to call scene.frame_set().
+class ParameterTable:
+    def __init__(self, frames: np.ndarray, setting_columns: dict, prompt_columns: dict):
+        self.frames = frames
+        # REST arg name -> values per frame
+        self.setting_columns = setting_columns
+        # prompt index -> weight per frame
+        self.prompt_columns = prompt_columns
+        for column in [frames, *setting_columns.values(), *prompt_columns.values()]:
+            column.setflags(write=False)
+
+    @property
+    def is_animated(self) -> bool:
+        return bool(self.setting_columns or self.prompt_columns)
+
+    def row_for_frame(self, frame: int) -> int:
+        row = int(np.searchsorted(self.frames, frame))
+        if row >= len(self.frames) or self.frames[row] != frame:
+            raise KeyError(f"Frame {frame} was not baked into the parameter table")
+        return row
+
+    # The REST args for a frame: the base args with every keyframed value replaced by its value on that frame.
+    def args_for_frame(self, base_args: dict, frame: int) -> dict:
+        args = dict(base_args)
+        if not self.is_animated:
+            return args
+        row = self.row_for_frame(frame)
+        for arg_name, column in self.setting_columns.items():
+            args[arg_name] = column[row].item()
+        if self.prompt_columns:
+            args["prompts"] = [dict(prompt) for prompt in base_args["prompts"]]
+            for prompt_idx, column in self.prompt_columns.items():
+                if prompt_idx < len(args["prompts"]):
+                    args["prompts"][prompt_idx]["weight"] = column[row].item()
+        return args
+
+
+def get_scene_fcurves(scene) -> dict:
+    anim_data = scene.animation_data
+    if not anim_data or not anim_data.action:
+        return {}
+    return {fcurve.data_path: fcurve for fcurve in anim_data.action.fcurves}
+
+
+def evaluate_fcurve(fcurve, frames: np.ndarray, dtype) -> np.ndarray:
+    values = np.fromiter(
+        (fcurve.evaluate(float(frame)) for frame in frames),
+        dtype=np.float64,
+        count=len(frames),
+    )
+    if dtype == np.int64:
+        return np.rint(values).astype(np.int64)
+    return values
+
+
+# Read the fcurves of every keyframed generation param once, for all the given frame numbers. Must be
+# called from the main thread. Params that aren't keyframed keep the value already in the base args.
+def bake_parameter_table(scene, frames, use_recommended_settings: bool) -> ParameterTable:
+    frames = np.unique(np.asarray(frames, dtype=np.int64))
+    fcurves = get_scene_fcurves(scene)
+    setting_columns = {}
+    for setting_name, arg_name in ANIMATABLE_SETTINGS.items():
+        # Recommended settings override the step count, so a keyframed value would be ignored anyway.
+        if setting_name == "steps" and use_recommended_settings:
+            continue
+        fcurve = fcurves.get(f"ds_settings.{setting_name}")
+        if fcurve:
+            dtype = np.int64 if setting_name in INTEGER_SETTINGS else np.float64
+            setting_columns[arg_name] = evaluate_fcurve(fcurve, frames, dtype)
+    prompt_columns = {}
+    for prompt_idx in range(len(scene.prompt_list)):
+        fcurve = fcurves.get(f"prompt_list[{prompt_idx}].strength")
+        if fcurve:
+            prompt_columns[prompt_idx] = evaluate_fcurve(fcurve, frames, np.float64)
+    return ParameterTable(frames, setting_columns, prompt_columns)
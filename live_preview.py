@@ -0,0 +1,83 @@
+from bisect import bisect_left, bisect_right, insort
+import threading
+import time
+from typing import Dict, List, Tuple
+
+# The sequencer strip is updated at most this often, so frames that complete in quick succession are added in
+# one batch and the UI stays responsive.
+UPDATE_INTERVAL = 0.5
+PREVIEW_STRIP_NAME = "Stability Animation"
+
+
+# Hands completed frames from the generation threads to the main thread, which is the only one allowed to
+# change Blender data.
+class LiveFrameChannel:
+    def __init__(self, interval: float = UPDATE_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending: List[Tuple[int, str]] = []
+        self.last_taken = 0.0
+
+    # Called from the generation threads as each frame's output is written.
+    def push(self, frame: int, path: str):
+        with self.lock:
+            self.pending.append((frame, path))
+
+    # The frames completed since the last call, or nothing if the last call was too recent, unless forced.
+    def take(self, force: bool = False) -> List[Tuple[int, str]]:
+        now = time.time()
+        with self.lock:
+            if not force and now - self.last_taken < self.interval:
+                return []
+            self.last_taken = now
+            frames, self.pending = self.pending, []
+        return frames
+
+
+# Which result each frame of the timeline shows while an animation job runs: the latest completed frame at or
+# before it, or the earliest completed frame if none is. A frame that completes out of order, or is retried,
+# replaces the frames that were holding an earlier result.
+class HeldFrameSequence:
+    def __init__(self, first_frame: int):
+        self.first_frame = first_frame
+        self.completed: List[int] = []
+        self.paths: Dict[int, str] = {}
+        # Path shown at each position, starting at first_frame.
+        self.shown: List[str] = []
+
+    def path_for(self, frame: int) -> str:
+        i = bisect_right(self.completed, frame)
+        return self.paths[self.completed[max(0, i - 1)]]
+
+    # Add completed frames. Returns the positions whose path changed, in order; positions past the end of the
+    # previous sequence are new.
+    def add(self, frames: List[Tuple[int, str]]) -> List[int]:
+        dirty = set()
+        for frame, path in frames:
+            frame = max(frame, self.first_frame)
+            if frame not in self.paths:
+                insort(self.completed, frame)
+            self.paths[frame] = path
+            i = bisect_left(self.completed, frame)
+            start = frame if i > 0 else self.first_frame
+            end = (
+                self.completed[i + 1]
+                if i + 1 < len(self.completed)
+                else self.completed[-1] + 1
+            )
+            dirty.update(range(start - self.first_frame, end - self.first_frame))
+        if not self.completed:
+            return []
+        length = self.completed[-1] - self.first_frame + 1
+        dirty.update(range(len(self.shown), length))
+        changed = []
+        for position in sorted(dirty):
+            path = self.path_for(self.first_frame + position)
+            if position >= len(self.shown):
+                self.shown.append(path)
+            elif self.shown[position] == path:
+                continue
+            else:
+                self.shown[position] = path
+            changed.append(position)
+        return changed
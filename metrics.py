@@ -0,0 +1,275 @@
+from contextlib import contextmanager
+from enum import Enum
+import json
+import math
+import threading
+import time
+from typing import Iterable, Optional
+
+
+# Phases of a single generation that are timed separately, so a slow network can be told apart from a
+# slow server. Numbered in the order they happen, which is the order they're reported in, with the total last.
+class Phase(Enum):
+    INIT_RENDER = 1
+    IMAGE_SCALING = 2
+    UPLOAD = 3
+    SERVER = 4
+    DOWNLOAD = 5
+    DECODE = 6
+    # Writing a result file to disk.
+    WRITE = 7
+    # Synthesizing in-between frames locally.
+    INTERPOLATE = 8
+    # Wall time for the whole frame, from the start of its preparation to the result being written.
+    TOTAL = 9
+
+
+PHASE_LABELS = {
+    Phase.INIT_RENDER: "Init Render",
+    Phase.IMAGE_SCALING: "Scaling",
+    Phase.UPLOAD: "Upload",
+    Phase.SERVER: "Server",
+    Phase.DOWNLOAD: "Download",
+    Phase.DECODE: "Decode",
+    Phase.WRITE: "Write",
+    Phase.INTERPOLATE: "Interpolate",
+    Phase.TOTAL: "Total",
+}
+
+
+# HDR-style latency histogram. Values are recorded in microseconds: below 2^bits each value has its own
+# bucket, above that every power of two is split into 2^(bits - 1) linear sub-buckets. This keeps the
+# relative error under 2^-(bits - 1) across the whole range, with a small, sparse set of buckets.
+class LatencyHistogram:
+    def __init__(self, sub_bucket_bits: int = 7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.sub_bucket_half = self.sub_bucket_count >> 1
+        self.counts = {}
+        self.count = 0
+        self.total_us = 0
+        self.min_us = None
+        self.max_us = None
+
+    def bucket_index(self, value_us: int) -> int:
+        if value_us < self.sub_bucket_count:
+            return value_us
+        shift = value_us.bit_length() - self.sub_bucket_bits
+        mantissa = value_us >> shift
+        return (
+            self.sub_bucket_count
+            + (shift - 1) * self.sub_bucket_half
+            + (mantissa - self.sub_bucket_half)
+        )
+
+    # The midpoint of the range of values that fall in a bucket.
+    def bucket_value(self, index: int) -> float:
+        if index < self.sub_bucket_count:
+            return float(index)
+        offset = index - self.sub_bucket_count
+        shift = offset // self.sub_bucket_half + 1
+        mantissa = offset % self.sub_bucket_half + self.sub_bucket_half
+        low = mantissa << shift
+        high = ((mantissa + 1) << shift) - 1
+        return (low + high) / 2
+
+    def record(self, seconds: float):
+        value_us = max(0, int(seconds * 1_000_000))
+        index = self.bucket_index(value_us)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total_us += value_us
+        self.min_us = value_us if self.min_us is None else min(self.min_us, value_us)
+        self.max_us = value_us if self.max_us is None else max(self.max_us, value_us)
+
+    # Value at the given percentile (0-100), in milliseconds.
+    def percentile(self, percentile: float) -> float:
+        if self.count == 0:
+            return 0.0
+        target = max(1, int(round(percentile / 100 * self.count)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                value_us = min(max(self.bucket_value(index), self.min_us), self.max_us)
+                return value_us / 1000
+        return self.max_us / 1000
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "min_ms": (self.min_us or 0) / 1000,
+            "max_ms": (self.max_us or 0) / 1000,
+            "mean_ms": self.total_us / self.count / 1000 if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+        }
+
+
+# Per-phase latency histograms for one generation job. Recorded to from the generation threads and read
+# from the UI, so all access goes through a lock.
+class JobMetrics:
+    def __init__(self):
+        self.started_at = time.time()
+        self.histograms = {phase: LatencyHistogram() for phase in Phase}
+        self.lock = threading.Lock()
+
+    def record(self, phase: Phase, seconds: float):
+        with self.lock:
+            self.histograms[phase].record(seconds)
+
+    @contextmanager
+    def timer(self, phase: Phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start)
+
+    # (phase, count, p50 ms, p95 ms) for every phase that has been recorded.
+    def summary(self):
+        with self.lock:
+            return [
+                (phase, hist.count, hist.percentile(50), hist.percentile(95))
+                for phase, hist in self.histograms.items()
+                if hist.count > 0
+            ]
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "started_at": self.started_at,
+                "phases": {
+                    phase.name.lower(): hist.to_dict()
+                    for phase, hist in self.histograms.items()
+                },
+            }
+
+    def export_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+# How quickly the throughput estimate follows changes in speed. Completions are weighted by how recent they
+# are, decaying by 1/e every this many seconds, so a burst of frames finishing together counts the same as
+# the same frames finishing evenly.
+THROUGHPUT_TIME_CONSTANT = 30.0
+
+
+# Progress of an animation job: which frames are done, in flight and failed, and an exponentially weighted
+# moving average of completed frames per second to project the time left from. Frames are tracked by index,
+# so frames that complete out of order or are retried are only counted once. Updated from the generation
+# threads and read from the UI.
+class JobProgress:
+    def __init__(
+        self,
+        total_frames: int,
+        concurrency: int,
+        completed: Iterable[int] = (),
+        time_constant: float = THROUGHPUT_TIME_CONSTANT,
+    ):
+        self.total_frames = total_frames
+        self.concurrency = concurrency
+        self.time_constant = time_constant
+        self.completed = set(completed)
+        self.in_flight = set()
+        self.failed = set()
+        # Frames per second, None until the first frame of this run completes.
+        self.rate: Optional[float] = None
+        self.started_at = time.time()
+        self.last_sample_at = self.started_at
+        self.pending_completions = 0
+        self.lock = threading.Lock()
+
+    def frame_started(self, index: int):
+        with self.lock:
+            self.in_flight.add(index)
+            self.failed.discard(index)
+
+    def frame_failed(self, index: int):
+        with self.lock:
+            self.in_flight.discard(index)
+            self.failed.add(index)
+
+    def frame_completed(self, index: int, now: float = None):
+        with self.lock:
+            self.in_flight.discard(index)
+            self.failed.discard(index)
+            if index in self.completed:
+                return
+            self.completed.add(index)
+            self.record_completions(1, now or time.time())
+
+    def record_completions(self, count: int, now: float):
+        self.pending_completions += count
+        self.rate = self.projected_rate(now)
+        if now > self.last_sample_at:
+            self.last_sample_at = now
+            self.pending_completions = 0
+
+    # The moving average with the completions since the last sample, and the time since then, folded in. While
+    # no frame completes, this decays the longer the wait gets.
+    def projected_rate(self, now: float) -> Optional[float]:
+        elapsed = now - self.last_sample_at
+        if elapsed <= 0:
+            return self.rate
+        sample = self.pending_completions / elapsed
+        if self.rate is None:
+            return sample if self.pending_completions else None
+        weight = 1 - math.exp(-elapsed / self.time_constant)
+        return self.rate + weight * (sample - self.rate)
+
+    @property
+    def remaining_frames(self) -> int:
+        with self.lock:
+            return max(0, self.total_frames - len(self.completed))
+
+    def frames_per_minute(self, now: float = None) -> Optional[float]:
+        with self.lock:
+            rate = self.projected_rate(now or time.time())
+        return rate * 60 if rate is not None else None
+
+    # Projected seconds until every frame is done, None until there is a rate to project from.
+    def eta_seconds(self, now: float = None) -> Optional[float]:
+        with self.lock:
+            rate = self.projected_rate(now or time.time())
+            remaining = max(0, self.total_frames - len(self.completed))
+        if remaining == 0:
+            return 0.0
+        if not rate:
+            return None
+        return remaining / rate
+
+    def snapshot(self, now: float = None) -> dict:
+        now = now or time.time()
+        eta = self.eta_seconds(now)
+        frames_per_minute = self.frames_per_minute(now)
+        with self.lock:
+            return {
+                "completed": len(self.completed),
+                "total": self.total_frames,
+                "in_flight": len(self.in_flight),
+                "failed": len(self.failed),
+                "concurrency": self.concurrency,
+                "frames_per_minute": (
+                    round(frames_per_minute, 2)
+                    if frames_per_minute is not None
+                    else None
+                ),
+                "eta_seconds": round(eta, 1) if eta is not None else None,
+            }
+
+
+job_metrics = JobMetrics()
+
+
+# Start collecting timings for a new job. The previous job's metrics stay readable until this is called.
+def start_job_metrics() -> JobMetrics:
+    global job_metrics
+    job_metrics = JobMetrics()
+    return job_metrics
+
+
+def get_job_metrics() -> JobMetrics:
+    return job_metrics
@@ -1,8 +1,11 @@
 from datetime import datetime
 from enum import Enum
 import heapq
+import json
+import random
+import sqlite3
 import subprocess
-from typing import List
+from typing import List, Optional, Tuple
 import bpy
 from bpy.props import (
     StringProperty,
@@ -24,6 +27,7 @@ import webbrowser
 from bpy.app.handlers import persistent
 
 from .data import (
+    API_KEY_ENV_VAR,
     DSAccount,
     TrackingEvent,
     UIContext,
@@ -31,29 +35,112 @@ from .data import (
     OutputDisplayLocation,
     RenderState,
     copy_image,
+    estimate_frame_credits,
+    estimate_preview_credits,
+    get_tile_layout,
+    format_preview_args,
     format_rest_args,
-    get_anim_images,
+    get_anim_frame_index,
+    get_anim_frame_selection,
+    get_credit_limit,
     get_init_image_dimensions,
     get_init_type,
+    get_history_directory,
+    get_output_root,
     get_preferences,
+    get_retention_policy,
     get_settings,
     initialize_sentry,
     log_sentry_event,
     prompt_to_filename,
     get_presets_file_location,
 )
+from .budget import CreditBudget, JobCheckpoint
+from .datablocks import (
+    AddonImageKind,
+    benchmark_result_loading,
+    collect_texture_images,
+    free_orphan_images,
+    is_replaceable_output,
+    pixel_buffer,
+    read_image_rgba8,
+    remove_image,
+    tag_image,
+    write_result_pixels,
+)
+from .frame_index import FrameSelection, format_frame_list
+from .frame_plan import (
+    FramePlan,
+    KeyframeMode,
+    build_frame_plan,
+    copy_reused_frames,
+    estimate_api_calls,
+    synthesize_segment,
+)
+from .imaging import decode_image_pixels, has_pillow, load_resized_png
+from .frame_conversion import (
+    CACHE_DIRNAME as CONVERTED_FRAMES_DIRNAME,
+    FrameConverter,
+    needs_conversion,
+)
+from .incremental import (
+    GenerationIndex,
+    compute_frame_keys,
+    hash_values,
+    remove_stale_outputs,
+)
+from .keyframes import ParameterTable, bake_parameter_table
+from .metrics import JobProgress, Phase, get_job_metrics, start_job_metrics
 from .dependencies import install_dependencies, check_dependencies_installed
+from .pipeline import FrameTask, Pipeline
+from .sharding import Shard, ShardCoordinator, split_frames
+from .render_capture import (
+    RENDER_RESULT_NAME,
+    RenderCapture,
+    capture_render_result,
+)
+from .batch_textures import (
+    DIRECT_INIT_EXTENSIONS,
+    BatchItem,
+    BatchStatus,
+    BatchTextureJob,
+)
+from .history import GenerationKind, HistoryStore, get_history_store
+from .tiling import (
+    MIN_TILE_SIDE,
+    Tile,
+    TileAssembler,
+    TileLayout,
+    TileProgress,
+    TileStatus,
+    needs_tiling,
+    split_image,
+)
+from .runs import (
+    RunKind,
+    create_run_directory,
+    latest_run_directory,
+    start_retention_cleanup,
+)
+from .live_preview import (
+    PREVIEW_STRIP_NAME,
+    UPDATE_INTERVAL,
+    HeldFrameSequence,
+    LiveFrameChannel,
+)
+from .video import VideoAssembler, VideoOutput
 from .requests import (
+    DEFAULT_ENGINE_NAME,
+    generate_img2img,
     get_account_details,
     log_analytics_event,
     render_img2img,
     render_text2img,
+    write_result_image,
 )
 import multiprocessing as mp
 import threading
-from glob import glob
 import platform
-import tempfile
 import time
 
 
@@ -66,29 +153,36 @@ def open_folder(dir: str):
         subprocess.call(["xdg-open", dir])
 
 
-# Create and clear render directories. This function should get all filesystem info for rendering,
-# as well as any platform specific info.
-def setup_render_directories(clear_anim=True):
-    addon_data_dir = os.path.join(tempfile.gettempdir(), "stability")
-    rendered_dir = os.path.join(addon_data_dir, "rendered")
-    generated_images_dir = os.path.join(addon_data_dir, "generated_images")
-    generated_animation_dir = os.path.join(addon_data_dir, "generated_animation")
-    for dir in [
-        addon_data_dir,
-        generated_images_dir,
-        rendered_dir,
-        generated_animation_dir,
-    ]:
-        if not os.path.exists(dir):
-            os.mkdir(dir)
+# Create the render directory, and the output directory of a run: a new run directory, or the latest one of
+# its kind for jobs that continue the last run. Old runs are removed in the background, by the retention policy
+# set in the preferences. This function should get all filesystem info for rendering, as well as any platform
+# specific info.
+def setup_render_directories(run_kind: RunKind, new_run: bool = True):
+    root = get_output_root()
+    rendered_dir = os.path.join(root, "rendered")
+    os.makedirs(rendered_dir, exist_ok=True)
+    run_dir = None if new_run else latest_run_directory(root, run_kind)
+    if not run_dir:
+        run_dir = create_run_directory(root, run_kind)
+    for dir in [root, rendered_dir, run_dir]:
         if not os.access(dir, os.W_OK):
             raise Exception(
                 f"Directory {dir} is not writable. Please check your Blender application permissions."
             )
-        if dir == generated_animation_dir and clear_anim:
-            for file in glob(os.path.join(dir, "*")):
-                os.remove(file)
-    return rendered_dir, generated_images_dir, generated_animation_dir
+    if new_run:
+        paused_job = StateOperator.paused_job
+        start_retention_cleanup(
+            root,
+            get_retention_policy(),
+            keep=[run_dir, paused_job.output_directory if paused_job else None],
+        )
+    return rendered_dir, run_dir
+
+
+# The output directory of the last run of a kind, without creating one.
+def get_latest_output_directory(run_kind: RunKind) -> str:
+    root = get_output_root()
+    return latest_run_directory(root, run_kind) or root
 
 
 class ContinueRenderOperator(Operator):
@@ -98,6 +192,8 @@ class ContinueRenderOperator(Operator):
     bl_label = "Continue"
 
     def execute(self, context):
+        if StateOperator.render_state == RenderState.PREVIEW:
+            StateOperator.render_start_time = time.time()
         StateOperator.render_state = RenderState.DIFFUSING
         return {"FINISHED"}
 
@@ -146,6 +242,346 @@ class SceneRenderExistingOutputOperator(Operator):
         return {"FINISHED"}
 
 
+# A batch item for an image texture. The init image is read straight from the image's file if it has an
+# unchanged one in a format Pillow reads, and otherwise from its pixels, here on the main thread.
+def prepare_batch_item(index: int, image) -> BatchItem:
+    width, height = image.size
+    item = BatchItem(index, image.name, width, height, image.channels, image.is_float)
+    path = bpy.path.abspath(image.filepath) if image.source == "FILE" else ""
+    if (
+        path
+        and not image.packed_file
+        and not image.is_dirty
+        and os.path.splitext(path)[1].lower() in DIRECT_INIT_EXTENSIONS
+        and os.path.exists(path)
+    ):
+        item.init_path = path
+    else:
+        item.init_pixels = read_image_rgba8(image)
+    return item
+
+
+class BatchTextureOperator(Operator):
+    """Generate every image texture used by the materials of the selected objects as one job, several at a time, writing each result back into its image as it completes"""
+
+    bl_idname = "dreamstudio.batch_textures"
+    bl_label = "Dream All Textures on Selected"
+
+    timer = None
+
+    def finish(self, context):
+        context.window_manager.event_timer_remove(self.timer)
+        StateOperator.batch_job = None
+        pixel_buffer.release()
+        return {"FINISHED"}
+
+    # Copy the textures generated since the last update into their images.
+    def write_completed(self, job: BatchTextureJob):
+        for item in job.take_completed():
+            image = bpy.data.images.get(item.image_name)
+            if (
+                not image
+                or tuple(image.size) != (item.width, item.height)
+                or image.channels != item.channels
+            ):
+                job.fail(item, "The image was removed or resized.")
+                continue
+            pixel_buffer.write(image, item.result_pixels)
+            item.result_pixels = None
+            item.status = BatchStatus.DONE
+        StateOperator.current_frame_idx = job.count(BatchStatus.DONE)
+
+    def modal(self, context, event):
+        job = StateOperator.batch_job
+        if not job or StateOperator.render_state == RenderState.IDLE:
+            return self.finish(context)
+        if event.type != "TIMER":
+            return {"PASS_THROUGH"}
+        self.write_completed(job)
+        for area in context.screen.areas:
+            area.tag_redraw()
+        if not job.finished:
+            return {"PASS_THROUGH"}
+        self.write_completed(job)
+        StateOperator.render_state = RenderState.IDLE
+        failed = [item for item in job.items if item.status == BatchStatus.FAILED]
+        if job.error:
+            self.report({"ERROR"}, "Batch generation failed: {}".format(job.error))
+        elif failed:
+            self.report(
+                {"WARNING"},
+                "{} of {} textures failed. First error: {}: {}".format(
+                    len(failed), len(job.items), failed[0].image_name, failed[0].error
+                ),
+            )
+        else:
+            self.report({"INFO"}, "Generated {} textures.".format(len(job.items)))
+        return self.finish(context)
+
+    def execute(self, context):
+        settings = context.scene.ds_settings
+        scene = context.scene
+        if not has_pillow():
+            self.report(
+                {"ERROR"}, "Batch generation needs Pillow. Reinstall dependencies."
+            )
+            return {"CANCELLED"}
+        width, height = get_init_image_dimensions(settings, scene)
+        if needs_tiling(width, height):
+            self.report(
+                {"ERROR"}, "Batch generation is limited to init images of 1 megapixel."
+            )
+            return {"CANCELLED"}
+        images = collect_texture_images(context.selected_objects)
+        if not images:
+            self.report(
+                {"ERROR"},
+                "No image textures found in the materials of the selected objects.",
+            )
+            return {"CANCELLED"}
+
+        StateOperator.kill_render_thread()
+        args = format_rest_args(settings, scene.prompt_list)
+        cost = estimate_frame_credits(args["width"], args["height"], args["steps"])
+        credit_limit = get_credit_limit(settings, StateOperator.account)
+        if credit_limit is not None:
+            if credit_limit < cost:
+                self.report(
+                    {"ERROR"},
+                    "Not enough credits left in the budget or balance to generate a texture.",
+                )
+                return {"CANCELLED"}
+            if len(images) * cost > credit_limit:
+                self.report(
+                    {"WARNING"},
+                    "Projected cost of {} credits is over the {} credit limit. Only {} of {} textures will be generated.".format(
+                        round(len(images) * cost, 2),
+                        round(credit_limit, 2),
+                        int(credit_limit // cost),
+                        len(images),
+                    ),
+                )
+
+        _, out_dir = setup_render_directories(RunKind.IMAGES)
+        items = []
+        for index, image in enumerate(images):
+            item = prepare_batch_item(index, image)
+            item.cost = cost
+            items.append(item)
+        budget = CreditBudget(credit_limit)
+        job = BatchTextureJob(
+            items,
+            args,
+            out_dir,
+            settings.max_concurrent_requests,
+            budget,
+            open_history(),
+        )
+        job.start()
+
+        StateOperator.batch_job = job
+        StateOperator.generated_output_dir = out_dir
+        StateOperator.render_state = RenderState.DIFFUSING
+        StateOperator.render_start_time = time.time()
+        StateOperator.current_frame_idx = 0
+        StateOperator.total_frame_count = len(items)
+        StateOperator.frame_plan = None
+        StateOperator.job_progress = None
+        StateOperator.tile_progress = None
+        StateOperator.credit_budget = budget
+
+        wm = context.window_manager
+        self.timer = wm.event_timer_add(UPDATE_INTERVAL, window=context.window)
+        wm.modal_handler_add(self)
+        return {"RUNNING_MODAL"}
+
+
+class ResumeJobOperator(Operator):
+    """Resume a paused animation job, generating only the frames that are not done yet"""
+
+    bl_idname = "dreamstudio.resume_job"
+    bl_label = "Resume"
+
+    def execute(self, context):
+        StateOperator.ui_context = UIContext.SCENE_VIEW
+        StateOperator.render_state = RenderState.RENDERING
+        StateOperator.resume_job = True
+        StateOperator.render_start_time = time.time()
+        bpy.ops.dreamstudio.dream_render_operator()
+        return {"FINISHED"}
+
+
+class ShardedRenderOperator(Operator):
+    """Generate the animation in several background Blender processes, each working on part of the frame range"""
+
+    bl_idname = "dreamstudio.render_sharded"
+    bl_label = "Dream (Background Processes)"
+
+    timer = None
+
+    def finish(self, context):
+        context.window_manager.event_timer_remove(self.timer)
+        StateOperator.shard_coordinator = None
+        return {"FINISHED"}
+
+    def modal(self, context, event):
+        coordinator = StateOperator.shard_coordinator
+        if not coordinator or StateOperator.render_state == RenderState.IDLE:
+            return self.finish(context)
+        if event.type != "TIMER":
+            return {"PASS_THROUGH"}
+        StateOperator.current_frame_idx = coordinator.completed
+        StateOperator.total_frame_count = coordinator.total
+        for area in context.screen.areas:
+            area.tag_redraw()
+        if not coordinator.finished:
+            return {"PASS_THROUGH"}
+        StateOperator.render_state = RenderState.IDLE
+        failed = coordinator.failed_shards
+        if failed:
+            self.report(
+                {"ERROR"},
+                "{} of {} processes failed. First error: {}".format(
+                    len(failed), len(coordinator.shards), failed[0].error
+                ),
+            )
+        else:
+            open_folder(coordinator.output_directory)
+        return self.finish(context)
+
+    def execute(self, context):
+        settings = context.scene.ds_settings
+        scene = context.scene
+        StateOperator.kill_render_thread()
+        if FrameSelection[settings.frame_selection] == FrameSelection.FAILED:
+            self.report(
+                {"ERROR"}, "Failed frames can only be retried in a single process."
+            )
+            return {"CANCELLED"}
+        frame_index = get_anim_frame_index()
+        init_frames, _ = get_anim_frame_selection(scene, frame_index)
+        frame_chunks = split_frames(
+            [frame for frame, _ in init_frames], settings.shard_count
+        )
+        if not frame_chunks:
+            self.report({"ERROR"}, "No rendered frames found in the frame selection.")
+            return {"CANCELLED"}
+        _, generated_animation_dir = setup_render_directories(
+            RunKind.ANIMATION, new_run=not settings.incremental_generation
+        )
+        # Each process keeps its checkpoint and frame plan here, apart from the shared results.
+        shards_dir = os.path.join(generated_animation_dir, "shards")
+        os.makedirs(shards_dir, exist_ok=True)
+
+        # The processes load a copy of the scene, so that unsaved changes are included.
+        blend_path = os.path.join(shards_dir, "job.blend")
+        bpy.ops.wm.save_as_mainfile(
+            filepath=blend_path, copy=True, check_existing=False
+        )
+        # Each process only has part of the frames, so none of them can assemble the video.
+        job_settings = {"video_output": VideoOutput.NONE.name}
+        if settings.use_credit_budget:
+            job_settings["credit_budget"] = settings.credit_budget / len(frame_chunks)
+        shards = []
+        for shard_idx, frames in enumerate(frame_chunks):
+            state_dir = os.path.join(shards_dir, f"shard_{shard_idx}")
+            os.makedirs(state_dir, exist_ok=True)
+            job = {
+                "frames_dir": frame_index.directory,
+                "output_dir": generated_animation_dir,
+                "state_dir": state_dir,
+                "frames": format_frame_list(frames),
+                # The stride is already applied to the frames.
+                "stride": 1,
+                "prompts": [
+                    {"text": p.prompt, "weight": p.strength} for p in scene.prompt_list
+                ],
+                "engine": settings.generation_engine,
+                "concurrency": settings.max_concurrent_requests,
+                "settings": job_settings,
+            }
+            with open(os.path.join(state_dir, "job.json"), "w") as f:
+                json.dump(job, f, indent=1)
+            shards.append(Shard(shard_idx, frames, state_dir))
+
+        cli_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+
+        def command_for_shard(shard: Shard):
+            return [
+                bpy.app.binary_path,
+                "-b",
+                blend_path,
+                "--python",
+                cli_path,
+                "--",
+                "--job",
+                os.path.join(shard.state_directory, "job.json"),
+            ]
+
+        # Passed through the environment rather than the command line, so it doesn't show up in process lists.
+        env = dict(os.environ)
+        env[API_KEY_ENV_VAR] = get_preferences().api_key
+        coordinator = ShardCoordinator(
+            shards, generated_animation_dir, command_for_shard, env
+        )
+        coordinator.start()
+        StateOperator.shard_coordinator = coordinator
+        StateOperator.generated_output_dir = generated_animation_dir
+        StateOperator.ui_context = UIContext.SCENE_VIEW
+        StateOperator.render_state = RenderState.DIFFUSING
+        StateOperator.render_start_time = time.time()
+        StateOperator.current_frame_idx = 0
+        StateOperator.total_frame_count = coordinator.total
+        StateOperator.frame_plan = None
+        StateOperator.job_progress = None
+        StateOperator.credit_budget = None
+
+        wm = context.window_manager
+        self.timer = wm.event_timer_add(0.5, window=context.window)
+        wm.modal_handler_add(self)
+        return {"RUNNING_MODAL"}
+
+
+# Gather what an animation job needs from Blender data on the main thread: the selected init frames as
+# (frame number, path), the checkpoint to continue from, and every keyframed param evaluated up front, instead
+# of changing the scene frame from the generation thread. Resuming continues the checkpoint in state_dir over
+# the same frames; retrying failed frames continues it with only the frames that didn't complete.
+def prepare_animation_job(scene, state_dir: str, resume_job: bool):
+    settings = scene.ds_settings
+    frame_index = get_anim_frame_index()
+    retry_failed = FrameSelection[settings.frame_selection] == FrameSelection.FAILED
+    previous = None
+    if state_dir and (resume_job or retry_failed):
+        previous = JobCheckpoint.load(state_dir)
+        if previous and previous.frames_directory != frame_index.directory:
+            previous = None
+    if resume_job and previous:
+        checkpoint = previous
+        init_frames, missing = frame_index.select(previous.frames)
+    elif retry_failed:
+        if not previous:
+            raise Exception("There is no earlier run of these frames to retry.")
+        checkpoint = previous
+        init_frames, missing = get_anim_frame_selection(scene, frame_index, previous)
+    else:
+        init_frames, missing = get_anim_frame_selection(scene, frame_index)
+        checkpoint = JobCheckpoint(
+            state_dir, frame_index.directory, [frame for frame, _ in init_frames]
+        )
+    if missing:
+        print(
+            "Skipping {} selected frames that have no init frame: {}".format(
+                len(missing), format_frame_list(missing)
+            )
+        )
+    parameter_table = bake_parameter_table(
+        scene,
+        [frame for frame, _ in init_frames],
+        settings.use_recommended_settings,
+    )
+    return init_frames, checkpoint, parameter_table
+
+
 class GeneratorWorker(Thread):
     def __init__(
         self,
@@ -155,14 +591,42 @@ class GeneratorWorker(Thread):
         input_img_paths: List[str],
         output_img_directory: str,
         init_type: InitType,
+        animation_frames: List[Tuple[int, str]] = None,
+        args: dict = None,
+        parameter_table: ParameterTable = None,
+        credit_limit: float = None,
+        checkpoint: JobCheckpoint = None,
+        on_frame_done=None,
+        live_preview: LiveFrameChannel = None,
+        init_capture: RenderCapture = None,
+        tile_layout: TileLayout = None,
+        history: HistoryStore = None,
     ):
         self.scene = scene
         self.context = context
         self.ui_context: UIContext = ui_context
         self.input_img_paths: List[str] = input_img_paths
+        # Init frames of an animation job, as (frame number, path).
+        self.animation_frames = animation_frames
         self.output_img_directory = output_img_directory
         self.running: bool = True
         self.init_type: InitType = init_type
+        # Formatted on the main thread, so the worker never reads Blender data for them.
+        self.args = args
+        self.parameter_table = parameter_table
+        self.credit_budget = CreditBudget(credit_limit)
+        self.checkpoint = checkpoint
+        # Called with the PlannedFrame of every animation frame as its output is written, from the
+        # generation threads.
+        self.on_frame_done = on_frame_done
+        # Completed animation frames for the main thread to show while the job runs.
+        self.live_preview = live_preview
+        # Render Result to generate from instead of the init image on disk, resized on this thread.
+        self.init_capture = init_capture
+        # Tiles to generate an image job as, if its init image is too large for one request.
+        self.tile_layout = tile_layout
+        # Every generation is recorded here, opened on the main thread.
+        self.history = history
         Thread.__init__(self)
 
     def run(self):
@@ -178,27 +642,474 @@ class GeneratorWorker(Thread):
                 capture_exception(e)
             raise e
 
-    # This sets up directories for render, and then renders individual frames
-    def generate(self):
+    # Add a generation to the history. A history that can't be written never fails the job.
+    def record_history(
+        self,
+        kind: GenerationKind,
+        args: dict,
+        output_path: str,
+        cost: float,
+        started_at: float,
+        frame: int = None,
+    ):
+        if not self.history:
+            return
+        try:
+            self.history.record(
+                kind,
+                args,
+                output_path,
+                cost=cost,
+                duration=time.perf_counter() - started_at,
+                frame=frame,
+                engine=args.get("engine", DEFAULT_ENGINE_NAME),
+            )
+        except sqlite3.Error as e:
+            print(f"Could not record the generation in the history: {e}")
+
+    # Generate the result of an image job and keep it for display: in one request, or as tiles if the init
+    # image is too large for one. Returns False if the job was cancelled.
+    def generate_image(self, init_img, output_file_path: str, args: dict) -> bool:
+        settings = self.scene.ds_settings
+        metrics = get_job_metrics()
+        layout = self.tile_layout
+        if layout:
+            started_at = time.perf_counter()
+            with metrics.timer(Phase.TOTAL):
+                res_img = self.generate_tiled(init_img, args)
+            if res_img is None:
+                return False
+            write_result_image(output_file_path, res_img)
+            cost = layout.count * estimate_frame_credits(
+                layout.tile_width, layout.tile_height, args["steps"]
+            )
+            self.record_history(
+                GenerationKind.TILED, args, output_file_path, cost, started_at
+            )
+        else:
+            if settings.use_preview_generation and not self.generate_preview(
+                init_img, args
+            ):
+                return False
+            started_at = time.perf_counter()
+            with metrics.timer(Phase.TOTAL):
+                status, reason, res_img = render_img2img(
+                    init_img, output_file_path, args
+                )
+            if status != 200:
+                raise Exception("Error generating image: {} {}".format(status, reason))
+            cost = estimate_frame_credits(args["width"], args["height"], args["steps"])
+            self.record_history(
+                GenerationKind.IMAGE, args, output_file_path, cost, started_at
+            )
+        StateOperator.last_result = load_result(res_img)
+        return True
+
+    # Generate an init image that is too large for one request as overlapping tiles, several at a time, and
+    # blend them back together as they complete. Every tile is sent with the same seed and prompts, so they
+    # match across the seams. Returns the encoded result, or None if the job was cancelled.
+    def generate_tiled(self, init_img, args: dict):
+        layout = self.tile_layout
+        concurrency = self.scene.ds_settings.max_concurrent_requests
+        tile_args = dict(args, width=layout.tile_width, height=layout.tile_height)
+        if tile_args["seed"] is None:
+            tile_args["seed"] = random.randrange(0, 4294967295)
+        tile_cost = estimate_frame_credits(
+            layout.tile_width, layout.tile_height, tile_args["steps"]
+        )
+        with get_job_metrics().timer(Phase.IMAGE_SCALING):
+            tile_images = split_image(init_img, layout)
+        assembler = TileAssembler(layout)
+        progress = TileProgress(layout)
+        StateOperator.tile_progress = progress
+
+        def send_request(tile: Tile):
+            if not self.credit_budget.reserve(tile_cost):
+                raise Exception(
+                    "Not enough credits left in the budget to generate every tile."
+                )
+            progress.set_status(tile, TileStatus.RUNNING)
+            try:
+                status, reason, res_img = generate_img2img(
+                    tile_images[tile.index], tile_args
+                )
+            except Exception:
+                progress.set_status(tile, TileStatus.FAILED)
+                self.credit_budget.release(tile_cost)
+                raise
+            if status != 200:
+                progress.set_status(tile, TileStatus.FAILED)
+                self.credit_budget.release(tile_cost)
+                raise Exception(
+                    "Error generating tile {}: {} {}".format(
+                        tile.index + 1, status, reason
+                    )
+                )
+            self.credit_budget.commit(tile_cost)
+            return tile, res_img
+
+        def blend_tile(item):
+            tile, res_img = item
+            with get_job_metrics().timer(Phase.DECODE):
+                assembler.add(tile, res_img)
+            progress.set_status(tile, TileStatus.DONE)
+
+        pipeline = Pipeline(
+            should_stop=lambda: not self.running
+            or StateOperator.render_state == RenderState.CANCELLED
+        )
+        pipeline.add_stage(
+            "request", send_request, workers=concurrency, queue_size=concurrency
+        )
+        pipeline.add_stage("blend", blend_tile, queue_size=concurrency)
+        pipeline.run(layout.tiles)
+        if pipeline.stopped:
+            return None
+        return assembler.encode()
+
+    # Send a cheap, low-res and low-step request with the same seed before the full generation, so a bad
+    # prompt can be caught early. Returns False if the user cancelled after seeing the preview.
+    def generate_preview(self, init_img, args: dict) -> bool:
+        settings = self.scene.ds_settings
+        preview_file_path = os.path.join(self.output_img_directory, "preview.png")
+        preview_args = format_preview_args(args)
+        # Upload the init image at the preview size, not the full one.
+        with get_job_metrics().timer(Phase.IMAGE_SCALING):
+            preview_init = load_resized_png(
+                init_img, preview_args["width"], preview_args["height"]
+            )
+        cost = estimate_frame_credits(
+            preview_args["width"], preview_args["height"], preview_args["steps"]
+        )
+        if not self.credit_budget.reserve(cost):
+            raise Exception("Not enough credits left in the budget for the preview.")
+        try:
+            status, reason, res_img = render_img2img(
+                preview_init, preview_file_path, preview_args
+            )
+        except Exception:
+            self.credit_budget.release(cost)
+            raise
+        if status != 200:
+            self.credit_budget.release(cost)
+            raise Exception("Error generating preview: {} {}".format(status, reason))
+        self.credit_budget.commit(cost)
+        if not self.running:
+            return False
+        StateOperator.preview_image_path = preview_file_path
+        StateOperator.preview_result = load_result(res_img)
+        StateOperator.preview_pending_display = True
+        if settings.preview_auto_continue:
+            return True
+        StateOperator.render_state = RenderState.PREVIEW
+        while self.running and StateOperator.render_state == RenderState.PREVIEW:
+            time.sleep(0.1)
+        return self.running and StateOperator.render_state == RenderState.DIFFUSING
+
+    # Generate every frame of the animation that isn't in the checkpoint yet. Frames flow through a pipeline:
+    # keyframed params are looked up in the baked table, the init frame is resized and encoded, the request is sent, and the
+    # result is written out - each stage with its own threads, so preparing the next frames overlaps with
+    # the requests in flight. Returns False if the job was cancelled.
+    def generate_animation(self) -> bool:
         settings = self.scene.ds_settings
         scene = self.scene
-        args = format_rest_args(settings, scene.prompt_list)
+        metrics = get_job_metrics()
+        if not self.animation_frames:
+            raise Exception("No rendered frames found. Please render the scene first.")
+        init_image_width, init_image_height = get_init_image_dimensions(settings, scene)
+        checkpoint = self.checkpoint
+        checkpoint.paused_for_budget = False
+        StateOperator.total_frame_count = checkpoint.total_frames
+        StateOperator.current_frame_idx = len(checkpoint.completed_frames)
+        concurrency = settings.max_concurrent_requests
+        budget_exhausted = threading.Event()
+        plan = build_frame_plan(
+            self.animation_frames,
+            self.output_img_directory,
+            KeyframeMode[settings.keyframe_mode],
+            settings.keyframe_stride,
+            settings.keyframe_change_threshold,
+            settings.skip_duplicate_frames,
+            settings.duplicate_frame_tolerance,
+        )
+        # Job state lives next to the checkpoint, which is kept apart from the results when several
+        # processes write to the same output directory.
+        state_directory = checkpoint.output_directory
+        plan.save(state_directory)
+        StateOperator.frame_plan = plan
+        guidance = settings.interpolation_guidance
+
+        # Keep the results of frames whose init frame and args haven't changed since they were generated.
+        generation_index = None
+        frame_keys = {}
+        if settings.incremental_generation:
+            settings_hash = hash_values(
+                checkpoint.frames_directory,
+                settings.generation_engine,
+                settings.use_recommended_settings,
+                settings.sampler,
+                settings.use_clip_guidance,
+            )
+            generation_index, stale = GenerationIndex.load(
+                state_directory, settings_hash
+            )
+            if stale:
+                print("Generation settings changed, regenerating every frame.")
+                remove_stale_outputs(plan)
+            frame_keys = compute_frame_keys(
+                plan,
+                generation_index,
+                lambda frame: self.parameter_table.args_for_frame(self.args, frame),
+                guidance,
+            )
+            unchanged = [
+                f.index
+                for f in plan.frames
+                if generation_index.is_current(f.index, frame_keys[f.index])
+                and os.path.exists(f.output_path)
+            ]
+            for index in unchanged:
+                checkpoint.mark_completed(index, 0.0)
+            StateOperator.current_frame_idx = len(checkpoint.completed_frames)
+            print(
+                "{} of {} frames are unchanged since the last run.".format(
+                    len(unchanged), len(plan.frames)
+                )
+            )
 
-        frame_start, frame_end = scene.frame_start, scene.frame_end
-        scene_frame_length: int = frame_end - frame_start + 1
+        # Throughput is measured from here, over the frames this run completes.
+        progress = JobProgress(
+            checkpoint.total_frames, concurrency, checkpoint.completed_frames
+        )
+        StateOperator.job_progress = progress
+
+        # Encode the frames into a video as they complete, starting with the ones that are already done.
+        video = VideoAssembler.start(
+            self.output_img_directory,
+            [f.index for f in plan.frames],
+            VideoOutput[settings.video_output],
+            scene.render.fps / scene.render.fps_base,
+        )
+        if video:
+            for index in sorted(checkpoint.completed_frames & set(plan.by_index)):
+                video.add_frame(index, plan.by_index[index].output_path)
+        if self.live_preview:
+            for index in sorted(checkpoint.completed_frames & set(plan.by_index)):
+                planned = plan.by_index[index]
+                self.live_preview.push(planned.frame, planned.output_path)
+
+        def mark_done(index: int, cost: float):
+            checkpoint.mark_completed(index, cost)
+            progress.frame_completed(index)
+            if generation_index:
+                generation_index.record(index, frame_keys[index])
+            if video:
+                video.add_frame(index, plan.by_index[index].output_path)
+            if self.live_preview:
+                planned = plan.by_index[index]
+                self.live_preview.push(planned.frame, planned.output_path)
+            if self.on_frame_done:
+                self.on_frame_done(plan.by_index[index])
+
+        def save_progress(force: bool = False):
+            checkpoint.save()
+            if generation_index:
+                generation_index.save(force)
+
+        def pending_frames():
+            for planned in plan.generated_frames:
+                if budget_exhausted.is_set():
+                    return
+                if planned.index in checkpoint.completed_frames:
+                    continue
+                yield FrameTask(
+                    planned.index,
+                    planned.frame,
+                    planned.init_path,
+                    planned.output_path,
+                )
+
+        # Fill in the frames between two generated frames once both of them are done.
+        def complete_segments(index: int):
+            for from_index, to_index, between in plan.segments_touching(index):
+                completed = checkpoint.completed_frames
+                if from_index not in completed or to_index not in completed:
+                    continue
+                missing = [f for f in between if f.index not in completed]
+                if not missing:
+                    continue
+                with metrics.timer(Phase.INTERPOLATE):
+                    synthesize_segment(plan, from_index, missing, guidance)
+                for frame in missing:
+                    mark_done(frame.index, 0.0)
+
+        # Once a frame is generated, copy it to its duplicates and fill in any segments that are now complete.
+        def complete_dependents(index: int):
+            done = [index]
+            for frame in copy_reused_frames(plan, index, checkpoint.completed_frames):
+                mark_done(frame.index, 0.0)
+                done.append(frame.index)
+            for done_index in done:
+                complete_segments(done_index)
+
+        converter = None
+        if has_pillow() and any(needs_conversion(p) for _, p in self.animation_frames):
+            converter = FrameConverter(
+                os.path.join(get_output_root(), CONVERTED_FRAMES_DIRNAME)
+            )
+
+        def evaluate_params(task: FrameTask):
+            task.started_at = time.perf_counter()
+            task.args = self.parameter_table.args_for_frame(self.args, task.frame)
+            task.cost = estimate_frame_credits(
+                task.args["width"], task.args["height"], task.args["steps"]
+            )
+            return task
+
+        # Resized and encoded in memory rather than through bpy.data.images, so it can run on several
+        # threads and doesn't leave a datablock behind for every frame.
+        # EXR and JPEG frames are converted in a process pool instead, and cached across runs.
+        def prepare_init_image(task: FrameTask):
+            with metrics.timer(Phase.IMAGE_SCALING):
+                if converter and needs_conversion(task.init_path):
+                    task.init_image = converter.convert(
+                        task.init_path, init_image_width, init_image_height
+                    )
+                else:
+                    task.init_image = load_resized_png(
+                        task.init_path, init_image_width, init_image_height
+                    )
+            return task
+
+        def send_request(task: FrameTask):
+            if budget_exhausted.is_set() or not self.credit_budget.reserve(task.cost):
+                budget_exhausted.set()
+                return None
+            StateOperator.render_start_time = time.time()
+            progress.frame_started(task.index)
+            try:
+                status, reason, task.result = generate_img2img(
+                    task.init_image, task.args
+                )
+            except Exception:
+                progress.frame_failed(task.index)
+                raise
+            task.init_image = None
+            if status != 200:
+                progress.frame_failed(task.index)
+                self.credit_budget.release(task.cost)
+                raise Exception("Error generating image: {} {}".format(status, reason))
+            self.credit_budget.commit(task.cost)
+            return task
+
+        def write_output(task: FrameTask):
+            write_result_image(task.output_path, task.result)
+            task.result = None
+            self.record_history(
+                GenerationKind.ANIMATION,
+                task.args,
+                task.output_path,
+                task.cost,
+                task.started_at,
+                frame=task.frame,
+            )
+            mark_done(task.index, task.cost)
+            complete_dependents(task.index)
+            save_progress()
+            StateOperator.current_frame_idx = len(checkpoint.completed_frames)
+            metrics.record(Phase.TOTAL, time.perf_counter() - task.started_at)
+
+        pipeline = Pipeline(
+            should_stop=lambda: not self.running
+            or StateOperator.render_state == RenderState.CANCELLED
+        )
+        pipeline.add_stage("evaluate", evaluate_params, queue_size=concurrency)
+        pipeline.add_stage(
+            "prepare", prepare_init_image, workers=concurrency, queue_size=concurrency
+        )
+        pipeline.add_stage(
+            "request", send_request, workers=concurrency, queue_size=concurrency
+        )
+        pipeline.add_stage("write", write_output, queue_size=concurrency)
+        try:
+            pipeline.run(pending_frames())
+        except Exception:
+            StateOperator.paused_job = checkpoint
+            if video:
+                video.cancel()
+            raise
+        finally:
+            save_progress(force=True)
+        if pipeline.stopped:
+            StateOperator.paused_job = checkpoint
+            if video:
+                video.cancel()
+            return False
+        # Duplicates and segments of frames that were generated by an earlier, resumed run.
+        for planned in plan.generated_frames:
+            if planned.index in checkpoint.completed_frames:
+                complete_dependents(planned.index)
+        save_progress(force=True)
+        StateOperator.current_frame_idx = len(checkpoint.completed_frames)
+        if plan.saved_api_calls:
+            print(
+                "Generated {} of {} frames, saving {} API calls ({} duplicate frames reused).".format(
+                    plan.api_call_count,
+                    len(plan.frames),
+                    plan.saved_api_calls,
+                    plan.reused_frame_count,
+                )
+            )
+        if budget_exhausted.is_set():
+            checkpoint.paused_for_budget = True
+            checkpoint.save()
+            StateOperator.paused_job = checkpoint
+            print(
+                "Credit budget reached after {} credits, pausing with {} frames left.".format(
+                    round(checkpoint.spent_credits, 2), checkpoint.remaining_frames
+                )
+            )
+            if video:
+                video.cancel()
+        elif video:
+            for video_path, error in video.finish().items():
+                if error:
+                    print("Could not write {}: {}".format(video_path, error))
+                else:
+                    print("Wrote {}".format(video_path))
+        return True
+
+    # This sets up directories for render, and then renders individual frames
+    def generate(self):
+        settings = self.scene.ds_settings
+        args = self.args
 
         StateOperator.render_state = RenderState.DIFFUSING
         output_file_path = os.path.join(self.output_img_directory, "result.png")
-        init_image_width, init_image_height = get_init_image_dimensions(settings, scene)
         StateOperator.last_rendered_image_path = output_file_path
+        StateOperator.last_result = None
+
+        metrics = get_job_metrics()
 
         # text2img mode
         if self.init_type == InitType.TEXT:
             StateOperator.render_state = RenderState.DIFFUSING
-            status, reason = render_text2img(self.output_img_directory, args)
-            StateOperator.render_state = RenderState.FINISHED
+            started_at = time.perf_counter()
+            with metrics.timer(Phase.TOTAL):
+                status, reason, res_img = render_text2img(
+                    self.output_img_directory, args
+                )
             if status != 200:
                 raise Exception("Error generating image: {} {}".format(status, reason))
+            self.record_history(
+                GenerationKind.TEXT,
+                args,
+                output_file_path,
+                estimate_frame_credits(args["width"], args["height"], args["steps"]),
+                started_at,
+            )
+            StateOperator.last_result = load_result(res_img)
+            StateOperator.render_state = RenderState.FINISHED
             return
 
         init_img_path = self.input_img_paths[0]
@@ -211,9 +1122,15 @@ class GeneratorWorker(Thread):
                         init_img_path
                     )
                 )
-            status, reason = render_img2img(init_img_path, output_file_path, args)
-            if status != 200:
-                raise Exception("Error generating image: {} {}".format(status, reason))
+            if self.init_capture:
+                with metrics.timer(Phase.IMAGE_SCALING):
+                    init_img = self.init_capture.resized_png(
+                        args["width"], args["height"]
+                    )
+            else:
+                init_img = init_img_path
+            if not self.generate_image(init_img, output_file_path, args):
+                return
             StateOperator.render_state = RenderState.FINISHED
             return
 
@@ -226,54 +1143,140 @@ class GeneratorWorker(Thread):
                         init_img_path
                     )
                 )
-            status, reason = render_img2img(input_img_path, output_file_path, args)
-            if status != 200:
-                raise Exception("Error generating image: {} {}".format(status, reason))
+            if not self.generate_image(input_img_path, output_file_path, args):
+                return
         elif self.init_type == InitType.ANIMATION:
-            rendered_frame_image_paths = list(sorted(self.input_img_paths))
-            if len(rendered_frame_image_paths) == 0:
-                raise Exception(
-                    "No rendered frames found. Please render the scene first."
-                )
-            start_frame = max(0, frame_start - 1)
-            end_frame = min(len(rendered_frame_image_paths), scene_frame_length)
-            StateOperator.total_frame_count = end_frame
-            for i, frame_img_file in enumerate(
-                rendered_frame_image_paths[start_frame:end_frame]
-            ):
-                if (
-                    not self.running
-                    or StateOperator.render_state == RenderState.CANCELLED
-                ):
-                    return
-                scene.frame_set(i + 1)
-                StateOperator.render_start_time = time.time()
-                args = format_rest_args(settings, scene.prompt_list)
-                output_file_path = os.path.join(
-                    self.output_img_directory, f"result_{i}.png"
-                )
-                rendered_image = bpy.data.images.load(frame_img_file)
-                rendered_image.scale(init_image_width, init_image_height)
-                StateOperator.current_frame_idx = i + 1
-                # We need to actually set Blender to a certain frame to evaluate all the keyframe values for that frame.
-                status, reason = render_img2img(frame_img_file, output_file_path, args)
-                if status != 200:
-                    raise Exception(
-                        "Error generating image: {} {}".format(status, reason)
-                    )
-            scene.frame_set(0)
+            if not self.generate_animation():
+                return
 
         StateOperator.rendering_from_viewport = False
         if self.running:
             StateOperator.render_state = RenderState.FINISHED
 
 
+# The generation history, or None if it can't be opened.
+def open_history() -> Optional[HistoryStore]:
+    try:
+        return get_history_store(get_history_directory())
+    except (sqlite3.Error, OSError) as e:
+        print(f"Could not open the generation history: {e}")
+        return None
+
+
+# The result of a generation as display_image_in_editor takes it: its pixels, decoded here on the generation
+# thread. None if Pillow isn't installed, in which case the result is loaded from its file.
+def load_result(res_img: bytes):
+    if res_img is None or not has_pillow():
+        return None
+    with get_job_metrics().timer(Phase.DECODE):
+        return decode_image_pixels(res_img)
+
+
+# Show a result in the open image editor, or in a new window if there isn't one. Decoded pixels are written
+# into the generated image the editor shows if nothing else uses it; without them the result is loaded from
+# image_path. Results are never packed, so they don't end up saved in the .blend file. Any image that is no
+# longer shown is freed.
+def display_image_in_editor(image_path: str, result=None):
+    image_tex_area = None
+    for area in bpy.context.screen.areas:
+        if area.type == "IMAGE_EDITOR":
+            image_tex_area = area
+    if not image_tex_area:
+        # Create a new image editor area
+        bpy.ops.screen.userpref_show("INVOKE_DEFAULT")
+        image_tex_area = bpy.context.window_manager.windows[-1].screen.areas[0]
+        image_tex_area.type = "IMAGE_EDITOR"
+    space = image_tex_area.spaces.active
+    if result:
+        space.image = write_result_pixels(result, space.image)
+    else:
+        rendered_image = bpy.data.images.load(image_path)
+        tag_image(rendered_image, AddonImageKind.TEMPORARY)
+        try:
+            width, height = rendered_image.size
+            target = space.image
+            if not is_replaceable_output(target, width, height):
+                target = None
+            space.image = copy_image(rendered_image, target)
+        finally:
+            remove_image(rendered_image)
+    free_orphan_images()
+
+
+# Shows the results of the running animation job as an image strip in the sequencer, so the timeline can be
+# scrubbed while frames are still being generated. Frames that aren't done yet hold the last result before
+# them. Only used from the main thread.
+class SequencerPreview:
+    def __init__(self, scene, first_frame: int):
+        self.scene = scene
+        self.first_frame = first_frame
+        self.sequence = HeldFrameSequence(first_frame)
+        self.created = False
+
+    # Add completed frames to the strip. Returns False if nothing changed.
+    def update(self, frames: List[Tuple[int, str]]) -> bool:
+        changed = self.sequence.add(frames)
+        if not changed:
+            return False
+        editor = self.scene.sequence_editor or self.scene.sequence_editor_create()
+        strip = editor.sequences.get(PREVIEW_STRIP_NAME)
+        if not self.created:
+            # The strip of the last run is replaced, in the same channel.
+            if strip:
+                channel = strip.channel
+                editor.sequences.remove(strip)
+            else:
+                channel = min(
+                    32, max((s.channel for s in editor.sequences_all), default=0) + 1
+                )
+            strip = editor.sequences.new_image(
+                PREVIEW_STRIP_NAME,
+                self.sequence.shown[0],
+                channel,
+                self.first_frame,
+            )
+            self.created = True
+        if not strip:
+            return False
+        elements = strip.elements
+        for position in changed:
+            filename = os.path.basename(self.sequence.shown[position])
+            if position < len(elements):
+                elements[position].filename = filename
+            else:
+                elements.append(filename)
+        strip.frame_final_duration = len(elements)
+        strip.invalidate_cache("RAW")
+        return True
+
+
 # Sets up the init image / animation, as well as setting all DreamStateOperator state that is passed to
 # the generation thread.
 class RenderOperator(Operator):
     bl_idname = "dreamstudio.dream_render_operator"
     bl_label = "Dream!"
 
+    # Set while an animation job is shown in the sequencer as it runs.
+    timer = None
+    live_preview: LiveFrameChannel = None
+    sequencer_preview: SequencerPreview = None
+
+    def update_live_preview(self, context, force: bool = False):
+        if not self.sequencer_preview:
+            return
+        if self.sequencer_preview.update(self.live_preview.take(force)):
+            for area in context.screen.areas:
+                if area.type == "SEQUENCE_EDITOR":
+                    area.tag_redraw()
+
+    def finish(self, context):
+        self.update_live_preview(context, force=True)
+        if self.timer:
+            context.window_manager.event_timer_remove(self.timer)
+            self.timer = None
+        pixel_buffer.release()
+        return {"FINISHED"}
+
     def modal(self, context, event):
         settings = context.scene.ds_settings
         output_location = OutputDisplayLocation[settings.output_location]
@@ -284,42 +1287,39 @@ class RenderOperator(Operator):
         if StateOperator.render_start_time:
             settings.current_time = time.time() - StateOperator.render_start_time
 
+        self.update_live_preview(context)
+
         if StateOperator.render_state == RenderState.CANCELLED:
             StateOperator.render_state = RenderState.IDLE
-            return {"FINISHED"}
+            return self.finish(context)
+
+        if StateOperator.preview_pending_display:
+            StateOperator.preview_pending_display = False
+            if output_location == OutputDisplayLocation.TEXTURE_VIEW:
+                display_image_in_editor(
+                    StateOperator.preview_image_path, StateOperator.preview_result
+                )
+            StateOperator.preview_result = None
 
         if StateOperator.render_state == RenderState.FINISHED:
             StateOperator.account = get_account_details(prefs.base_url, prefs.api_key)
             StateOperator.render_state = RenderState.IDLE
-            image_tex_area = None
-            for area in bpy.context.screen.areas:
-                if area.type == "IMAGE_EDITOR":
-                    image_tex_area = area
             if (
                 output_location == OutputDisplayLocation.TEXTURE_VIEW
                 and init_type != InitType.ANIMATION
             ):
-                rendered_image = bpy.data.images.load(
-                    StateOperator.last_rendered_image_path
+                display_image_in_editor(
+                    StateOperator.last_rendered_image_path, StateOperator.last_result
                 )
-                if image_tex_area:
-                    image_tex_area.spaces.active.image = copy_image(rendered_image)
-                else:
-                    # Create a new image editor area
-                    bpy.ops.screen.userpref_show("INVOKE_DEFAULT")
-                    image_tex_area = bpy.context.window_manager.windows[
-                        -1
-                    ].screen.areas[0]
-                    image_tex_area.type = "IMAGE_EDITOR"
-                    image_tex_area.spaces.active.image = copy_image(rendered_image)
             elif (
                 output_location == OutputDisplayLocation.FILE_SYSTEM
                 or ui_context == UIContext.SCENE_VIEW
             ):
                 open_folder(StateOperator.generated_output_dir)
+            StateOperator.last_result = None
 
         if StateOperator.render_state == RenderState.IDLE:
-            return {"FINISHED"}
+            return self.finish(context)
 
         def confirm_cancel(self, context):
             layout = self.layout
@@ -333,6 +1333,11 @@ class RenderOperator(Operator):
             return {"PASS_THROUGH"}
 
         if event.type == "ESC":
+            # A preview waits on the user, so ESC discards it rather than pausing.
+            if StateOperator.render_state == RenderState.PREVIEW:
+                StateOperator.reset_render_state()
+                StateOperator.render_state = RenderState.CANCELLED
+                return {"PASS_THROUGH"}
             StateOperator.render_state = RenderState.PAUSED
             return {"PASS_THROUGH"}
 
@@ -344,49 +1349,165 @@ class RenderOperator(Operator):
         scene = bpy.context.scene
         ui_context = StateOperator.ui_context
         init_type = get_init_type()
+        resume_job = StateOperator.resume_job
+        StateOperator.resume_job = False
         # Ensure there isn't an existing thread with a lock on the render directory.
         StateOperator.kill_render_thread()
-        (
-            rendered_dir,
-            generated_images_dir,
-            generated_animation_dir,
-        ) = setup_render_directories()
-        out_dir = (
-            generated_animation_dir
-            if init_type == InitType.ANIMATION
-            else generated_images_dir
+        metrics = start_job_metrics()
+        # Animation jobs that continue the last run write to its directory. The directories are only created
+        # once the job has passed the checks below, so a cancelled job doesn't leave an empty run behind.
+        run_kind = RunKind.IMAGES
+        new_run = True
+        if init_type == InitType.ANIMATION:
+            run_kind = RunKind.ANIMATION
+            new_run = (
+                not resume_job
+                and not settings.incremental_generation
+                and FrameSelection[settings.frame_selection] != FrameSelection.FAILED
+            )
+        last_run_dir = (
+            None
+            if new_run
+            else latest_run_directory(get_output_root(), RunKind.ANIMATION)
         )
-        StateOperator.generated_output_dir = out_dir
         if context.area.type == "IMAGE_EDITOR":
             ui_context = UIContext.IMAGE_EDITOR
 
-        init_img_path = os.path.join(rendered_dir, "init.png")
-
         init_image_width, init_image_height = get_init_image_dimensions(settings, scene)
         render_file_path = scene.render.filepath
         init_img_paths = []
+        init_capture = None
 
         if StateOperator.rendering_from_viewport:
             init_type = InitType.VIEWPORT
+
+        # Check the projected cost of the whole job against the budget and the cached balance before
+        # doing any work.
+        checkpoint = None
+        parameter_table = None
+        animation_frames = None
+        job_frame_count = 1
+        if init_type == InitType.ANIMATION:
+            animation_frames, checkpoint, parameter_table = prepare_animation_job(
+                scene, last_run_dir, resume_job
+            )
+            init_img_paths = [path for _, path in animation_frames]
+            if settings.show_live_preview and animation_frames:
+                self.live_preview = LiveFrameChannel()
+                self.sequencer_preview = SequencerPreview(scene, animation_frames[0][0])
+            job_frame_count = estimate_api_calls(
+                checkpoint.remaining_frames,
+                KeyframeMode[settings.keyframe_mode],
+                settings.keyframe_stride,
+            )
+        tile_layout = None
+        if init_type in (InitType.TEXTURE, InitType.VIEWPORT):
+            tile_layout = get_tile_layout(settings, scene)
+            if tile_layout and not tile_layout.is_supported:
+                StateOperator.render_state = RenderState.IDLE
+                self.report(
+                    {"ERROR"},
+                    "Both sides of a tiled image must be at least {} pixels.".format(
+                        MIN_TILE_SIDE
+                    ),
+                )
+                return {"CANCELLED"}
+        StateOperator.paused_job = None
+        StateOperator.job_progress = None
+        StateOperator.tile_progress = None
+        free_orphan_images()
+        rest_args = format_rest_args(settings, scene.prompt_list)
+        frame_cost = estimate_frame_credits(
+            rest_args["width"], rest_args["height"], rest_args["steps"]
+        )
+        if tile_layout:
+            job_frame_count = tile_layout.count
+            frame_cost = estimate_frame_credits(
+                tile_layout.tile_width, tile_layout.tile_height, rest_args["steps"]
+            )
+        elif settings.use_preview_generation and init_type in (
+            InitType.TEXTURE,
+            InitType.VIEWPORT,
+        ):
+            # The preview sent first is paid for too.
+            frame_cost += estimate_preview_credits(
+                rest_args["width"], rest_args["height"], rest_args["steps"]
+            )
+        credit_limit = get_credit_limit(
+            settings,
+            StateOperator.account,
+            checkpoint.spent_credits if checkpoint else 0.0,
+        )
+        if credit_limit is not None:
+            if credit_limit < frame_cost:
+                StateOperator.render_state = RenderState.IDLE
+                StateOperator.paused_job = checkpoint if resume_job else None
+                self.report(
+                    {"ERROR"},
+                    "Not enough credits left in the budget or balance to generate a frame. Raise the budget to continue.",
+                )
+                return {"CANCELLED"}
+            # Tiled images can't be paused partway, every tile is needed.
+            if tile_layout and job_frame_count * frame_cost > credit_limit:
+                StateOperator.render_state = RenderState.IDLE
+                self.report(
+                    {"ERROR"},
+                    "Generating all {} tiles costs {} credits, over the {} credit limit.".format(
+                        job_frame_count,
+                        round(job_frame_count * frame_cost, 2),
+                        round(credit_limit, 2),
+                    ),
+                )
+                return {"CANCELLED"}
+            if job_frame_count * frame_cost > credit_limit:
+                self.report(
+                    {"WARNING"},
+                    "Projected cost of {} credits is over the {} credit limit. The job will pause after {} of {} frames.".format(
+                        round(job_frame_count * frame_cost, 2),
+                        round(credit_limit, 2),
+                        int(credit_limit // frame_cost),
+                        job_frame_count,
+                    ),
+                )
+        if init_type == InitType.TEXTURE and not settings.init_texture_ref:
+            raise Exception("No init texture set")
+
+        rendered_dir, out_dir = setup_render_directories(run_kind, new_run)
+        StateOperator.generated_output_dir = out_dir
+        if checkpoint:
+            checkpoint.output_directory = out_dir
+        init_img_path = os.path.join(rendered_dir, "init.png")
+
         # If we are in the image editor, we need to save the image to a temporary file to use for init
         if init_type == InitType.TEXTURE:
             img = settings.init_texture_ref
-            if not img:
-                raise Exception("No init texture set")
             # workaround for render result not having pixels
             # https://blender.stackexchange.com/questions/2170/how-to-access-render-result-pixels-from-python-script
-            if img.name == "Render Result":
-                img = bpy.data.images["Render Result"]
-                rr_path = os.path.join(rendered_dir, "render_result.png")
-                img.save_render(rr_path, scene=None)
-                init_image = bpy.data.images.load(rr_path)
-                init_image.scale(init_image_width, init_image_height)
-                init_image.save_render(init_img_path)
+            if img.name == RENDER_RESULT_NAME and has_pillow():
+                # Captured once, and resized and encoded on the generation thread.
+                with metrics.timer(Phase.INIT_RENDER):
+                    init_capture = capture_render_result(scene, rendered_dir)
+                init_img_paths = [init_capture.path]
             else:
-                init_image = copy_image(img)
-                init_image.scale(init_image_width, init_image_height)
-                init_image.save_render(init_img_path)
-            init_img_paths = [init_img_path]
+                if img.name == RENDER_RESULT_NAME:
+                    img = bpy.data.images[RENDER_RESULT_NAME]
+                    rr_path = os.path.join(rendered_dir, "render_result.png")
+                    with metrics.timer(Phase.INIT_RENDER):
+                        img.save_render(rr_path, scene=None)
+                    with metrics.timer(Phase.IMAGE_SCALING):
+                        init_image = bpy.data.images.load(rr_path)
+                else:
+                    with metrics.timer(Phase.IMAGE_SCALING):
+                        init_image = copy_image(img)
+                # The scaled copy is only needed on disk.
+                tag_image(init_image, AddonImageKind.TEMPORARY)
+                try:
+                    with metrics.timer(Phase.IMAGE_SCALING):
+                        init_image.scale(init_image_width, init_image_height)
+                        init_image.save_render(init_img_path)
+                finally:
+                    remove_image(init_image)
+                init_img_paths = [init_img_path]
 
         # Render 3D view
         if init_type == InitType.VIEWPORT:
@@ -399,9 +1520,10 @@ class RenderOperator(Operator):
             tmp_w, tmp_h = scene.render.resolution_x, scene.render.resolution_y
             scene.render.resolution_x = init_image_width
             scene.render.resolution_y = init_image_height
-            res = bpy.ops.render.opengl(
-                write_still=True, animation=False, view_context=True
-            )
+            with metrics.timer(Phase.INIT_RENDER):
+                res = bpy.ops.render.opengl(
+                    write_still=True, animation=False, view_context=True
+                )
             scene.render.resolution_x = tmp_w
             scene.render.resolution_y = tmp_h
             # bpy.data.screens[workspace].overlay.show_overlays = tmp_show_overlay
@@ -410,8 +1532,6 @@ class RenderOperator(Operator):
 
             if res != {"FINISHED"}:
                 raise Exception("Failed to render: {}".format(res))
-        elif init_type == InitType.ANIMATION:
-            init_img_paths, frame_path = get_anim_images()
         StateOperator.generator_thread = GeneratorWorker(
             scene,
             context,
@@ -419,10 +1539,23 @@ class RenderOperator(Operator):
             input_img_paths=init_img_paths,
             output_img_directory=out_dir,
             init_type=init_type,
+            animation_frames=animation_frames,
+            args=rest_args,
+            parameter_table=parameter_table,
+            credit_limit=credit_limit,
+            checkpoint=checkpoint,
+            live_preview=self.live_preview,
+            init_capture=init_capture,
+            tile_layout=tile_layout,
+            history=open_history(),
         )
+        StateOperator.credit_budget = StateOperator.generator_thread.credit_budget
         StateOperator.generator_thread.start()
 
         wm.modal_handler_add(self)
+        if self.live_preview:
+            # Update the strip even while no other event comes in.
+            self.timer = wm.event_timer_add(UPDATE_INTERVAL, window=context.window)
 
         return {"RUNNING_MODAL"}
 
@@ -441,13 +1574,33 @@ class StateOperator(Operator):
     generator_thread: Thread = None
     rendering_from_viewport = False
     # Where we put images that are generated after the diffusion step.
-    # Either generated_images_dir or generation_animation_dir will be set.
+    # Output directory of the current run, in its own run directory.
     generated_output_dir = None
     # Where we put images that are rendered by the addon.
     rendered_images_dir = None
     # Where we put images that are generated by the addon.
     last_rendered_image_path = None
+    # The last result held in memory for display, as returned by load_result.
+    last_result = None
+    # Low-res preview generated before the full request, and whether the modal still needs to show it.
+    preview_image_path = None
+    preview_result = None
+    preview_pending_display = False
     render_start_time: float = None
+    # Credit spending of the running job, and the checkpoint of a job that was paused and can be resumed.
+    credit_budget: CreditBudget = None
+    paused_job: JobCheckpoint = None
+    resume_job = False
+    # Which frames of the running animation job are generated and which are interpolated.
+    frame_plan: FramePlan = None
+    # Background processes of an animation job that is split across several Blender instances.
+    shard_coordinator: ShardCoordinator = None
+    # Throughput and time left of the running animation job.
+    job_progress: JobProgress = None
+    # Status of each tile of the running image job, if it is generated as tiles.
+    tile_progress: TileProgress = None
+    # Textures of the running batch job, generated apart from the generator thread.
+    batch_job: BatchTextureJob = None
 
     sentry_initialized = False
 
@@ -459,9 +1612,16 @@ class StateOperator(Operator):
         self.cancel_rendering = False
         self.current_frame_idx = 0
         self.render_start_time = None
+        self.preview_pending_display = False
 
     def kill_render_thread():
         self = StateOperator
+        if self.shard_coordinator:
+            self.shard_coordinator.stop()
+            self.shard_coordinator = None
+        if self.batch_job:
+            self.batch_job.cancel()
+            self.batch_job = None
         if self.generator_thread:
             try:
                 self.generator_thread.running = False
@@ -496,16 +1656,109 @@ class OpenOutputFolderOperator(Operator):
     bl_label = "Open Output Folder"
 
     def execute(self, context):
-        (
-            dreamstudio_dir,
-            generated_images_dir,
-            generated_animation_dir,
-        ) = setup_render_directories(clear_anim=False)
         init_type = get_init_type()
         if init_type == InitType.ANIMATION:
-            open_folder(generated_animation_dir)
+            open_folder(get_latest_output_directory(RunKind.ANIMATION))
         else:
-            open_folder(generated_images_dir)
+            open_folder(get_latest_output_directory(RunKind.IMAGES))
+        return {"FINISHED"}
+
+
+class FreeUnusedImagesOperator(Operator):
+    """Remove the images created by the addon that are no longer shown or used"""
+
+    bl_idname = "dreamstudio.free_unused_images"
+    bl_label = "Free Unused Images"
+
+    def execute(self, context):
+        freed = free_orphan_images()
+        pixel_buffer.release()
+        self.report({"INFO"}, f"Freed {freed} unused images.")
+        return {"FINISHED"}
+
+
+class HistoryPageOperator(Operator):
+    """Show the next or previous page of the generation history"""
+
+    bl_idname = "dreamstudio.history_page"
+    bl_label = "Change History Page"
+
+    step: IntProperty(default=1)
+
+    def execute(self, context):
+        settings = context.scene.ds_settings
+        settings.history_page = max(0, settings.history_page + self.step)
+        return {"FINISHED"}
+
+
+class OpenHistoryEntryOperator(Operator):
+    """Show this generation in the image editor"""
+
+    bl_idname = "dreamstudio.open_history_entry"
+    bl_label = "Open Generation"
+
+    entry_id: IntProperty()
+
+    def execute(self, context):
+        history = open_history()
+        entry = history.get(self.entry_id) if history else None
+        if not entry or not os.path.exists(entry.output_path):
+            self.report({"ERROR"}, "The result of this generation was removed.")
+            return {"CANCELLED"}
+        display_image_in_editor(entry.output_path)
+        return {"FINISHED"}
+
+
+class ExportTimingsOperator(Operator):
+    """Save the per-phase timings of the last generation job to a JSON file in the output folder"""
+
+    bl_idname = "dreamstudio.export_timings"
+    bl_label = "Export Timings"
+
+    def execute(self, context):
+        metrics = get_job_metrics()
+        out_dir = StateOperator.generated_output_dir
+        if not out_dir:
+            out_dir = get_latest_output_directory(RunKind.IMAGES)
+        timestamp = datetime.fromtimestamp(metrics.started_at).strftime("%Y%m%d_%H%M%S")
+        export_path = os.path.join(out_dir, f"timings_{timestamp}.json")
+        metrics.export_json(export_path)
+        self.report({"INFO"}, f"Timings saved to {export_path}")
+        return {"FINISHED"}
+
+
+class BenchmarkResultLoadingOperator(Operator):
+    """Time loading generated results into Blender from disk, as packed PNG data, and as pixels decoded in memory, at 512, 1024 and 2048 px"""
+
+    bl_idname = "dreamstudio.benchmark_result_loading"
+    bl_label = "Benchmark Result Loading"
+
+    def execute(self, context):
+        if not has_pillow():
+            self.report(
+                {"ERROR"}, "The benchmark needs Pillow. Reinstall dependencies."
+            )
+            return {"CANCELLED"}
+        directory = os.path.join(get_output_root(), "benchmark")
+        os.makedirs(directory, exist_ok=True)
+        results = benchmark_result_loading(directory)
+        for size, timings in results.items():
+            print(
+                "{0}x{0}: ".format(size)
+                + ", ".join(
+                    "{} {}ms".format(name, round(ms, 1)) for name, ms in timings.items()
+                )
+            )
+        largest = results[max(results)]
+        self.report(
+            {"INFO"},
+            "{0}x{0}: disk {1}ms, packed {2}ms, decoded {3}ms. See the console for all sizes.".format(
+                max(results),
+                round(largest["disk"], 1),
+                round(largest["packed"], 1),
+                round(largest["decoded"], 1),
+            ),
+        )
         return {"FINISHED"}
 
 
@@ -0,0 +1,136 @@
+import queue
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+
+# Passed down the pipeline after the last item, once per worker of the receiving stage.
+_END = object()
+
+# How often blocked workers wake up to check whether the pipeline was stopped.
+POLL_INTERVAL = 0.1
+
+
+# One animation frame moving through the generation pipeline.
+class FrameTask:
+    def __init__(self, index: int, frame: int, init_path: str, output_path: str):
+        self.index = index
+        # Scene frame number, used to look up keyframed params.
+        self.frame = frame
+        self.init_path = init_path
+        self.output_path = output_path
+        # Filled in by the pipeline stages.
+        self.args: dict = None
+        self.cost = 0.0
+        # Path or encoded bytes of the init image that gets uploaded.
+        self.init_image = None
+        # Encoded bytes of the generated image.
+        self.result: bytes = None
+        self.started_at = time.perf_counter()
+
+
+class PipelineStage:
+    def __init__(self, name: str, fn: Callable, workers: int, queue_size: int):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        # Bounded, so a fast stage can only run queue_size items ahead of the stage after it.
+        self.input = queue.Queue(maxsize=max(1, queue_size))
+        self.active_workers = self.workers
+        self.lock = threading.Lock()
+
+
+# Runs items through a chain of stages, each with its own worker threads and a bounded queue in front of
+# it, so that e.g. preparing the next frames overlaps with the requests that are in flight.
+# A stage function returns the item to pass on, or None to drop it. The first exception raised by any
+# stage stops the pipeline and is re-raised from run().
+class Pipeline:
+    def __init__(self, should_stop: Callable[[], bool] = None):
+        self.stages: List[PipelineStage] = []
+        self.should_stop = should_stop
+        self.stop_event = threading.Event()
+        self.errors: List[Exception] = []
+
+    def add_stage(self, name: str, fn: Callable, workers: int = 1, queue_size: int = 2):
+        self.stages.append(PipelineStage(name, fn, workers, queue_size))
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    @property
+    def stopped(self) -> bool:
+        if not self.stop_event.is_set() and self.should_stop and self.should_stop():
+            self.stop_event.set()
+        return self.stop_event.is_set()
+
+    def put(self, stage: PipelineStage, item) -> bool:
+        while not self.stopped:
+            try:
+                stage.input.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, stage: PipelineStage):
+        while not self.stopped:
+            try:
+                return stage.input.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                pass
+        return _END
+
+    def next_stage(self, stage: PipelineStage) -> Optional[PipelineStage]:
+        index = self.stages.index(stage)
+        if index + 1 < len(self.stages):
+            return self.stages[index + 1]
+        return None
+
+    def run_worker(self, stage: PipelineStage):
+        next_stage = self.next_stage(stage)
+        while True:
+            item = self.get(stage)
+            if item is _END:
+                break
+            try:
+                result = stage.fn(item)
+            except Exception as e:
+                self.errors.append(e)
+                self.stop()
+                break
+            if result is not None and next_stage:
+                if not self.put(next_stage, result):
+                    break
+        # The last worker of a stage to finish tells the next stage that no more items are coming.
+        with stage.lock:
+            stage.active_workers -= 1
+            last_worker = stage.active_workers == 0
+        if last_worker and next_stage:
+            for _ in range(next_stage.workers):
+                self.put(next_stage, _END)
+
+    # Feed the items into the first stage and block until every stage has drained, or the pipeline stops.
+    def run(self, items: Iterable):
+        threads = []
+        for stage in self.stages:
+            for i in range(stage.workers):
+                thread = threading.Thread(
+                    target=self.run_worker,
+                    args=(stage,),
+                    name=f"pipeline-{stage.name}-{i}",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+        first_stage = self.stages[0]
+        try:
+            for item in items:
+                if not self.put(first_stage, item):
+                    break
+        finally:
+            for _ in range(first_stage.workers):
+                self.put(first_stage, _END)
+            for thread in threads:
+                thread.join()
+        if self.errors:
+            raise self.errors[0]
@@ -0,0 +1,111 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import bpy
+from bpy.app.handlers import persistent
+
+from .imaging import load_resized_png
+
+RENDER_RESULT_NAME = "Render Result"
+# Output settings changed for the capture, in the order they are restored.
+CAPTURE_SETTINGS = ("file_format", "color_mode", "color_depth", "compression")
+
+# Bumped whenever the Render Result may have changed, which Blender doesn't expose otherwise. Together with
+# the color management settings it identifies what a capture holds.
+_render_generation = 0
+
+
+@persistent
+def invalidate_render_capture(*args):
+    global _render_generation
+    _render_generation += 1
+
+
+CAPTURE_HANDLERS = (
+    bpy.app.handlers.render_complete,
+    bpy.app.handlers.render_cancel,
+    bpy.app.handlers.load_post,
+)
+
+
+def register_capture_handlers():
+    for handlers in CAPTURE_HANDLERS:
+        if invalidate_render_capture not in handlers:
+            handlers.append(invalidate_render_capture)
+
+
+def unregister_capture_handlers():
+    for handlers in CAPTURE_HANDLERS:
+        if invalidate_render_capture in handlers:
+            handlers.remove(invalidate_render_capture)
+
+
+# Everything that changes the pixels save_render writes for the Render Result: the render, the slot shown,
+# and the view transform applied on save.
+def render_result_key(image, scene) -> tuple:
+    view = scene.view_settings
+    return (
+        _render_generation,
+        image.render_slots.active_index,
+        scene.name,
+        scene.display_settings.display_device,
+        view.view_transform,
+        view.look,
+        round(view.exposure, 4),
+        round(view.gamma, 4),
+        scene.render.image_settings.color_mode,
+    )
+
+
+# The Render Result saved to disk once. Its pixels can't be read from Python, so one save_render is needed;
+# it is written without PNG compression, and resizing and encoding the upload happen on the generation
+# thread. Resized PNGs are kept by size, so generating again from the same render skips all of it.
+class RenderCapture:
+    def __init__(self, key: tuple, path: str):
+        self.key = key
+        self.path = path
+        self.lock = threading.Lock()
+        self.resized: Dict[Tuple[int, int], bytes] = {}
+
+    # The capture resized and encoded as the upload PNG. Safe to call from worker threads.
+    def resized_png(self, width: int, height: int) -> bytes:
+        with self.lock:
+            data = self.resized.get((width, height))
+            if data is None:
+                data = load_resized_png(self.path, width, height)
+                self.resized[(width, height)] = data
+            return data
+
+
+_last_capture: Optional[RenderCapture] = None
+
+
+# Capture the Render Result into directory, or return the last capture if the render hasn't changed since.
+# Main thread only.
+def capture_render_result(scene, directory: str) -> RenderCapture:
+    global _last_capture
+    image = bpy.data.images[RENDER_RESULT_NAME]
+    key = render_result_key(image, scene)
+    path = os.path.join(directory, "render_result.png")
+    if (
+        _last_capture
+        and _last_capture.key == key
+        and _last_capture.path == path
+        and os.path.exists(path)
+    ):
+        return _last_capture
+    os.makedirs(directory, exist_ok=True)
+    # save_render writes with the scene's output settings, which are put back afterwards. Changing the
+    # file format can change the color mode and depth, so those are restored after it.
+    image_settings = scene.render.image_settings
+    saved = {name: getattr(image_settings, name) for name in CAPTURE_SETTINGS}
+    try:
+        image_settings.file_format = "PNG"
+        image_settings.compression = 0
+        image.save_render(path, scene=scene)
+    finally:
+        for name in CAPTURE_SETTINGS:
+            setattr(image_settings, name, saved[name])
+    _last_capture = RenderCapture(key, path)
+    return _last_capture
@@ -1,3 +1,4 @@
+import io
 import os
 import requests
 import json
@@ -6,19 +7,88 @@ import time
 import bpy
 from .prompt_list import MULTIPROMPT_ENABLED
 from .data import APIType, TrackingEvent, DSAccount, get_preferences, log_sentry_event
-
-
-def render_img2img(input_file_location, output_file_location, args):
+from .metrics import Phase, get_job_metrics
+
+# Engine used when the request args don't specify one.
+DEFAULT_ENGINE_NAME = "stable-diffusion-v1-5"
+
+
+# Request body that notes when the HTTP client has read the last byte of it, which marks the end of the upload.
+class TimedUploadBody:
+    def __init__(self, body: bytes):
+        self.buffer = io.BytesIO(body)
+        self.length = len(body)
+        self.finished_at = None
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        chunk = self.buffer.read(size)
+        if not chunk and self.finished_at is None:
+            self.finished_at = time.perf_counter()
+        return chunk
+
+
+# Send a request, recording upload, server and download time into the current job's metrics.
+# The response content is fully read before returning.
+def send_timed_request(method, url, **kwargs) -> requests.Response:
+    metrics = get_job_metrics()
+    prepared = requests.Request(method, url, **kwargs).prepare()
+    body = None
+    if prepared.body is not None:
+        if isinstance(prepared.body, str):
+            prepared.body = prepared.body.encode("utf-8")
+        body = TimedUploadBody(prepared.body)
+        prepared.body = body
+    with requests.Session() as session:
+        send_start = time.perf_counter()
+        response = session.send(prepared, stream=True)
+        headers_received = time.perf_counter()
+        # If the server answered before reading the whole body, count it all as upload.
+        upload_end = body.finished_at if body and body.finished_at else headers_received
+        metrics.record(Phase.UPLOAD, upload_end - send_start)
+        metrics.record(Phase.SERVER, headers_received - upload_end)
+        with metrics.timer(Phase.DOWNLOAD):
+            response.content
+    return response
+
+
+# Generate from an init image and write the result to output_file_location. The encoded result is returned
+# as well, so it can be shown without reading the file back.
+def render_img2img(init_image, output_file_location, args):
+    status, msg, res_img = generate_img2img(init_image, args)
+    if res_img is not None:
+        write_result_image(output_file_location, res_img)
+    return status, msg, res_img
+
+
+# Generate from an init image, given either as a path to an image file or as its encoded bytes.
+# Returns the status code, the status message and the encoded result image, which is None on failure.
+def generate_img2img(init_image, args):
     preferences = get_preferences()
     api_type = APIType[preferences.api_type]
     log_sentry_event(TrackingEvent.IMG2IMG)
     if api_type == APIType.REST:
-        return render_img2img_rest(input_file_location, output_file_location, args)
+        return generate_img2img_rest(init_image, args)
     if api_type == APIType.GRPC:
-        return render_img2img_grpc(input_file_location, output_file_location, args)
+        return generate_img2img_grpc(init_image, args)
+
+
+def read_init_image(init_image) -> bytes:
+    if isinstance(init_image, (bytes, bytearray)):
+        return bytes(init_image)
+    with open(init_image, "rb") as init_image_file:
+        return init_image_file.read()
+
+
+def write_result_image(output_file_location, res_img: bytes):
+    with get_job_metrics().timer(Phase.WRITE):
+        with open(output_file_location, "wb") as res_img_file:
+            res_img_file.write(res_img)
 
 
-def render_img2img_rest(input_file_location, output_file_location, args):
+def generate_img2img_rest(init_image, args):
     seed = random.randrange(0, 4294967295) if args["seed"] is None else args["seed"]
     all_options = {
         "cfg_scale": args["cfg_scale"],
@@ -34,13 +104,14 @@ def render_img2img_rest(input_file_location, output_file_location, args):
     }
 
     base_url = args["base_url"]
-    url = f"{base_url}/generation/stable-diffusion-v1-5/image-to-image"
+    engine = args.get("engine", DEFAULT_ENGINE_NAME)
+    url = f"{base_url}/generation/{engine}/image-to-image"
 
     payload = {"options": json.dumps(all_options)}
     files = [
         (
             "init_image",
-            ("render_0001.png", open(input_file_location, "rb"), "image/png"),
+            ("render_0001.png", read_init_image(init_image), "image/png"),
         )
     ]
     headers = {
@@ -48,14 +119,15 @@ def render_img2img_rest(input_file_location, output_file_location, args):
         "Authorization": args["api_key"],
     }
 
-    response = requests.request("POST", url, headers=headers, data=payload, files=files)
+    response = send_timed_request(
+        "POST", url, headers=headers, data=payload, files=files
+    )
 
     msg = response.reason
 
+    res_img = None
     if response.status_code in (200, 201):
         res_img = response.content
-        with open(output_file_location, "wb") as res_img_file:
-            res_img_file.write(res_img)
     else:
         try:
             res_body = response.json()
@@ -63,10 +135,10 @@ def render_img2img_rest(input_file_location, output_file_location, args):
             print(msg)
         except json.JSONDecodeError:
             print(response.text)
-    return response.status_code, msg
+    return response.status_code, msg, res_img
 
 
-def render_img2img_grpc(input_file_location, output_file_location, args):
+def generate_img2img_grpc(init_image, args):
 
     from stability_sdk import client, interfaces
     from PIL import Image
@@ -80,11 +152,13 @@ def render_img2img_grpc(input_file_location, output_file_location, args):
     )
 
     stability_inference = client.StabilityInference(
-        key=args["api_key"], host=args["base_url"]
+        key=args["api_key"],
+        host=args["base_url"],
+        engine=args.get("engine", DEFAULT_ENGINE_NAME),
     )
 
     sampler = get_sampler_from_str(args["sampler"])
-    init_img = Image.open(input_file_location)
+    init_img = Image.open(io.BytesIO(read_init_image(init_image)))
     res_img = None
     seed = random.randrange(0, 4294967295) if args["seed"] is None else args["seed"]
     if MULTIPROMPT_ENABLED:
@@ -92,6 +166,8 @@ def render_img2img_grpc(input_file_location, output_file_location, args):
     else:
         prompts = args["prompts"][0]["text"]
     frame_seed = seed
+    metrics = get_job_metrics()
+    request_start = time.perf_counter()
     answers = stability_inference.generate(
         prompt=prompts,
         init_image=init_img,
@@ -113,15 +189,15 @@ def render_img2img_grpc(input_file_location, output_file_location, args):
                 artifact.finish_reason
                 == interfaces.gooseai.generation.generation_pb2.FILTER
             ):
-                return 401, "Safety filter hit"
+                return 401, "Safety filter hit", None
             if (
                 artifact.type
                 == interfaces.gooseai.generation.generation_pb2.ARTIFACT_IMAGE
             ):
-                res_img = Image.open(io.BytesIO(artifact.binary))
-                res_img.save(output_file_location)
-                return 200, "Success"
-    return 500, "No image returned from server"
+                # The gRPC client doesn't expose upload and download separately, so it all counts as server time.
+                metrics.record(Phase.SERVER, time.perf_counter() - request_start)
+                return 200, "Success", artifact.binary
+    return 500, "No image returned from server", None
 
 
 def render_text2img(output_file_directory, args):
@@ -144,7 +220,8 @@ def render_text2img(output_file_directory, args):
     }
 
     base_url = args["base_url"]
-    url = f"{base_url}/generation/stable-diffusion-v1-5/text-to-image"
+    engine = args.get("engine", DEFAULT_ENGINE_NAME)
+    url = f"{base_url}/generation/{engine}/text-to-image"
 
     headers = {
         "Content-Type": "application/json",
@@ -152,18 +229,18 @@ def render_text2img(output_file_directory, args):
         "Authorization": args["api_key"],
     }
 
-    response = requests.request("POST", url, json=payload, headers=headers)
+    response = send_timed_request("POST", url, json=payload, headers=headers)
 
     msg = response.reason
 
+    res_img = None
     if response.status_code in (200, 201):
         res_img = response.content
-        with open(output_file_directory + "/result.png", "wb") as res_img_file:
-            res_img_file.write(res_img)
+        write_result_image(output_file_directory + "/result.png", res_img)
     else:
         res_body = response.json()
         msg = res_body["message"]
-    return response.status_code, msg
+    return response.status_code, msg, res_img
 
 
 def log_analytics_event(
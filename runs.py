@@ -0,0 +1,176 @@
+from datetime import datetime
+from enum import Enum
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Iterable, List, Optional
+
+RUNS_DIRNAME = "runs"
+RUN_TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S_%f"
+
+
+class RunKind(Enum):
+    IMAGES = 1
+    ANIMATION = 2
+
+
+_run_id_lock = threading.Lock()
+_last_run_micros = 0
+
+
+# Run directories are named by their start time, to the microsecond, and a short job id, so they sort by age.
+# The times of the ids made by this process always increase, even for runs started in the same microsecond.
+def new_run_id(now: float = None) -> str:
+    global _last_run_micros
+    micros = round(now * 1e6) if now else time.time_ns() // 1000
+    with _run_id_lock:
+        micros = max(micros, _last_run_micros + 1)
+        _last_run_micros = micros
+    moment = datetime.fromtimestamp(micros // 10**6).replace(
+        microsecond=micros % 10**6
+    )
+    return f"{moment.strftime(RUN_TIMESTAMP_FORMAT)}_{uuid.uuid4().hex[:8]}"
+
+
+def run_kind_directory(root: str, kind: RunKind) -> str:
+    return os.path.join(root, RUNS_DIRNAME, kind.name.lower())
+
+
+def create_run_directory(root: str, kind: RunKind) -> str:
+    path = os.path.join(run_kind_directory(root, kind), new_run_id())
+    os.makedirs(path)
+    return path
+
+
+# Run directories of a kind, oldest first.
+def list_run_directories(root: str, kind: RunKind) -> List[str]:
+    kind_dir = run_kind_directory(root, kind)
+    try:
+        with os.scandir(kind_dir) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_dir())
+    except FileNotFoundError:
+        return []
+    return [os.path.join(kind_dir, name) for name in names]
+
+
+def latest_run_directory(root: str, kind: RunKind) -> Optional[str]:
+    runs = list_run_directories(root, kind)
+    return runs[-1] if runs else None
+
+
+def run_created_at(path: str) -> float:
+    timestamp = "_".join(os.path.basename(path).split("_")[:3])
+    try:
+        return datetime.strptime(timestamp, RUN_TIMESTAMP_FORMAT).timestamp()
+    except ValueError:
+        return os.stat(path).st_mtime
+
+
+def directory_size(path: str) -> int:
+    size = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    size += directory_size(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    size += entry.stat(follow_symlinks=False).st_size
+    except FileNotFoundError:
+        pass
+    return size
+
+
+# Which old runs to keep. A limit of 0 is no limit. The latest run of each kind is always kept, since it is
+# the one a paused or incremental job continues.
+class RetentionPolicy:
+    def __init__(
+        self, max_runs: int = 0, max_age_days: float = 0, max_size_bytes: int = 0
+    ):
+        self.max_runs = max_runs
+        self.max_age_days = max_age_days
+        self.max_size_bytes = max_size_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_runs or self.max_age_days or self.max_size_bytes)
+
+
+# The run directories the policy removes. Each kind keeps its newest max_runs runs; runs older than
+# max_age_days are removed; then, newest first, runs are kept while their total size fits in max_size_bytes.
+def select_expired_runs(
+    root: str, policy: RetentionPolicy, keep: Iterable[str] = (), now: float = None
+) -> List[str]:
+    now = now or time.time()
+    keep = {os.path.normpath(path) for path in keep if path}
+    expired = []
+    candidates = []
+    for kind in RunKind:
+        runs = list_run_directories(root, kind)
+        if not runs:
+            continue
+        for age_rank, path in enumerate(reversed(runs)):
+            if age_rank == 0 or os.path.normpath(path) in keep:
+                continue
+            if policy.max_runs and age_rank >= policy.max_runs:
+                expired.append(path)
+            elif (
+                policy.max_age_days
+                and now - run_created_at(path) > policy.max_age_days * 86400
+            ):
+                expired.append(path)
+            else:
+                candidates.append(path)
+    if policy.max_size_bytes:
+        total = sum(
+            directory_size(path)
+            for kind in RunKind
+            for path in list_run_directories(root, kind)
+            if path not in expired and path not in candidates
+        )
+        for path in sorted(candidates, key=run_created_at, reverse=True):
+            total += directory_size(path)
+            if total > policy.max_size_bytes:
+                expired.append(path)
+    return expired
+
+
+def remove_expired_runs(
+    root: str, policy: RetentionPolicy, keep: Iterable[str] = ()
+) -> List[str]:
+    removed = []
+    for path in select_expired_runs(root, policy, keep):
+        try:
+            shutil.rmtree(path)
+            removed.append(path)
+        except OSError as e:
+            print(f"Could not remove old run {path}: {e}")
+    if removed:
+        print(f"Removed {len(removed)} old runs from {root}")
+    return removed
+
+
+_cleanup_lock = threading.Lock()
+
+
+# Apply the retention policy on a background thread, so removing old results never blocks the UI. A
+# cleanup that is already running is not started twice.
+def start_retention_cleanup(
+    root: str, policy: RetentionPolicy, keep: Iterable[str] = ()
+) -> Optional[threading.Thread]:
+    if not policy.enabled:
+        return None
+    keep = list(keep)
+
+    def cleanup():
+        if not _cleanup_lock.acquire(blocking=False):
+            return
+        try:
+            remove_expired_runs(root, policy, keep)
+        finally:
+            _cleanup_lock.release()
+
+    thread = threading.Thread(target=cleanup, name="run-retention", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,205 @@
+from enum import Enum
+import json
+import os
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+SHARD_MANIFEST_FILENAME = "shard_manifest.json"
+# Progress events are written often, so the manifest is rewritten at most this often.
+MANIFEST_SAVE_INTERVAL = 1.0
+
+
+class ShardStatus(Enum):
+    PENDING = 1
+    RUNNING = 2
+    FINISHED = 3
+    # Stopped at the credit budget, can be resumed.
+    PAUSED = 4
+    FAILED = 5
+    CANCELLED = 6
+
+
+# Split frames into at most shard_count contiguous runs of nearly equal length.
+def split_frames(frames: List[int], shard_count: int) -> List[List[int]]:
+    if not frames:
+        return []
+    shard_count = max(1, min(shard_count, len(frames)))
+    base, extra = divmod(len(frames), shard_count)
+    chunks = []
+    start = 0
+    for i in range(shard_count):
+        length = base + (1 if i < extra else 0)
+        chunks.append(frames[start : start + length])
+        start += length
+    return chunks
+
+
+# One background Blender process generating a run of frames. Its state is updated from the JSON progress
+# lines the process writes to stdout.
+class Shard:
+    def __init__(self, shard_idx: int, frames: List[int], state_directory: str):
+        self.shard_idx = shard_idx
+        self.frame_start = frames[0]
+        self.frame_end = frames[-1]
+        self.state_directory = state_directory
+        self.status = ShardStatus.PENDING
+        self.completed = 0
+        self.total = len(frames)
+        self.spent_credits = 0.0
+        self.error: Optional[str] = None
+        self.exit_code: Optional[int] = None
+        self.process: subprocess.Popen = None
+
+    def handle_event(self, event: dict):
+        kind = event.get("event")
+        if "completed" in event:
+            self.completed = event["completed"]
+        if "total" in event:
+            self.total = event["total"]
+        if "spent_credits" in event:
+            self.spent_credits = event["spent_credits"]
+        if kind == "start":
+            self.status = ShardStatus.RUNNING
+        elif kind == "finished":
+            self.status = ShardStatus.FINISHED
+        elif kind == "paused":
+            self.status = ShardStatus.PAUSED
+        elif kind in ("error", "interrupted"):
+            self.status = ShardStatus.FAILED
+            self.error = event.get("message", kind)
+
+    @property
+    def done(self) -> bool:
+        return self.status not in (ShardStatus.PENDING, ShardStatus.RUNNING)
+
+    def to_dict(self) -> dict:
+        return {
+            "frame_start": self.frame_start,
+            "frame_end": self.frame_end,
+            "state_directory": self.state_directory,
+            "status": self.status.name.lower(),
+            "completed": self.completed,
+            "total": self.total,
+            "spent_credits": self.spent_credits,
+            "error": self.error,
+            "exit_code": self.exit_code,
+            "pid": self.process.pid if self.process else None,
+        }
+
+
+# Runs every shard of a job as its own process, and aggregates their progress for the UI. The processes
+# write their results to the same output directory; the manifest there records the shards and their state.
+# command_for_shard returns the command line that runs a shard.
+class ShardCoordinator:
+    def __init__(
+        self,
+        shards: List[Shard],
+        output_directory: str,
+        command_for_shard: Callable[[Shard], List[str]],
+        env: Dict[str, str] = None,
+    ):
+        self.shards = shards
+        self.output_directory = output_directory
+        self.command_for_shard = command_for_shard
+        self.env = env
+        self.started_at: float = None
+        self.lock = threading.Lock()
+        self.readers: List[threading.Thread] = []
+        self.last_saved = 0.0
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.output_directory, SHARD_MANIFEST_FILENAME)
+
+    def start(self):
+        self.started_at = time.time()
+        for shard in self.shards:
+            shard.process = subprocess.Popen(
+                self.command_for_shard(shard),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                stdin=subprocess.DEVNULL,
+                env=self.env,
+                text=True,
+                bufsize=1,
+            )
+            shard.status = ShardStatus.RUNNING
+            reader = threading.Thread(
+                target=self.read_output,
+                args=(shard,),
+                name=f"shard-{shard.shard_idx}",
+                daemon=True,
+            )
+            reader.start()
+            self.readers.append(reader)
+        self.save_manifest(force=True)
+
+    # Follow a shard's stdout until its process exits. Blender's own output is passed through.
+    def read_output(self, shard: Shard):
+        for line in shard.process.stdout:
+            line = line.strip()
+            event = None
+            if line.startswith("{"):
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    pass
+            if not isinstance(event, dict) or "event" not in event:
+                if line:
+                    print(f"[shard {shard.shard_idx}] {line}")
+                continue
+            with self.lock:
+                shard.handle_event(event)
+            self.save_manifest()
+        shard.exit_code = shard.process.wait()
+        with self.lock:
+            if not shard.done:
+                shard.status = ShardStatus.FAILED
+                shard.error = f"Blender exited with code {shard.exit_code}"
+        self.save_manifest(force=True)
+
+    def stop(self):
+        for shard in self.shards:
+            if shard.process and shard.process.poll() is None:
+                shard.process.terminate()
+            with self.lock:
+                if not shard.done:
+                    shard.status = ShardStatus.CANCELLED
+        self.save_manifest(force=True)
+
+    # Whether every process has exited and its output has been read.
+    @property
+    def finished(self) -> bool:
+        return bool(self.readers) and not any(r.is_alive() for r in self.readers)
+
+    @property
+    def completed(self) -> int:
+        with self.lock:
+            return sum(shard.completed for shard in self.shards)
+
+    @property
+    def total(self) -> int:
+        with self.lock:
+            return sum(shard.total for shard in self.shards)
+
+    @property
+    def failed_shards(self) -> List[Shard]:
+        with self.lock:
+            return [s for s in self.shards if s.status == ShardStatus.FAILED]
+
+    def save_manifest(self, force: bool = False):
+        with self.lock:
+            now = time.time()
+            if not force and now - self.last_saved < MANIFEST_SAVE_INTERVAL:
+                return
+            self.last_saved = now
+            payload = {
+                "started_at": self.started_at,
+                "shards": [shard.to_dict() for shard in self.shards],
+            }
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(payload, f, indent=1)
+            os.replace(tmp_path, self.manifest_path)
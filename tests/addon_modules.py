@@ -0,0 +1,28 @@
+# Lets the tests import the addon's modules without Blender. Loaded as a pytest plugin by pytest.ini.
+#
+# The addon's __init__.py imports bpy, so the repository root is collected as a plain directory rather than
+# a package, and modules are loaded through a stand-in package that shares the root's path but never runs
+# __init__.py. Relative imports between the modules work as in Blender; modules that import bpy can't be
+# loaded.
+import importlib
+import os
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "stability_addon"
+
+
+def pytest_collect_directory(path, parent):
+    if str(path) == ROOT:
+        return pytest.Dir.from_parent(parent, path=path)
+
+
+def load_addon_module(name: str):
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [ROOT]
+        sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module(f"{PACKAGE_NAME}.{name}")
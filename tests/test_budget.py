@@ -0,0 +1,69 @@
+import threading
+
+from addon_modules import load_addon_module
+
+budget = load_addon_module("budget")
+
+
+def test_reservations_count_against_the_limit():
+    credits = budget.CreditBudget(10.0)
+    assert credits.reserve(4.0)
+    assert credits.reserve(4.0)
+    assert not credits.reserve(4.0)
+    credits.release(4.0)
+    assert credits.reserve(4.0)
+    credits.commit(4.0)
+    credits.commit(4.0)
+    assert credits.spent == 8.0
+    assert credits.reserved == 0.0
+    assert credits.affordable_frames(1.0) == 2
+
+
+def test_no_limit():
+    credits = budget.CreditBudget(None)
+    assert all(credits.reserve(100.0) for _ in range(10))
+    assert credits.affordable_frames(1.0) is None
+
+
+# With requests in flight on several threads, no more is reserved than the limit allows.
+def test_concurrent_reservations_hold_the_limit():
+    credits = budget.CreditBudget(50.0)
+    accepted = []
+    lock = threading.Lock()
+
+    def reserve_many():
+        for _ in range(100):
+            if credits.reserve(1.0):
+                credits.commit(1.0)
+                with lock:
+                    accepted.append(1)
+
+    threads = [threading.Thread(target=reserve_many) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(accepted) == 50
+    assert credits.spent == 50.0
+
+
+def test_checkpoint_round_trips(tmp_path):
+    checkpoint = budget.JobCheckpoint(str(tmp_path), "/renders/shot", [1, 2, 3, 5])
+    checkpoint.mark_completed(1, 0.5)
+    checkpoint.mark_completed(3, 0.5)
+    checkpoint.paused_for_budget = True
+    checkpoint.save()
+    loaded = budget.JobCheckpoint.load(str(tmp_path))
+    assert loaded.frames_directory == "/renders/shot"
+    assert loaded.frames == [1, 2, 3, 5]
+    assert loaded.completed_frames == {1, 3}
+    assert loaded.spent_credits == 1.0
+    assert loaded.paused_for_budget
+    assert loaded.failed_frames == [2, 5]
+    assert loaded.remaining_frames == 2
+
+
+def test_missing_or_corrupt_checkpoint_loads_as_none(tmp_path):
+    assert budget.JobCheckpoint.load(str(tmp_path)) is None
+    (tmp_path / budget.CHECKPOINT_FILENAME).write_text("{not json")
+    assert budget.JobCheckpoint.load(str(tmp_path)) is None
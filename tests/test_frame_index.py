@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+from addon_modules import load_addon_module
+
+frame_index = load_addon_module("frame_index")
+
+
+def touch(directory, *names):
+    for name in names:
+        open(os.path.join(directory, name), "wb").close()
+
+
+@pytest.mark.parametrize(
+    "text,frames",
+    [
+        ("1-5", [1, 2, 3, 4, 5]),
+        ("10, 2, 2, 7", [2, 7, 10]),
+        ("1-10:3, 4", [1, 4, 7, 10]),
+        (" 3 - 5 : 2 ,, ", [3, 5]),
+        ("", []),
+    ],
+)
+def test_parse_frame_list(text, frames):
+    assert frame_index.parse_frame_list(text) == frames
+
+
+@pytest.mark.parametrize("text", ["a", "5-1", "1-10:0", "1-", "-3"])
+def test_parse_frame_list_rejects_malformed_items(text):
+    with pytest.raises(ValueError):
+        frame_index.parse_frame_list(text)
+
+
+def test_format_frame_list_round_trips():
+    frames = [1, 2, 3, 5, 8, 9, 10, 20]
+    text = frame_index.format_frame_list(frames)
+    assert text == "1-3, 5, 8-10, 20"
+    assert frame_index.parse_frame_list(text) == frames
+    assert frame_index.format_frame_list([]) == ""
+
+
+@pytest.mark.parametrize(
+    "name,frame",
+    [
+        ("render_0012.png", 12),
+        ("shot3_frame12.png", 12),
+        ("0007.exr", 7),
+        ("cover.png", None),
+    ],
+)
+def test_parse_frame_number(name, frame):
+    assert frame_index.parse_frame_number(name) == frame
+
+
+def test_index_sorts_by_frame_number_and_finds_gaps(tmp_path):
+    touch(tmp_path, "f_10.png", "f_2.png", "f_3.png", "f_7.png", "f_3.PNG", "x.jpg")
+    index = frame_index.FrameIndex.build(str(tmp_path), ("png",))
+    assert index.exists
+    assert index.frames == [2, 3, 3, 7, 10]
+    assert index.frame_range == (2, 10)
+    assert index.gaps == [(4, 6), (8, 9)]
+    assert index.missing_frame_count == 5
+    assert list(index.duplicates) == [3]
+    assert index.count_in_range(3, 9) == 2
+
+
+def test_unnumbered_files_number_every_frame_by_position(tmp_path):
+    touch(tmp_path, "b.png", "a10.png", "a9.png")
+    index = frame_index.FrameIndex.build(str(tmp_path), ("png",))
+    assert index.frame_numbers == [1, 2, 3]
+    assert [os.path.basename(index.frame_paths[i]) for i in (1, 2, 3)] == [
+        "a9.png",
+        "a10.png",
+        "b.png",
+    ]
+
+
+def test_select_splits_existing_and_missing_frames(tmp_path):
+    touch(tmp_path, "1.exr", "2.exr", "4.exr")
+    index = frame_index.FrameIndex.build(
+        str(tmp_path), frame_index.frame_extensions("OPEN_EXR")
+    )
+    selected, missing = index.select([1, 3, 4, 5])
+    assert [frame for frame, _ in selected] == [1, 4]
+    assert missing == [3, 5]
+
+
+def test_missing_directory(tmp_path):
+    index = frame_index.FrameIndex.build(str(tmp_path / "missing"), ("png",))
+    assert not index.exists
+    assert len(index) == 0
+
+
+def test_cache_is_rebuilt_when_the_directory_changes(tmp_path):
+    touch(tmp_path, "1.png")
+    first = frame_index.get_frame_index(str(tmp_path), "PNG")
+    assert frame_index.get_frame_index(str(tmp_path), "PNG") is first
+    touch(tmp_path, "2.png")
+    # Some filesystems only keep the mtime to the second.
+    os.utime(tmp_path, ns=(0, first.mtime_ns + 1_000_000_000))
+    second = frame_index.get_frame_index(str(tmp_path), "PNG")
+    assert second is not first
+    assert second.frame_numbers == [1, 2]
@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+from addon_modules import load_addon_module
+
+frame_plan = load_addon_module("frame_plan")
+incremental = load_addon_module("incremental")
+
+ARGS = {"prompt": "a watercolor city", "steps": 30, "api_key": "sk-1"}
+
+
+@pytest.fixture
+def job(tmp_path):
+    frames_dir = tmp_path / "frames"
+    output_dir = tmp_path / "output"
+    frames_dir.mkdir()
+    output_dir.mkdir()
+    init_frames = []
+    for frame in range(1, 8):
+        path = frames_dir / f"{frame:04d}.png"
+        path.write_bytes(f"frame {frame}".encode())
+        init_frames.append((frame, str(path)))
+    return init_frames, str(output_dir)
+
+
+# Frames 1, 4 and 7 are generated, the rest are interpolated between them.
+def plan_job(init_frames, output_dir):
+    plan = frame_plan.build_frame_plan(
+        init_frames, output_dir, frame_plan.KeyframeMode.STRIDE, 3, 0.0
+    )
+    assert [f.index for f in plan.generated_frames] == [1, 4, 7]
+    return plan
+
+
+def frame_keys(plan, output_dir, args_for_frame=lambda frame: ARGS):
+    index, stale = incremental.GenerationIndex.load(output_dir, "settings")
+    assert not stale
+    keys = incremental.compute_frame_keys(plan, index, args_for_frame, 0.5)
+    for frame_idx, key in keys.items():
+        index.record(frame_idx, key)
+    index.save(force=True)
+    return keys
+
+
+def changed_frames(before, after):
+    return sorted(i for i in before if before[i] != after[i])
+
+
+def test_unchanged_job_keeps_every_key(job):
+    init_frames, output_dir = job
+    plan = plan_job(init_frames, output_dir)
+    keys = frame_keys(plan, output_dir)
+    index, _ = incremental.GenerationIndex.load(output_dir, "settings")
+    assert all(index.is_current(i, key) for i, key in keys.items())
+    assert frame_keys(plan_job(init_frames, output_dir), output_dir) == keys
+
+
+def test_changed_args_only_affect_that_frame_and_its_segments(job):
+    init_frames, output_dir = job
+    plan = plan_job(init_frames, output_dir)
+    keys = frame_keys(plan, output_dir)
+    changed = frame_keys(
+        plan, output_dir, lambda frame: dict(ARGS, steps=50) if frame == 4 else ARGS
+    )
+    assert changed_frames(keys, changed) == [2, 3, 4, 5, 6]
+
+
+def test_api_key_does_not_change_the_keys(job):
+    init_frames, output_dir = job
+    plan = plan_job(init_frames, output_dir)
+    keys = frame_keys(plan, output_dir)
+    assert (
+        frame_keys(plan, output_dir, lambda frame: dict(ARGS, api_key="sk-2")) == keys
+    )
+
+
+def test_changed_init_frame_is_regenerated(job):
+    init_frames, output_dir = job
+    keys = frame_keys(plan_job(init_frames, output_dir), output_dir)
+    with open(init_frames[0][1], "wb") as f:
+        f.write(b"edited")
+    # Touching a frame without changing it keeps its key.
+    stat = os.stat(init_frames[6][1])
+    os.utime(init_frames[6][1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    changed = frame_keys(plan_job(init_frames, output_dir), output_dir)
+    assert changed_frames(keys, changed) == [1, 2, 3]
+
+
+def test_changed_settings_make_the_index_stale(job):
+    init_frames, output_dir = job
+    frame_keys(plan_job(init_frames, output_dir), output_dir)
+    index, stale = incremental.GenerationIndex.load(output_dir, "other settings")
+    assert stale
+    assert index.entries == {}
+
+
+def test_remove_stale_outputs(job):
+    init_frames, output_dir = job
+    plan = plan_job(init_frames, output_dir)
+    for frame in plan.frames[:3]:
+        open(frame.output_path, "wb").close()
+    incremental.remove_stale_outputs(plan)
+    assert os.listdir(output_dir) == []
@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from addon_modules import load_addon_module
+
+live_preview = load_addon_module("live_preview")
+
+
+# What every position should show, worked out from scratch: the latest completed frame at or before it, or
+# the earliest completed frame if none is.
+def expected_shown(first_frame, paths):
+    completed = sorted(paths)
+    shown = []
+    for frame in range(first_frame, completed[-1] + 1):
+        held = [f for f in completed if f <= frame]
+        shown.append(paths[held[-1] if held else completed[0]])
+    return shown
+
+
+def test_frames_hold_until_the_next_completed_frame():
+    sequence = live_preview.HeldFrameSequence(1)
+    assert sequence.add([(3, "c")]) == [0, 1, 2]
+    assert sequence.shown == ["c", "c", "c"]
+    assert sequence.add([(6, "f")]) == [3, 4, 5]
+    assert sequence.shown == ["c", "c", "c", "c", "c", "f"]
+    assert sequence.add([(1, "a"), (4, "d")]) == [0, 1, 3, 4]
+    assert sequence.shown == ["a", "a", "c", "d", "d", "f"]
+
+
+def test_retried_frames_replace_what_they_held():
+    sequence = live_preview.HeldFrameSequence(0)
+    sequence.add([(0, "a"), (2, "c")])
+    assert sequence.add([(2, "c2")]) == [2]
+    assert sequence.shown == ["a", "a", "c2"]
+    assert sequence.add([(2, "c2")]) == []
+
+
+def test_frames_before_the_first_frame_are_shown_at_the_start():
+    sequence = live_preview.HeldFrameSequence(10)
+    assert sequence.add([(4, "early")]) == [0]
+    assert sequence.shown == ["early"]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_any_completion_order_matches_the_held_frames(seed):
+    rng = random.Random(seed)
+    first_frame = 5
+    frames = rng.sample(range(first_frame, first_frame + 60), 25)
+    sequence = live_preview.HeldFrameSequence(first_frame)
+    paths = {}
+    shown = []
+    while frames:
+        batch = [
+            (frames.pop(), f"r{seed}_{i}") for i in range(rng.randint(1, 4)) if frames
+        ]
+        # Retry an earlier frame now and then.
+        if paths and rng.random() < 0.3:
+            batch.append((rng.choice(sorted(paths)), f"retry_{len(shown)}"))
+        changed = sequence.add(batch)
+        paths.update(batch)
+        new_shown = expected_shown(first_frame, paths)
+        assert sequence.shown == new_shown
+        assert changed == [
+            p
+            for p in range(len(new_shown))
+            if p >= len(shown) or shown[p] != new_shown[p]
+        ]
+        shown = new_shown
+
+
+def test_channel_batches_frames_between_updates():
+    channel = live_preview.LiveFrameChannel(interval=60)
+    channel.push(1, "a")
+    assert channel.take(force=True) == [(1, "a")]
+    channel.push(2, "b")
+    channel.push(3, "c")
+    assert channel.take() == []
+    assert channel.take(force=True) == [(2, "b"), (3, "c")]
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from addon_modules import load_addon_module
+
+metrics = load_addon_module("metrics")
+
+
+def test_small_values_are_exact():
+    histogram = metrics.LatencyHistogram()
+    for us in range(100):
+        histogram.record(us / 1_000_000)
+    assert histogram.percentile(50) == pytest.approx(0.049)
+    assert histogram.percentile(100) == pytest.approx(0.099)
+
+
+def test_bucket_indices_increase_with_the_value():
+    histogram = metrics.LatencyHistogram()
+    values = np.unique(np.geomspace(1, 10**9, 2000).astype(int))
+    indices = [histogram.bucket_index(int(v)) for v in values]
+    assert indices == sorted(indices)
+
+
+@pytest.mark.parametrize("percentile", [50, 90, 95, 99])
+def test_percentiles_are_within_the_relative_error(percentile):
+    rng = np.random.default_rng(0)
+    seconds = rng.lognormal(mean=0, sigma=1.5, size=5000)
+    histogram = metrics.LatencyHistogram()
+    for value in seconds:
+        histogram.record(value)
+    expected_ms = np.percentile(seconds, percentile, method="nearest") * 1000
+    bound = 2 ** -(histogram.sub_bucket_bits - 1)
+    assert histogram.percentile(percentile) == pytest.approx(expected_ms, rel=bound)
+
+
+def test_empty_histogram():
+    histogram = metrics.LatencyHistogram()
+    assert histogram.percentile(95) == 0.0
+    assert histogram.to_dict()["mean_ms"] == 0.0
+
+
+def test_summary_only_lists_recorded_phases_in_order():
+    job = metrics.JobMetrics()
+    job.record(metrics.Phase.TOTAL, 2.0)
+    job.record(metrics.Phase.UPLOAD, 0.5)
+    job.record(metrics.Phase.UPLOAD, 0.5)
+    summary = job.summary()
+    assert [phase for phase, *_ in summary] == [
+        metrics.Phase.UPLOAD,
+        metrics.Phase.TOTAL,
+    ]
+    assert summary[0][1] == 2
+    assert summary[0][2] == pytest.approx(500)
+
+
+def new_progress(total_frames=10, completed=()):
+    progress = metrics.JobProgress(total_frames, concurrency=2, completed=completed)
+    progress.last_sample_at = 0.0
+    return progress
+
+
+def test_frames_are_counted_once():
+    progress = new_progress(completed=[0])
+    progress.frame_started(1)
+    progress.frame_failed(1)
+    assert progress.snapshot(now=1.0)["failed"] == 1
+    progress.frame_started(1)
+    assert progress.snapshot(now=1.0)["in_flight"] == 1
+    progress.frame_completed(1, now=1.0)
+    progress.frame_completed(1, now=2.0)
+    progress.frame_completed(0, now=2.0)
+    snapshot = progress.snapshot(now=2.0)
+    assert snapshot["completed"] == 2
+    assert snapshot["in_flight"] == 0
+    assert snapshot["failed"] == 0
+    assert progress.remaining_frames == 8
+
+
+def test_steady_rate_projects_the_time_left():
+    progress = new_progress()
+    assert progress.eta_seconds(now=0.5) is None
+    for index in range(4):
+        progress.frame_completed(index, now=float(index + 1))
+    assert progress.frames_per_minute(now=4.0) == pytest.approx(60)
+    assert progress.eta_seconds(now=4.0) == pytest.approx(6)
+
+
+def test_rate_decays_while_no_frame_completes():
+    progress = new_progress()
+    for index in range(3):
+        progress.frame_completed(index, now=float(index + 1))
+    rate = progress.frames_per_minute(now=3.0)
+    assert progress.frames_per_minute(now=30.0) < rate / 2
+    assert progress.eta_seconds(now=30.0) > progress.eta_seconds(now=3.0)
+
+
+def test_eta_is_zero_once_every_frame_is_done():
+    progress = new_progress(total_frames=2)
+    progress.frame_completed(0, now=1.0)
+    progress.frame_completed(1, now=2.0)
+    assert progress.eta_seconds(now=5.0) == 0.0
@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+from addon_modules import load_addon_module
+
+pipeline = load_addon_module("pipeline")
+
+
+def test_items_pass_through_every_stage():
+    results = []
+    lock = threading.Lock()
+
+    def collect(item):
+        with lock:
+            results.append(item)
+
+    pipeline.Pipeline().add_stage("double", lambda x: x * 2, workers=3).add_stage(
+        "add", lambda x: x + 1, workers=2
+    ).add_stage("collect", collect).run(range(50))
+    assert sorted(results) == [x * 2 + 1 for x in range(50)]
+
+
+def test_none_drops_the_item():
+    results = []
+    pipeline.Pipeline().add_stage(
+        "odd", lambda x: x if x % 2 else None, workers=2
+    ).add_stage("collect", results.append).run(range(10))
+    assert sorted(results) == [1, 3, 5, 7, 9]
+
+
+def test_first_error_stops_the_pipeline_and_is_raised():
+    seen = []
+
+    def fail_on_three(item):
+        if item == 3:
+            raise ValueError("bad frame")
+        return item
+
+    with pytest.raises(ValueError, match="bad frame"):
+        pipeline.Pipeline().add_stage("check", fail_on_three).add_stage(
+            "collect", seen.append
+        ).run(range(1000))
+    assert 3 not in seen
+    assert len(seen) < 1000
+
+
+def test_should_stop_ends_the_run():
+    processed = []
+
+    def slow(item):
+        time.sleep(0.01)
+        processed.append(item)
+
+    stop_after = 5
+    pipeline.Pipeline(should_stop=lambda: len(processed) >= stop_after).add_stage(
+        "slow", slow
+    ).run(range(1000))
+    assert stop_after <= len(processed) < 20
+
+
+# A fast stage can only run queue_size items ahead of a slow one.
+def test_queues_bound_how_far_a_stage_runs_ahead():
+    produced = []
+    lead = []
+
+    def produce(item):
+        produced.append(item)
+        return item
+
+    def consume(item):
+        lead.append(len(produced) - item)
+        time.sleep(0.005)
+
+    pipeline.Pipeline().add_stage("produce", produce).add_stage(
+        "consume", consume, queue_size=2
+    ).run(range(40))
+    assert len(produced) == 40
+    # The consumed item, the queue in front of it, and the one the producer is blocked on.
+    assert max(lead) <= 4
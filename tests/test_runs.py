@@ -0,0 +1,116 @@
+from datetime import datetime
+import os
+import time
+
+import pytest
+
+from addon_modules import load_addon_module
+
+runs = load_addon_module("runs")
+
+DAY = 86400
+NOW = datetime(2024, 6, 1, 12).timestamp()
+
+
+# Make a run directory of a kind, started days_ago days before NOW, holding size bytes.
+def make_run(root, kind, days_ago: float, size: int = 0, suffix="abcd0123"):
+    started = datetime.fromtimestamp(NOW - days_ago * DAY)
+    name = f"{started.strftime(runs.RUN_TIMESTAMP_FORMAT)}_{suffix}"
+    path = os.path.join(runs.run_kind_directory(str(root), kind), name)
+    os.makedirs(path)
+    with open(os.path.join(path, "result.png"), "wb") as f:
+        f.write(b"\0" * size)
+    return path
+
+
+def names(paths):
+    return sorted(os.path.basename(path) for path in paths)
+
+
+def test_run_ids_sort_in_the_order_they_were_made():
+    ids = [runs.new_run_id() for _ in range(500)]
+    assert sorted(ids) == ids
+    assert len(set(ids)) == len(ids)
+
+
+def test_run_created_at_reads_the_name(tmp_path):
+    path = make_run(tmp_path, runs.RunKind.IMAGES, days_ago=3)
+    assert runs.run_created_at(path) == pytest.approx(NOW - 3 * DAY)
+
+
+def test_latest_run_is_the_newest_of_its_kind(tmp_path):
+    assert runs.latest_run_directory(str(tmp_path), runs.RunKind.IMAGES) is None
+    make_run(tmp_path, runs.RunKind.IMAGES, days_ago=2)
+    newest = make_run(tmp_path, runs.RunKind.IMAGES, days_ago=1)
+    created = runs.create_run_directory(str(tmp_path), runs.RunKind.ANIMATION)
+    assert runs.latest_run_directory(str(tmp_path), runs.RunKind.IMAGES) == newest
+    assert runs.latest_run_directory(str(tmp_path), runs.RunKind.ANIMATION) == created
+
+
+def test_max_runs_keeps_the_newest_runs_of_each_kind(tmp_path):
+    images = [make_run(tmp_path, runs.RunKind.IMAGES, days) for days in (4, 3, 2, 1)]
+    animation = make_run(tmp_path, runs.RunKind.ANIMATION, 10)
+    expired = runs.select_expired_runs(
+        str(tmp_path), runs.RetentionPolicy(max_runs=2), now=NOW
+    )
+    assert names(expired) == names(images[:2])
+    assert animation not in expired
+
+
+def test_max_age_never_removes_the_latest_run(tmp_path):
+    old = [make_run(tmp_path, runs.RunKind.IMAGES, days) for days in (40, 35, 31)]
+    recent = make_run(tmp_path, runs.RunKind.ANIMATION, 2)
+    only_animation = make_run(tmp_path, runs.RunKind.ANIMATION, 50)
+    expired = runs.select_expired_runs(
+        str(tmp_path), runs.RetentionPolicy(max_age_days=30), now=NOW
+    )
+    # The newest images run is kept even though it's older than the limit.
+    assert names(expired) == names(old[:2] + [only_animation])
+    assert recent not in expired
+
+
+def test_kept_runs_are_not_removed(tmp_path):
+    paused = make_run(tmp_path, runs.RunKind.ANIMATION, 20)
+    make_run(tmp_path, runs.RunKind.ANIMATION, 1)
+    expired = runs.select_expired_runs(
+        str(tmp_path),
+        runs.RetentionPolicy(max_runs=1, max_age_days=7),
+        keep=[paused, None],
+        now=NOW,
+    )
+    assert expired == []
+
+
+def test_max_size_keeps_the_newest_runs_that_fit(tmp_path):
+    sizes = {5: 400, 4: 300, 3: 200, 2: 100}
+    paths = {
+        days: make_run(tmp_path, runs.RunKind.IMAGES, days, size)
+        for days, size in sizes.items()
+    }
+    latest = make_run(tmp_path, runs.RunKind.IMAGES, 1, 500)
+    expired = runs.select_expired_runs(
+        str(tmp_path), runs.RetentionPolicy(max_size_bytes=1000), now=NOW
+    )
+    # The latest run counts against the limit, but is never removed.
+    assert names(expired) == names([paths[4], paths[5]])
+    assert latest not in expired
+
+
+def test_remove_expired_runs_deletes_them(tmp_path):
+    old = make_run(tmp_path, runs.RunKind.IMAGES, 3, size=10)
+    latest = make_run(tmp_path, runs.RunKind.IMAGES, 0, size=10)
+    policy = runs.RetentionPolicy(max_runs=1)
+    assert runs.remove_expired_runs(str(tmp_path), policy) == [old]
+    assert not os.path.exists(old)
+    assert os.path.exists(latest)
+
+
+def test_cleanup_runs_in_the_background(tmp_path):
+    assert runs.start_retention_cleanup(str(tmp_path), runs.RetentionPolicy()) is None
+    old = make_run(tmp_path, runs.RunKind.IMAGES, (time.time() - NOW) / DAY + 3)
+    runs.create_run_directory(str(tmp_path), runs.RunKind.IMAGES)
+    thread = runs.start_retention_cleanup(
+        str(tmp_path), runs.RetentionPolicy(max_age_days=1)
+    )
+    thread.join(timeout=10)
+    assert not os.path.exists(old)
@@ -0,0 +1,114 @@
+import io
+
+import numpy as np
+import pytest
+
+from addon_modules import load_addon_module
+
+tiling = load_addon_module("tiling")
+
+
+# (width, height, tile_size, overlap)
+LAYOUT_SIZES = [
+    (1200, 900, 896, 128),
+    (3000, 2000, 896, 128),
+    (2048, 2048, 512, 256),
+    (4096, 1024, 960, 32),
+    (1500, 1100, 896, 128),
+]
+
+
+@pytest.mark.parametrize("width,height,tile_size,overlap", LAYOUT_SIZES)
+def test_layout_covers_image(width, height, tile_size, overlap):
+    layout = tiling.TileLayout(width, height, tile_size, overlap)
+    coverage = np.zeros((height, width), dtype=np.int32)
+    for tile in layout.tiles:
+        assert tile.width % tiling.TILE_SIDE_STEP == 0
+        assert tile.height % tiling.TILE_SIDE_STEP == 0
+        assert tile.x >= 0 and tile.y >= 0
+        assert tile.x + tile.width <= width and tile.y + tile.height <= height
+        coverage[tile.y : tile.y + tile.height, tile.x : tile.x + tile.width] += 1
+    assert coverage.min() >= 1
+    assert layout.count == len(layout.columns) * len(layout.rows)
+    assert layout.is_supported
+
+
+@pytest.mark.parametrize("width,height,tile_size,overlap", LAYOUT_SIZES)
+def test_neighbours_overlap(width, height, tile_size, overlap):
+    layout = tiling.TileLayout(width, height, tile_size, overlap)
+    for starts, side in (
+        (layout.columns, layout.tile_width),
+        (layout.rows, layout.tile_height),
+    ):
+        for prev, start in zip(starts, starts[1:]):
+            assert start > prev
+            assert prev + side - start >= min(overlap, side // 2)
+
+
+def test_tile_starts_caps_overlap_at_half_the_side():
+    starts = tiling.tile_starts(1000, 128, 128)
+    assert starts[0] == 0
+    assert starts[-1] == 1000 - 128
+    assert all(0 < b - a <= 64 for a, b in zip(starts, starts[1:]))
+
+
+@pytest.mark.parametrize(
+    "width,height", [(8000, 180), (12000, 96), (40, 5000), (6000, 255)]
+)
+def test_narrow_images_are_unsupported(width, height):
+    layout = tiling.TileLayout(width, height, 896, 128)
+    assert not layout.is_supported
+    for tile in layout.tiles:
+        assert tile.x + tile.width <= width and tile.y + tile.height <= height
+
+
+# Where only two tiles overlap, their ramps add up to 1, so the blend keeps the brightness of the tiles
+# across the seams without relying on the assembler's normalization.
+@pytest.mark.parametrize(
+    "length,side,overlap", [(3000, 896, 128), (2000, 512, 128), (4096, 960, 32)]
+)
+def test_ramps_sum_to_one(length, side, overlap):
+    starts = tiling.tile_starts(length, side, overlap)
+    before, after = tiling.neighbour_overlaps(starts, side)
+    total = np.zeros(length, dtype=np.float32)
+    for start, start_overlap, end_overlap in zip(starts, before, after):
+        total[start : start + side] += tiling.feather_ramp(
+            side, start_overlap, end_overlap
+        )
+    np.testing.assert_allclose(total, 1, atol=1e-5)
+
+
+def test_feather_ramp_is_never_zero():
+    ramp = tiling.feather_ramp(256, 64, 64)
+    assert ramp.min() > 0
+    assert ramp.max() == 1
+    np.testing.assert_allclose(ramp[:64] + ramp[:64][::-1], 1, atol=1e-6)
+
+
+def encode_png(pixels) -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, "RGB").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def decode_png(data: bytes):
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        return np.asarray(img.convert("RGB"))
+
+
+@pytest.mark.parametrize("width,height,tile_size,overlap", LAYOUT_SIZES[:3])
+def test_assembler_reproduces_tiles_of_one_image(width, height, tile_size, overlap):
+    pytest.importorskip("PIL")
+    rng = np.random.default_rng(0)
+    source = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    layout = tiling.TileLayout(width, height, tile_size, overlap)
+    assembler = tiling.TileAssembler(layout)
+    # Added out of order, as they complete.
+    for tile in reversed(layout.tiles):
+        crop = source[tile.y : tile.y + tile.height, tile.x : tile.x + tile.width]
+        assembler.add(tile, encode_png(np.ascontiguousarray(crop)))
+    np.testing.assert_array_equal(decode_png(assembler.encode()), source)
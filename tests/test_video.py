@@ -0,0 +1,46 @@
+import random
+
+from addon_modules import load_addon_module
+
+video = load_addon_module("video")
+
+
+def test_frames_in_order_pass_straight_through():
+    buffer = video.FrameReorderBuffer([0, 1, 2])
+    assert buffer.push(0, "a") == ["a"]
+    assert buffer.push(1, "b") == ["b"]
+    assert buffer.push(2, "c") == ["c"]
+    assert buffer.drain() == []
+
+
+def test_frames_are_held_until_every_earlier_frame_is_done():
+    buffer = video.FrameReorderBuffer([0, 1, 2, 3])
+    assert buffer.push(2, "c") == []
+    assert buffer.push(1, "b") == []
+    assert buffer.push(0, "a") == ["a", "b", "c"]
+    assert buffer.push(3, "d") == ["d"]
+
+
+def test_any_completion_order_gives_the_video_order():
+    # Frame indices in the order they appear in the video.
+    order = [5, 3, 8, 0, 1, 9, 2, 7, 6, 4]
+    rng = random.Random(0)
+    for _ in range(20):
+        completion = order[:]
+        rng.shuffle(completion)
+        buffer = video.FrameReorderBuffer(order)
+        written = []
+        for index in completion:
+            written += buffer.push(index, f"frame_{index}")
+        assert written == [f"frame_{index}" for index in order]
+
+
+def test_drain_skips_frames_that_never_completed():
+    buffer = video.FrameReorderBuffer([0, 1, 2, 3, 4])
+    assert buffer.push(0, "a") == ["a"]
+    assert buffer.push(4, "e") == []
+    assert buffer.push(2, "c") == []
+    assert buffer.drain() == ["c", "e"]
+    # Frames after the drain that are earlier than the last written frame are dropped.
+    assert buffer.push(1, "b") == []
+    assert buffer.drain() == []
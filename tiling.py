@@ -0,0 +1,213 @@
+from enum import Enum
+import io
+import math
+import threading
+from typing import List
+
+# Largest init image the API accepts, in pixels. Larger images are generated as tiles that fit it.
+MAX_INIT_PIXELS = 1_000_000
+# Tile sides are multiples of this, as the API requires.
+TILE_SIDE_STEP = 64
+# Shortest tile side that is generated. The API rejects the smallest sides, and narrow tiles give little to
+# blend across, so images with a side shorter than this aren't tiled.
+MIN_TILE_SIDE = 256
+
+
+class TileStatus(Enum):
+    PENDING = 1
+    RUNNING = 2
+    DONE = 3
+    FAILED = 4
+
+
+# A tile's rectangle in the full image, in Pillow coordinates: x to the right and y down from the top left.
+class Tile:
+    def __init__(
+        self, index: int, row: int, column: int, x: int, y: int, width: int, height: int
+    ):
+        self.index = index
+        self.row = row
+        self.column = column
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    @property
+    def box(self):
+        return self.x, self.y, self.x + self.width, self.y + self.height
+
+
+# Start positions of tiles of the given side along an axis, spread evenly so that neighbours overlap by at
+# least overlap pixels and the last tile ends at the edge. The overlap is capped at half the side, so every
+# tile moves the next one forward.
+def tile_starts(length: int, side: int, overlap: int) -> List[int]:
+    if side >= length:
+        return [0]
+    overlap = min(overlap, side // 2)
+    count = math.ceil((length - overlap) / (side - overlap))
+    return [round(i * (length - side) / (count - 1)) for i in range(count)]
+
+
+# The tiles covering an image of the given size. Tiles are at most tile_size on a side, snapped down to
+# multiples of TILE_SIDE_STEP and to the image size, and listed row by row from the top left. Check
+# is_supported before generating it.
+class TileLayout:
+    def __init__(self, width: int, height: int, tile_size: int, overlap: int):
+        self.width = width
+        self.height = height
+        self.overlap = overlap
+
+        def side(length: int) -> int:
+            snapped = min(tile_size, length) // TILE_SIDE_STEP * TILE_SIDE_STEP
+            return min(length, max(TILE_SIDE_STEP, snapped))
+
+        self.tile_width = side(width)
+        self.tile_height = side(height)
+        self.columns = tile_starts(width, self.tile_width, overlap)
+        self.rows = tile_starts(height, self.tile_height, overlap)
+        self.tiles = [
+            Tile(
+                row * len(self.columns) + column,
+                row,
+                column,
+                x,
+                y,
+                self.tile_width,
+                self.tile_height,
+            )
+            for row, y in enumerate(self.rows)
+            for column, x in enumerate(self.columns)
+        ]
+
+    @property
+    def count(self) -> int:
+        return len(self.tiles)
+
+    # Whether the tiles are large enough to generate. Not the case for images with a side shorter than
+    # MIN_TILE_SIDE, like very wide or very tall ones.
+    @property
+    def is_supported(self) -> bool:
+        return min(self.tile_width, self.tile_height) >= MIN_TILE_SIDE
+
+
+def needs_tiling(width: int, height: int) -> bool:
+    return width * height > MAX_INIT_PIXELS
+
+
+# Crop the init image into the layout's tiles, each encoded as PNG. init_image is a path or encoded bytes,
+# and is resized to the layout's size if it isn't already.
+def split_image(init_image, layout: TileLayout) -> List[bytes]:
+    from PIL import Image
+
+    source = io.BytesIO(init_image) if isinstance(init_image, bytes) else init_image
+    with Image.open(source) as img:
+        img = img.convert("RGB")
+    if img.size != (layout.width, layout.height):
+        img = img.resize(
+            (layout.width, layout.height), getattr(Image, "Resampling", Image).LANCZOS
+        )
+    tiles = []
+    for tile in layout.tiles:
+        buffer = io.BytesIO()
+        img.crop(tile.box).save(buffer, format="PNG")
+        tiles.append(buffer.getvalue())
+    return tiles
+
+
+# Blend weight along one side of a tile: ramps up smoothly across the overlap at each end that meets a
+# neighbouring tile, and is 1 elsewhere. Never 0, so every pixel has some weight.
+def feather_ramp(length: int, start_overlap: int, end_overlap: int):
+    import numpy as np
+
+    def edge(overlap: int):
+        t = (np.arange(overlap, dtype=np.float32) + 0.5) / overlap
+        return 0.5 - 0.5 * np.cos(np.pi * t)
+
+    ramp = np.ones(length, dtype=np.float32)
+    if start_overlap > 0:
+        ramp[:start_overlap] = np.minimum(ramp[:start_overlap], edge(start_overlap))
+    if end_overlap > 0:
+        end = slice(length - end_overlap, length)
+        ramp[end] = np.minimum(ramp[end], edge(end_overlap)[::-1])
+    return ramp
+
+
+# Overlap of a run of tiles along an axis with the tile before and after each one.
+def neighbour_overlaps(starts: List[int], side: int):
+    before = [0] + [prev + side - start for prev, start in zip(starts, starts[1:])]
+    after = before[1:] + [0]
+    return before, after
+
+
+# Reassembles generated tiles into the full image, blending each into its neighbours across the overlaps.
+# Tiles can be added in any order and from several threads.
+class TileAssembler:
+    def __init__(self, layout: TileLayout):
+        import numpy as np
+
+        self.layout = layout
+        self.lock = threading.Lock()
+        self.color = np.zeros((layout.height, layout.width, 3), dtype=np.float32)
+        self.weight = np.zeros((layout.height, layout.width), dtype=np.float32)
+        x_before, x_after = neighbour_overlaps(layout.columns, layout.tile_width)
+        y_before, y_after = neighbour_overlaps(layout.rows, layout.tile_height)
+        self.column_ramps = [
+            feather_ramp(layout.tile_width, before, after)
+            for before, after in zip(x_before, x_after)
+        ]
+        self.row_ramps = [
+            feather_ramp(layout.tile_height, before, after)
+            for before, after in zip(y_before, y_after)
+        ]
+
+    # Add a generated tile, given as encoded image bytes.
+    def add(self, tile: Tile, data: bytes):
+        import numpy as np
+        from PIL import Image
+
+        with Image.open(io.BytesIO(data)) as img:
+            img = img.convert("RGB")
+            if img.size != (tile.width, tile.height):
+                img = img.resize((tile.width, tile.height))
+            pixels = np.asarray(img, dtype=np.float32)
+        weight = np.outer(self.row_ramps[tile.row], self.column_ramps[tile.column])
+        rows = slice(tile.y, tile.y + tile.height)
+        columns = slice(tile.x, tile.x + tile.width)
+        with self.lock:
+            self.color[rows, columns] += pixels * weight[..., None]
+            self.weight[rows, columns] += weight
+
+    # The blended image, encoded as PNG.
+    def encode(self) -> bytes:
+        import numpy as np
+        from PIL import Image
+
+        with self.lock:
+            pixels = self.color / np.maximum(self.weight, 1e-6)[..., None]
+        buffer = io.BytesIO()
+        Image.fromarray(np.clip(np.rint(pixels), 0, 255).astype(np.uint8), "RGB").save(
+            buffer, format="PNG"
+        )
+        return buffer.getvalue()
+
+
+# Status of every tile of the running job, for the UI.
+class TileProgress:
+    def __init__(self, layout: TileLayout):
+        self.layout = layout
+        self.lock = threading.Lock()
+        self.statuses = [TileStatus.PENDING] * layout.count
+
+    def set_status(self, tile: Tile, status: TileStatus):
+        with self.lock:
+            self.statuses[tile.index] = status
+
+    def snapshot(self) -> List[TileStatus]:
+        with self.lock:
+            return list(self.statuses)
+
+    @property
+    def completed(self) -> int:
+        with self.lock:
+            return self.statuses.count(TileStatus.DONE)
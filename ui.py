@@ -8,33 +8,61 @@ from glob import glob
 import bpy
 
 from .prompt_list import render_prompt_list
+from .frame_index import FrameSelection, parse_frame_list
+from .frame_plan import KeyframeMode, estimate_api_calls
+from .imaging import has_pillow
+from .datablocks import get_addon_image_memory
+from .frame_conversion import has_openexr
+from .metrics import PHASE_LABELS, get_job_metrics
 
 from .data import (
     SUPPORTED_RENDER_FILE_TYPES,
+    EXR_RENDER_FILE_TYPES,
     InitType,
     OutputDisplayLocation,
     RenderState,
     UIContext,
     ValidationState,
+    estimate_frame_credits,
+    estimate_preview_credits,
+    get_anim_frame_index,
+    get_anim_frame_selection,
     get_anim_images,
+    get_credit_limit,
     get_init_image_dimensions,
     get_init_type,
+    get_history_filter,
     get_preferences,
+    get_tile_layout,
 )
 from .operators import (
+    BatchTextureOperator,
+    BenchmarkResultLoadingOperator,
     CancelRenderOperator,
+    ContinueRenderOperator,
     DS_OpenPresetsFileOperator,
+    ExportTimingsOperator,
+    FreeUnusedImagesOperator,
     GetAPIKeyOperator,
+    HistoryPageOperator,
+    OpenHistoryEntryOperator,
     DS_LogIssueOperator,
     FinishOnboardingOperator,
     DS_OpenDocumentationOperator,
     OpenOutputFolderOperator,
+    ResumeJobOperator,
     SceneRenderExistingOutputOperator,
     SceneRenderViewportOperator,
+    ShardedRenderOperator,
     UseRenderFolderOperator,
     StateOperator,
+    open_history,
 )
-
+from .batch_textures import BatchStatus, BatchTextureJob
+from .gallery import GALLERY_COLUMNS, GALLERY_PAGE_SIZE, history_gallery
+from .sharding import ShardStatus
+from .tiling import MIN_TILE_SIDE, TileProgress, TileStatus, needs_tiling
+from .video import VideoOutput, find_ffmpeg
 
 ADDON_CATEGORY = "Stability"
 DS_REGION_TYPE = "UI"
@@ -52,8 +80,82 @@ class PanelSectionImageEditor:
     bl_category = ADDON_CATEGORY
 
 
+def format_time_left(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return "{}m {}s".format(*divmod(seconds, 60))
+    hours, seconds = divmod(seconds, 3600)
+    return "{}h {}m".format(hours, seconds // 60)
+
+
+def draw_job_progress(layout, progress):
+    stats = progress.snapshot()
+    if stats["eta_seconds"] is None:
+        rate_text = "Measuring speed..."
+    else:
+        rate_text = "{} frames/min, {} left".format(
+            stats["frames_per_minute"], format_time_left(stats["eta_seconds"])
+        )
+    layout.label(text=rate_text, icon="TIME")
+    status_text = "{} in flight of {} concurrent".format(
+        stats["in_flight"], stats["concurrency"]
+    )
+    if stats["failed"]:
+        status_text += ", {} failed".format(stats["failed"])
+    layout.label(text=status_text)
+
+
+TILE_STATUS_ICONS = {
+    TileStatus.PENDING: "CHECKBOX_DEHLT",
+    TileStatus.RUNNING: "SORTTIME",
+    TileStatus.DONE: "CHECKBOX_HLT",
+    TileStatus.FAILED: "ERROR",
+}
+
+
+# One icon per tile, laid out like the tiles in the image.
+def draw_tile_progress(layout, progress: TileProgress):
+    statuses = progress.snapshot()
+    layout.label(
+        text="Tiles: {} / {} done".format(
+            statuses.count(TileStatus.DONE), len(statuses)
+        )
+    )
+    grid = layout.grid_flow(
+        row_major=True, columns=len(progress.layout.columns), align=True
+    )
+    for status in statuses:
+        grid.label(text="", icon=TILE_STATUS_ICONS[status])
+
+
+# How many textures of a batch job are done, and which ones are being generated or failed.
+def draw_batch_progress(layout, job: BatchTextureJob):
+    failed = [item for item in job.items if item.status == BatchStatus.FAILED]
+    summary = "Textures: {} / {} done".format(
+        job.count(BatchStatus.DONE), len(job.items)
+    )
+    if failed:
+        summary += ", {} failed".format(len(failed))
+    layout.label(text=summary, icon="MATERIAL")
+    for item in job.items:
+        if item.status == BatchStatus.RUNNING:
+            layout.label(text=item.image_name, icon="SORTTIME")
+    for item in failed:
+        layout.label(text="{}: {}".format(item.image_name, item.error), icon="ERROR")
+
+
 def draw_in_progress_view(layout, ui_context: UIContext):
     init_type = get_init_type()
+    if StateOperator.render_state == RenderState.PREVIEW:
+        layout.label(text="Preview ready. Generate at full quality?")
+        preview_row = layout.row()
+        preview_row.operator(
+            ContinueRenderOperator.bl_idname, text="Generate Full Quality"
+        )
+        preview_row.operator(CancelRenderOperator.bl_idname, text="Discard")
+        return
     state_text = (
         "Rendering..."
         if StateOperator.render_state == RenderState.RENDERING
@@ -72,6 +174,45 @@ def draw_in_progress_view(layout, ui_context: UIContext):
             StateOperator.current_frame_idx, StateOperator.total_frame_count
         )
     layout.label(text=state_text)
+    progress = StateOperator.job_progress
+    if init_type == InitType.ANIMATION and progress:
+        draw_job_progress(layout, progress)
+    tile_progress = StateOperator.tile_progress
+    if init_type != InitType.ANIMATION and tile_progress:
+        draw_tile_progress(layout, tile_progress)
+    plan = StateOperator.frame_plan
+    if init_type == InitType.ANIMATION and plan and plan.saved_api_calls:
+        layout.label(
+            text="Generating {} of {} frames ({} API calls saved)".format(
+                plan.api_call_count, len(plan.frames), plan.saved_api_calls
+            )
+        )
+    batch = StateOperator.batch_job
+    if batch:
+        draw_batch_progress(layout, batch)
+    coordinator = StateOperator.shard_coordinator
+    if coordinator:
+        for shard in coordinator.shards:
+            shard_text = "Frames {}-{}: {} / {} ({})".format(
+                shard.frame_start,
+                shard.frame_end,
+                shard.completed,
+                shard.total,
+                shard.status.name.lower(),
+            )
+            layout.label(
+                text=shard_text,
+                icon="ERROR" if shard.status == ShardStatus.FAILED else "NONE",
+            )
+            if shard.error:
+                layout.label(text=shard.error)
+    budget = StateOperator.credit_budget
+    if budget and budget.limit is not None:
+        layout.label(
+            text="Spent: {} / {} credits".format(
+                round(budget.spent, 2), round(budget.limit, 2)
+            )
+        )
     cancel_text = (
         "Cancel Render"
         if StateOperator.render_state == RenderState.RENDERING
@@ -217,7 +358,27 @@ TITLES = {
 }
 
 
+def draw_resume_row(layout):
+    paused_job = StateOperator.paused_job
+    resume_row = layout.row()
+    resume_row.label(
+        text="Paused: {} / {} frames, {} credits spent".format(
+            len(paused_job.completed_frames),
+            paused_job.total_frames,
+            round(paused_job.spent_credits, 2),
+        ),
+        icon="PAUSE",
+    )
+    resume_row.operator(ResumeJobOperator.bl_idname, text="Resume", icon="PLAY")
+
+
 def draw_dream_row(layout, settings, scene, ui_context: UIContext):
+    if (
+        StateOperator.paused_job
+        and ui_context == UIContext.SCENE_VIEW
+        and get_init_type() == InitType.ANIMATION
+    ):
+        draw_resume_row(layout)
     dream_row = layout.row()
     dream_row.scale_y = 2.0
     valid = render_validation(layout, settings, scene, ui_context)
@@ -241,6 +402,13 @@ def draw_dream_row(layout, settings, scene, ui_context: UIContext):
             SceneRenderExistingOutputOperator.bl_idname, text=TITLES[init_type.value]
         )
         render_col.enabled = valid == ValidationState.VALID
+        if init_type == InitType.ANIMATION and settings.shard_count > 1:
+            shard_row = layout.row()
+            shard_row.operator(
+                ShardedRenderOperator.bl_idname,
+                text="Dream ({} Background Processes)".format(settings.shard_count),
+            )
+            shard_row.enabled = valid == ValidationState.VALID
 
 
 # Validation messages should be no longer than 50 chars or so.
@@ -249,14 +417,29 @@ def validate_settings(
 ) -> tuple[ValidationState, str]:
     width, height = get_init_image_dimensions(settings, scene)
     prompts = scene.prompt_list
-    # cannot be > 1 megapixel
+    # cannot be > 1 megapixel, unless a single image is generated as tiles
     init_type = get_init_type()
-    if init_type != InitType.TEXT:
-        if width * height > 1_000_000:
+    if init_type != InitType.TEXT and needs_tiling(width, height):
+        if init_type == InitType.ANIMATION:
             return (
                 ValidationState.RENDER_SETTINGS,
                 "Init image size cannot be greater than 1 megapixel.",
             )
+        if not settings.use_tiled_generation:
+            return (
+                ValidationState.DS_SETTINGS,
+                "Enable Tiled Generation for images over 1 megapixel.",
+            )
+        if not has_pillow():
+            return (
+                ValidationState.DS_SETTINGS,
+                "Tiled generation needs Pillow. Reinstall dependencies.",
+            )
+        if not get_tile_layout(settings, scene).is_supported:
+            return (
+                ValidationState.RENDER_SETTINGS,
+                f"Both image sides must be {MIN_TILE_SIDE}px or more to tile.",
+            )
 
     if not prompts or len(prompts) < 1:
         return False, "Press 'Add' to add a prompt to the list."
@@ -278,6 +461,23 @@ def validate_settings(
 
     if init_type == InitType.ANIMATION:
 
+        compares_frames = (
+            KeyframeMode[settings.keyframe_mode] != KeyframeMode.ALL
+            or settings.skip_duplicate_frames
+        )
+        if compares_frames and not has_pillow():
+            return (
+                ValidationState.DS_SETTINGS,
+                "Comparing frames needs Pillow. Reinstall dependencies.",
+            )
+        if render_file_type in EXR_RENDER_FILE_TYPES and not (
+            has_pillow() and has_openexr()
+        ):
+            return (
+                ValidationState.DS_SETTINGS,
+                "Reading EXR frames needs OpenEXR. Reinstall dependencies.",
+            )
+
         init_img_paths, render_dir = get_anim_images()
 
         # filepath is a directory in this case
@@ -291,6 +491,12 @@ def validate_settings(
                 ValidationState.RENDER_SETTINGS,
                 "No images found in input directory with the set file type.",
             )
+        if FrameSelection[settings.frame_selection] == FrameSelection.CUSTOM:
+            try:
+                if not parse_frame_list(settings.frame_list):
+                    return ValidationState.DS_SETTINGS, "The frame list is empty."
+            except ValueError:
+                return ValidationState.DS_SETTINGS, "The frame list is invalid."
 
     for p in prompts:
         if not p or p.prompt == "":
@@ -302,14 +508,38 @@ def validate_settings(
     return ValidationState.VALID, ""
 
 
+# How many init frames the animation's frame selection covers. Which frames failed isn't known until the
+# job starts, so retrying them is estimated as the whole scene range.
+def selected_frame_count(settings, scene) -> int:
+    frame_index = get_anim_frame_index()
+    selection = FrameSelection[settings.frame_selection]
+    if selection == FrameSelection.FAILED or (
+        selection == FrameSelection.SCENE_RANGE and settings.frame_selection_stride == 1
+    ):
+        return frame_index.count_in_range(scene.frame_start, scene.frame_end)
+    return len(get_anim_frame_selection(scene, frame_index)[0])
+
+
 def credit_estimate(settings, scene, init_type: InitType):
     width, height = get_init_image_dimensions(settings, scene)
-    pixels = width * height
-    steps = int(settings.steps)
-    credit_estimate = (pixels - 169527) * steps / 30 * 2.16e-08
+    credit_estimate = estimate_frame_credits(width, height, int(settings.steps))
+    tile_layout = get_tile_layout(settings, scene)
+    if init_type in (InitType.TEXTURE, InitType.VIEWPORT) and tile_layout:
+        credit_estimate = tile_layout.count * estimate_frame_credits(
+            tile_layout.tile_width, tile_layout.tile_height, int(settings.steps)
+        )
+    elif (
+        init_type in (InitType.TEXTURE, InitType.VIEWPORT)
+        and settings.use_preview_generation
+    ):
+        credit_estimate += estimate_preview_credits(width, height, int(settings.steps))
     if init_type == InitType.ANIMATION:
-        credit_estimate *= len(get_anim_images()[0])
-    return round(credit_estimate * 100, 2)
+        credit_estimate *= estimate_api_calls(
+            selected_frame_count(settings, scene),
+            KeyframeMode[settings.keyframe_mode],
+            settings.keyframe_stride,
+        )
+    return round(credit_estimate, 2)
 
 
 def render_validation(layout, settings, scene, ui_context: UIContext):
@@ -328,9 +558,36 @@ def render_validation(layout, settings, scene, ui_context: UIContext):
         else:
             cost = credit_estimate(settings, scene, init_type)
             layout.label(text=f"Ready! Cost: {cost} credits.", icon="CHECKMARK")
+            credit_limit = get_credit_limit(settings, StateOperator.account)
+            if credit_limit is not None and cost > credit_limit:
+                layout.label(
+                    text=f"Over the {round(credit_limit, 2)} credit limit, the job will pause.",
+                    icon="INFO",
+                )
+            if init_type == InitType.ANIMATION:
+                draw_frame_index_warnings(layout)
     return valid_state
 
 
+# Gaps and duplicate frame numbers in the init animation folder.
+def draw_frame_index_warnings(layout):
+    frame_index = get_anim_frame_index()
+    if frame_index.gaps:
+        layout.label(
+            text="{} frames missing, first at {}.".format(
+                frame_index.missing_frame_count, frame_index.gaps[0][0]
+            ),
+            icon="INFO",
+        )
+    if frame_index.duplicates:
+        layout.label(
+            text="{} frame numbers used by more than one file.".format(
+                len(frame_index.duplicates)
+            ),
+            icon="INFO",
+        )
+
+
 # Individual panel sections are added by setting bl_parent_id
 
 # Blender requires that we register a different panel type for each UI section -
@@ -375,6 +632,144 @@ class AdvancedOptionsPanelSectionImageEditor(PanelSectionImageEditor, Panel):
         draw_advanced_options_panel(self, context)
 
 
+class PerformancePanelSection3DEditor(PanelSection3D, Panel):
+
+    bl_parent_id = Stability3DPanel.bl_idname
+    bl_label = "Performance"
+    bl_options = {"DEFAULT_CLOSED"}
+
+    def draw(self, context):
+        draw_performance_panel(self, context)
+
+
+class PerformancePanelSectionImageEditor(PanelSectionImageEditor, Panel):
+
+    bl_parent_id = StabilityImageEditorPanel.bl_idname
+    bl_label = "Performance"
+    bl_options = {"DEFAULT_CLOSED"}
+
+    def draw(self, context):
+        draw_performance_panel(self, context)
+
+
+class HistoryPanelSection3DEditor(PanelSection3D, Panel):
+
+    bl_parent_id = Stability3DPanel.bl_idname
+    bl_label = "History"
+    bl_options = {"DEFAULT_CLOSED"}
+
+    def draw(self, context):
+        draw_history_panel(self, context)
+
+
+class HistoryPanelSectionImageEditor(PanelSectionImageEditor, Panel):
+
+    bl_parent_id = StabilityImageEditorPanel.bl_idname
+    bl_label = "History"
+    bl_options = {"DEFAULT_CLOSED"}
+
+    def draw(self, context):
+        draw_history_panel(self, context)
+
+
+# A page of past generations, newest first, with a thumbnail and an open button for each.
+def draw_history_panel(self, context):
+    layout = self.layout
+    settings = context.scene.ds_settings
+    if StateOperator.render_state == RenderState.ONBOARDING:
+        return
+    search_row = layout.row(align=True)
+    search_row.prop(settings, "history_search", text="", icon="VIEWZOOM")
+    search_row.prop(settings, "history_filter", text="")
+
+    history = open_history()
+    if not history:
+        layout.label(text="The history could not be opened.", icon="ERROR")
+        return
+    search = settings.history_search
+    kind = get_history_filter(settings)
+    entries, total = history_gallery.get_page(
+        history, search, kind, settings.history_page
+    )
+    if not total:
+        layout.label(text="No generations found.")
+        return
+    page_count = (total + GALLERY_PAGE_SIZE - 1) // GALLERY_PAGE_SIZE
+    page = min(settings.history_page, page_count - 1)
+    if page != settings.history_page:
+        # The page was past the end of a smaller result, show the last one.
+        entries, total = history_gallery.get_page(history, search, kind, page)
+
+    grid = layout.grid_flow(
+        row_major=True, columns=GALLERY_COLUMNS, even_columns=True, align=True
+    )
+    for entry in entries:
+        col = grid.column(align=True)
+        icon = history_gallery.thumbnail_icon(entry)
+        if icon:
+            col.template_icon(icon_value=icon, scale=5)
+        else:
+            col.label(text="Removed", icon="FILE_BROKEN")
+        title = entry.prompt or "(no prompt)"
+        if entry.frame is not None:
+            title = "{}: {}".format(entry.frame, title)
+        open_op = col.operator(
+            OpenHistoryEntryOperator.bl_idname, text=title[:24], emboss=False
+        )
+        open_op.entry_id = entry.id
+
+    page_row = layout.row(align=True)
+    prev_col = page_row.column(align=True)
+    prev_col.enabled = page > 0
+    prev_col.operator(HistoryPageOperator.bl_idname, text="", icon="TRIA_LEFT").step = (
+        -1
+    )
+    page_row.label(text="Page {} / {} ({} results)".format(page + 1, page_count, total))
+    next_col = page_row.column(align=True)
+    next_col.enabled = page + 1 < page_count
+    next_col.operator(
+        HistoryPageOperator.bl_idname, text="", icon="TRIA_RIGHT"
+    ).step = 1
+
+
+# Memory held by the addon's images, and the p50 / p95 latency of each phase of the current or last
+# generation job.
+def draw_performance_panel(self, context):
+    layout = self.layout
+    if StateOperator.render_state == RenderState.ONBOARDING:
+        return
+
+    image_count, image_bytes = get_addon_image_memory()
+    images_row = layout.row()
+    images_row.label(
+        text="Images: {} ({} MB)".format(image_count, round(image_bytes / 2**20, 1)),
+        icon="IMAGE_DATA",
+    )
+    images_row.operator(FreeUnusedImagesOperator.bl_idname, text="Free Unused")
+    layout.operator(BenchmarkResultLoadingOperator.bl_idname, icon="TIME")
+
+    summary = get_job_metrics().summary()
+    if not summary:
+        layout.label(text="No timings recorded yet.")
+        return
+
+    grid = layout.grid_flow(row_major=True, columns=4, even_columns=True)
+    for heading in ("Phase", "Count", "p50", "p95"):
+        grid.label(text=heading)
+    for phase, count, p50, p95 in summary:
+        grid.label(text=PHASE_LABELS[phase])
+        grid.label(text=str(count))
+        grid.label(text=format_duration(p50))
+        grid.label(text=format_duration(p95))
+    layout.operator(ExportTimingsOperator.bl_idname, icon="EXPORT")
+
+
+def format_duration(milliseconds: float) -> str:
+    if milliseconds >= 1000:
+        return "{}s".format(round(milliseconds / 1000, 2))
+    return "{}ms".format(round(milliseconds, 1))
+
+
 def draw_advanced_options_panel(self, context):
     layout = self.layout
     settings = context.scene.ds_settings
@@ -396,6 +791,12 @@ def draw_advanced_options_panel(self, context):
         "use_recommended_settings",
     )
 
+    budget_row = layout.row()
+    budget_row.prop(settings, "use_credit_budget")
+    budget_input_row = budget_row.row()
+    budget_input_row.enabled = settings.use_credit_budget
+    budget_input_row.prop(settings, "credit_budget")
+
     steps_row = layout.row()
     steps_row.prop(settings, "steps", text="Steps")
     steps_row.enabled = not use_recommended
@@ -442,10 +843,68 @@ def draw_render_options_panel(self, context, ui_context: UIContext):
                 text="Select 'Render Result' above to use a rendered frame. Render first!"
             )
 
+    # Only image jobs send a preview first.
+    if init_type in (InitType.TEXTURE, InitType.VIEWPORT):
+        tile_layout = get_tile_layout(settings, context.scene)
+        preview_row = layout.row()
+        # Tiled images are generated without a preview.
+        preview_row.enabled = not tile_layout
+        preview_row.prop(settings, "use_preview_generation")
+        auto_continue_col = preview_row.column()
+        auto_continue_col.enabled = settings.use_preview_generation
+        auto_continue_col.prop(settings, "preview_auto_continue")
+
+    if init_type in (InitType.TEXTURE, InitType.VIEWPORT):
+        layout.prop(settings, "use_tiled_generation")
+        if settings.use_tiled_generation:
+            tile_row = layout.row()
+            tile_row.prop(settings, "tile_size")
+            tile_row.prop(settings, "tile_overlap")
+            if tile_layout:
+                layout.label(
+                    text="{} tiles of {}x{}".format(
+                        tile_layout.count,
+                        tile_layout.tile_width,
+                        tile_layout.tile_height,
+                    ),
+                    icon="MESH_GRID",
+                )
+        if settings.use_tiled_generation or init_type == InitType.TEXTURE:
+            layout.prop(settings, "max_concurrent_requests")
+        if init_type == InitType.TEXTURE:
+            layout.operator(BatchTextureOperator.bl_idname, icon="MATERIAL")
+
     if init_type == InitType.ANIMATION:
         init_folder_row = layout.row()
         init_folder_row.prop(settings, "init_animation_folder_path")
         init_folder_row.operator(UseRenderFolderOperator.bl_idname)
+        frame_selection = FrameSelection[settings.frame_selection]
+        layout.prop(settings, "frame_selection")
+        if frame_selection == FrameSelection.CUSTOM:
+            layout.prop(settings, "frame_list")
+        if frame_selection != FrameSelection.FAILED:
+            layout.prop(settings, "frame_selection_stride")
+        layout.prop(settings, "max_concurrent_requests")
+        layout.prop(settings, "shard_count")
+        layout.prop(settings, "incremental_generation")
+        layout.prop(settings, "show_live_preview")
+        layout.prop(settings, "video_output")
+        if VideoOutput[settings.video_output] != VideoOutput.NONE and not find_ffmpeg():
+            layout.label(
+                text="ffmpeg not found, no video will be written.", icon="INFO"
+            )
+        keyframe_mode = KeyframeMode[settings.keyframe_mode]
+        layout.prop(settings, "keyframe_mode")
+        if keyframe_mode != KeyframeMode.ALL:
+            layout.prop(settings, "keyframe_stride")
+            if keyframe_mode == KeyframeMode.ADAPTIVE:
+                layout.prop(settings, "keyframe_change_threshold")
+            layout.prop(settings, "interpolation_guidance")
+        duplicates_row = layout.row()
+        duplicates_row.prop(settings, "skip_duplicate_frames")
+        tolerance_col = duplicates_row.column()
+        tolerance_col.enabled = settings.skip_duplicate_frames
+        tolerance_col.prop(settings, "duplicate_frame_tolerance", text="Tolerance")
 
     use_resolution_label = "Use Render Resolution"
     if ui_context == UIContext.IMAGE_EDITOR:
@@ -0,0 +1,233 @@
+from enum import Enum
+from functools import lru_cache
+import heapq
+import os
+import queue
+import shutil
+import subprocess
+import threading
+from typing import Dict, List, Optional
+
+VIDEO_BASENAME = "animation"
+# Same size as directory_to_gif.sh. GIFs are never scaled up.
+GIF_WIDTH = 480
+
+
+# Which videos are assembled from the frames of an animation job.
+class VideoOutput(Enum):
+    NONE = 1
+    MP4 = 2
+    GIF = 3
+    MP4_AND_GIF = 4
+
+
+# Cached, since the UI checks for it on every redraw.
+@lru_cache(maxsize=1)
+def find_ffmpeg() -> Optional[str]:
+    return shutil.which("ffmpeg")
+
+
+# Encoder args per container. Frames come in as PNGs on stdin.
+def ffmpeg_output_args(extension: str, fps: float) -> List[str]:
+    if extension == "mp4":
+        return [
+            "-c:v",
+            "libx264",
+            "-pix_fmt",
+            "yuv420p",
+            "-crf",
+            "18",
+            # x264 needs even dimensions.
+            "-vf",
+            "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+            "-movflags",
+            "+faststart",
+        ]
+    # A palette generated from every frame, as in directory_to_gif.sh, but in a single pass.
+    return [
+        "-vf",
+        f"fps={fps},scale='min({GIF_WIDTH},iw)':-1:flags=lanczos,split[a][b];"
+        "[a]palettegen=stats_mode=diff[p];[b][p]paletteuse=dither=bayer:diff_mode=rectangle",
+        "-loop",
+        "0",
+    ]
+
+
+# One ffmpeg process encoding the frames it is fed on stdin into a video file.
+class VideoEncoder:
+    def __init__(self, ffmpeg_path: str, output_path: str, fps: float):
+        self.output_path = output_path
+        self.error: Optional[str] = None
+        extension = os.path.splitext(output_path)[1].lstrip(".")
+        command = [
+            ffmpeg_path,
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "image2pipe",
+            "-framerate",
+            str(fps),
+            "-c:v",
+            "png",
+            "-i",
+            "-",
+            *ffmpeg_output_args(extension, fps),
+            output_path,
+        ]
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+
+    def write(self, data: bytes):
+        if self.error:
+            return
+        try:
+            self.process.stdin.write(data)
+        except (BrokenPipeError, OSError) as e:
+            self.error = f"ffmpeg stopped accepting frames: {e}"
+
+    def close(self) -> bool:
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        stderr = self.process.stderr.read()
+        self.process.wait()
+        if self.process.returncode != 0 and not self.error:
+            self.error = stderr.decode("utf-8", "replace").strip() or (
+                f"ffmpeg exited with code {self.process.returncode}"
+            )
+        return not self.error
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+
+# Holds frames that complete out of order until every frame before them is done.
+class FrameReorderBuffer:
+    def __init__(self, frame_order: List[int]):
+        # frame index -> position in the video
+        self.positions = {index: position for position, index in enumerate(frame_order)}
+        self.position = 0
+        self.pending = []
+
+    # Add a completed frame, and return the frames that are now ready, in order.
+    def push(self, index: int, path: str) -> List[str]:
+        heapq.heappush(self.pending, (self.positions[index], path))
+        return self.pop_ready()
+
+    def pop_ready(self) -> List[str]:
+        ready = []
+        while self.pending and self.pending[0][0] <= self.position:
+            position, path = heapq.heappop(self.pending)
+            if position == self.position:
+                self.position += 1
+                ready.append(path)
+        return ready
+
+    # Everything still buffered, in order, skipping the frames that never completed.
+    def drain(self) -> List[str]:
+        ready = []
+        while self.pending:
+            position, path = heapq.heappop(self.pending)
+            if position >= self.position:
+                self.position = position + 1
+                ready.append(path)
+        return ready
+
+
+# Streams the frames of an animation job into ffmpeg while the job runs. Frames are added as they complete,
+# in any order, and are encoded in frame order from a background thread, so the videos are done soon after
+# the last frame.
+class VideoAssembler:
+    def __init__(
+        self,
+        output_directory: str,
+        frame_order: List[int],
+        video_output: VideoOutput,
+        fps: float,
+        ffmpeg_path: str,
+    ):
+        extensions = {
+            VideoOutput.MP4: ["mp4"],
+            VideoOutput.GIF: ["gif"],
+            VideoOutput.MP4_AND_GIF: ["mp4", "gif"],
+        }[video_output]
+        self.output_paths = [
+            os.path.join(output_directory, f"{VIDEO_BASENAME}.{ext}")
+            for ext in extensions
+        ]
+        self.buffer = FrameReorderBuffer(frame_order)
+        self.fps = fps
+        self.ffmpeg_path = ffmpeg_path
+        self.encoders: List[VideoEncoder] = []
+        self.frames = queue.Queue()
+        self.written_frames = 0
+        self.thread = threading.Thread(
+            target=self.run, name="video-assembler", daemon=True
+        )
+
+    # Start assembling, unless no video is wanted or ffmpeg isn't installed, in which case this returns None.
+    @classmethod
+    def start(
+        cls,
+        output_directory: str,
+        frame_order: List[int],
+        video_output: VideoOutput,
+        fps: float,
+    ):
+        if video_output == VideoOutput.NONE:
+            return None
+        ffmpeg_path = find_ffmpeg()
+        if not ffmpeg_path:
+            print("ffmpeg was not found on the PATH, skipping video output.")
+            return None
+        assembler = cls(output_directory, frame_order, video_output, fps, ffmpeg_path)
+        assembler.encoders = [
+            VideoEncoder(ffmpeg_path, path, fps) for path in assembler.output_paths
+        ]
+        assembler.thread.start()
+        return assembler
+
+    # Called from the generation threads as each frame's output is written.
+    def add_frame(self, index: int, path: str):
+        self.frames.put((index, path))
+
+    def write_frames(self, paths: List[str]):
+        for path in paths:
+            with open(path, "rb") as f:
+                data = f.read()
+            for encoder in self.encoders:
+                encoder.write(data)
+            self.written_frames += 1
+
+    def run(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            self.write_frames(self.buffer.push(*item))
+        self.write_frames(self.buffer.drain())
+
+    # Encode the rest of the frames and wait for ffmpeg. Returns the error of each video by path, None if it
+    # was written.
+    def finish(self) -> Dict[str, Optional[str]]:
+        self.frames.put(None)
+        self.thread.join()
+        results = {}
+        for encoder in self.encoders:
+            results[encoder.output_path] = None if encoder.close() else encoder.error
+        return results
+
+    # Stop without finishing the videos, and remove what was written of them.
+    def cancel(self):
+        self.frames.put(None)
+        for encoder in self.encoders:
+            encoder.kill()